@@ -3,10 +3,23 @@ from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
 from typing import Optional, List
 from fastapi.middleware.cors import CORSMiddleware
-from processMigrations import add_to_queue, process_queue
+from processMigrations import add_to_queue, MigrationScheduler, FETCH_CONCURRENCY, POST_CONCURRENCY
+from jobQueue import create_job_queue
+from migrationJournal import prune_journals
+from imageWorkers import image_workers
+from blobCache import blob_cache
+from blueskySessions import bsky_sessions
+from notifyOutbox import notify_outbox
+from progressBus import progress_bus
+import metrics
+import time
+from datetime import datetime, timezone
 from bluesky import resolve_did
+from didCache import did_cache, DID_RESOLUTION
+from twitterArchive import save_archive, archive_path, prune_archives, prune_archives_periodically, ArchiveError, ArchiveStorageFull, ARCHIVE_MAX_BYTES
+from twitter import sessions as twitter_sessions, timeline_cache
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 # Initialize the FastAPI app
 app = FastAPI()
@@ -19,8 +32,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Define a global task queue
-queue = asyncio.Queue()
+# Define a global task queue (persistent, survives restarts)
+queue = create_job_queue()
+# Fetch workers: one per Twitter session unless FETCH_CONCURRENCY says otherwise
+scheduler = MigrationScheduler(queue, FETCH_CONCURRENCY or len(twitter_sessions.sessions), POST_CONCURRENCY)
+# Housekeeping that runs for as long as the server does
+background_tasks = []
 
 # Request model
 class MigrationRequest(BaseModel):
@@ -30,59 +47,141 @@ class MigrationRequest(BaseModel):
     password: str
     limit: Optional[int] = 800  # Default limit
     threadUrls: Optional[List[str]] = None
+    archiveId: Optional[str] = None  # From POST /archives, instead of fetching the timeline
 
 @app.post("/posts")
 async def enqueue_posts_migration(request: MigrationRequest):
-    # Resolve DID
-    did = await resolve_did(request.bskyHandle)
-
     # Validate input
-    if not request.twitterName and not request.threadUrls:
+    if not request.twitterName and not request.threadUrls and not request.archiveId:
         raise HTTPException(
             status_code=400,
-            detail="Either 'twitterName' or 'threadUrls' must be provided.",
+            detail="Either 'twitterName', 'threadUrls' or 'archiveId' must be provided.",
         )
+    if request.archiveId and not archive_path(request.archiveId):
+        raise HTTPException(status_code=404, detail="Unknown Twitter archive; upload it again.")
+
+    # Resolve DID (cached, see didCache.py); with DID_RESOLUTION=worker the migration resolves it when it starts
+    did = None
+    if DID_RESOLUTION != "worker":
+        did = await resolve_did(request.bskyHandle)
+        if not did:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Could not resolve the Bluesky handle '{request.bskyHandle}'.",
+            )
 
     # Determine task type and add to queue
     task_data = request.model_dump()
     task_data.update({"did": did, "task_type": "posts"})
-    await add_to_queue(queue, task_data)
+    job_id = await add_to_queue(queue, task_data)
+    position = await queue.position(job_id)
 
+    source = request.twitterName or ("the uploaded archive" if request.archiveId else "threads")
     return {
-        "message": f"Migration task for {request.twitterName or 'threads'} (DID: {did}) has been queued.",
+        "message": f"Migration task for {source}{f' (DID: {did})' if did else ''} has been queued.",
         "success": True,
+        "queue_position": position,
     }
 
+@app.post("/archives")
+async def upload_twitter_archive(request: Request):
+    """Twitter archive ZIP as the raw request body, streamed to disk; migrate it with the returned archiveId"""
+    expected_bytes = int(request.headers.get("content-length") or 0)
+    if expected_bytes > ARCHIVE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Archive too large.")
+    try:
+        archive_id, summary = await save_archive(request.stream(), expected_bytes=expected_bytes)
+    except ArchiveStorageFull as e:
+        raise HTTPException(status_code=507, detail=str(e))
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "archiveId": archive_id, **summary}
+
 @app.on_event("startup")
 async def start_queue_processors():
-    """Start multiple queue processors for concurrent migration processing"""
-    num_processors = 2  # Start with 2 processors for conservative concurrency
+    """Start the fetch and post worker pools"""
+    # Journals only matter while a migration can still be retried
+    prune_journals()
+    prune_archives()
+    background_tasks.append(asyncio.create_task(prune_archives_periodically()))
+    await blob_cache.prune()
 
-    print(f"Starting {num_processors} queue processors for concurrent migrations")
+    # Deliver status notifications left over from before a restart
+    notify_outbox.start()
 
-    for i in range(num_processors):
-        processor_name = f"processor-{i+1}"
-        asyncio.create_task(process_queue(queue, processor_name))
+    # Live progress for /migrations/{id}/events
+    progress_bus.attach(queue, scheduler.post.workers)
 
+    print(f"Starting {scheduler.fetch.workers} fetch and {scheduler.post.workers} post workers for concurrent migrations")
+    scheduler.start()
     print("All queue processors started successfully")
 
+@app.on_event("shutdown")
+async def stop_queue_processors():
+    """Hand in-flight jobs back to the queue before the process exits"""
+    for task in background_tasks:
+        task.cancel()
+    await scheduler.stop()
+    await queue.close()
+    await notify_outbox.close()
+    await timeline_cache.close()
+    await blob_cache.close()
+    await bsky_sessions.close()
+    image_workers.shutdown()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint to monitor system status"""
+    processors_running = scheduler.running()
+    healthy_sessions = sum(1 for session in twitter_sessions.sessions if session.healthy)
+    # Degraded: migrations can't make progress until a processor or Twitter session is back
+    degraded = processors_running < len(scheduler.tasks) or healthy_sessions == 0
     return {
-        "status": "healthy",
-        "timestamp": "2024-01-01T00:00:00Z",  # Would be dynamic in production
+        "status": "degraded" if degraded else "healthy",
+        "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "uptime_seconds": round(time.time() - metrics.STARTED_AT),
         "version": "2.0.0-optimized",
-        "features": [
-            "ultra_conservative_rate_limiting",
-            "parallel_image_processing",
-            "multiple_queue_processors",
-            "connection_pooling",
-            "batch_operations",
-            "error_recovery"
-        ]
+        "queue_depth": await queue.size(),
+        "processors_running": processors_running,
+        "stages": scheduler.status(),
+        "twitter_sessions_healthy": healthy_sessions,
+        "twitter_sessions_total": len(twitter_sessions.sessions),
+        "image_workers": image_workers.stats(),
+        "progress": progress_bus.stats(),
+        "did_cache": did_cache.stats(),
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Operational metrics in the Prometheus text format"""
+    metrics.QUEUE_DEPTH.set(await queue.size())
+    for stage, status in scheduler.status().items():
+        if isinstance(status, dict):
+            metrics.STAGE_ACTIVE.labels(stage).set(status["active"])
+            metrics.STAGE_UTILIZATION.labels(stage).set(status["utilization"])
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/twitter/sessions")
+async def twitter_session_status():
+    """Per-session health, quarantine state, call metrics and rate limit budgets"""
+    return twitter_sessions.status()
+
+@app.get("/migrations/{migration_id}/events")
+async def migration_events(migration_id: str):
+    """Server-Sent Events: stage, queue position, posts/sec and ETA until the migration ends"""
+    if not await progress_bus.exists(migration_id):
+        raise HTTPException(status_code=404, detail="Unknown migration")
+    return StreamingResponse(
+        progress_bus.subscribe(migration_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/notifications")
+async def notification_status():
+    """Status notification outbox: pending, delivered and failed deliveries"""
+    return await notify_outbox.stats()
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     print("Error:", exc.errors())
@@ -0,0 +1,176 @@
+"""
+BATCHED BLUESKY POSTING ENGINE
+================================
+- Record keys (TIDs) are assigned locally
+- Record CIDs are computed client-side (DAG-CBOR + sha256), so reply
+  root/parent strong refs inside a thread are known before the server replies.
+  The PDS is sent the exact JSON that was hashed and stores it as DAG-CBOR
+  unchanged, so its CID is the same one
+- Posts are written many at a time with com.atproto.repo.applyWrites
+- Rate limiter points are charged per write operation, as the PDS does
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import libipld
+from atproto import models
+from atproto_client.exceptions import BadRequestError
+
+from rateLimiter import ACTION_POINTS
+
+POST_COLLECTION = "app.bsky.feed.post"
+APPLY_WRITES_BATCH_SIZE = int(os.getenv("APPLY_WRITES_BATCH_SIZE", "25"))
+MAX_APPLY_WRITES = 200  # Hard limit of writes per applyWrites call on the PDS
+
+_TID_ALPHABET = "234567abcdefghijklmnopqrstuvwxyz"
+_tid_lock = threading.Lock()
+_last_tid_timestamp = 0
+_clock_id = int.from_bytes(os.urandom(2), "big") & 0x3FF
+
+
+def next_tid() -> str:
+    """Generate a timestamp identifier (monotonic within this process)"""
+    global _last_tid_timestamp
+    with _tid_lock:
+        timestamp = max(time.time_ns() // 1000, _last_tid_timestamp + 1)
+        _last_tid_timestamp = timestamp
+    value = (timestamp << 10) | _clock_id
+    chars = []
+    for _ in range(13):
+        chars.append(_TID_ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def _to_ipld(value: Any) -> Any:
+    """Convert the JSON form of a record to its IPLD data model ({"$link": cid} -> CID)"""
+    if isinstance(value, dict):
+        if len(value) == 1 and "$link" in value:
+            _, cid_bytes = libipld.decode_multibase(value["$link"])
+            return cid_bytes
+        return {key: _to_ipld(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_ipld(item) for item in value]
+    return value
+
+
+def compute_record_cid(record: Dict[str, Any]) -> str:
+    """CIDv1 (dag-cbor, sha2-256) of a record in its JSON form"""
+    digest = hashlib.sha256(libipld.encode_dag_cbor(_to_ipld(record))).digest()
+    return libipld.encode_cid(bytes([0x01, 0x71, 0x12, 0x20]) + digest)
+
+
+def _invalid_record(e: BadRequestError) -> bool:
+    """A 400 for the records themselves (ExpiredToken and InvalidToken are 400s too, for the session)"""
+    content = getattr(e.response, "content", None)
+    return (getattr(content, "error", None) or "") not in ("ExpiredToken", "InvalidToken")
+
+
+class BatchPoster:
+    """
+    Collects post records and writes them with applyWrites.
+
+    add() returns the strong ref ({"uri", "cid"}) of the future post right
+    away; on_commit(tweet_id, ref, root) is called once the post is actually
+    stored, where root is the strong ref of its thread root.
+    """
+
+    def __init__(
+        self,
+        client,
+        did: str,
+        rate_limiter,
+        batch_size: int = APPLY_WRITES_BATCH_SIZE,
+        on_commit: Optional[Callable[[Any, Dict[str, str], Dict[str, str]], None]] = None,
+    ):
+        self.client = client
+        self.did = did
+        self.rate_limiter = rate_limiter
+        self.batch_size = max(1, min(batch_size, MAX_APPLY_WRITES))
+        self.on_commit = on_commit
+        self.pending: List[Dict[str, Any]] = []
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+
+    def add(self, record: models.AppBskyFeedPost.Record, tweet_id=None, root: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        rkey = next_tid()
+        value = models.get_model_as_dict(record)
+        ref = {
+            "uri": f"at://{self.did}/{POST_COLLECTION}/{rkey}",
+            "cid": compute_record_cid(value),
+        }
+        self.pending.append({"rkey": rkey, "value": value, "ref": ref, "tweet_id": tweet_id, "root": root or ref})
+        return ref
+
+    async def flush_if_full(self):
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending posts. On failure they stay pending so the caller can retry"""
+        if not self.pending:
+            return
+        batch = list(self.pending)
+
+        await self.rate_limiter.acquire(self.did, ACTION_POINTS["CREATE"] * len(batch))
+
+        writes = [
+            models.ComAtprotoRepoApplyWrites.Create(collection=POST_COLLECTION, rkey=op["rkey"], value=op["value"])
+            for op in batch
+        ]
+        try:
+            response = await self.client.com.atproto.repo.apply_writes(
+                models.ComAtprotoRepoApplyWrites.Data(repo=self.did, writes=writes)
+            )
+        except BadRequestError as e:
+            if _invalid_record(e):
+                # One invalid record rejects the whole batch: fall back to single writes
+                print(f"applyWrites rejected a batch of {len(batch)} posts ({e}); retrying individually")
+                self.pending = []
+                await self._write_individually(batch)
+                return
+            raise
+
+        self.pending = self.pending[len(batch):]
+        self.batches += 1
+        results = response.results or []
+        for i, op in enumerate(batch):
+            if i < len(results) and results[i].cid != op["ref"]["cid"]:
+                # Can't happen while the PDS stores the JSON it is sent (see above); replies in this batch
+                # already point at the local CID, so only the journal can be told the stored one
+                print(f"ERROR: the PDS stored {results[i].uri} with CID {results[i].cid}, not {op['ref']['cid']}; replies to it may not resolve")
+                op["ref"] = {"uri": results[i].uri, "cid": results[i].cid}
+            self._commit(op)
+
+    async def _write_individually(self, batch: List[Dict[str, Any]]):
+        """Only a post the PDS rejects as invalid is given up; on any other error the rest stays pending and it is raised"""
+        for i, op in enumerate(batch):
+            try:
+                resp = await self.client.com.atproto.repo.create_record(
+                    models.ComAtprotoRepoCreateRecord.Data(
+                        repo=self.did, collection=POST_COLLECTION, rkey=op["rkey"], record=op["value"]
+                    )
+                )
+            except BadRequestError as e:
+                if not _invalid_record(e):
+                    self.pending = batch[i:] + self.pending
+                    raise
+                self.failed += 1
+                print(f"Failed to create post {op['rkey']} (tweet {op['tweet_id']}): {e}")
+                continue
+            except Exception:
+                # Expired session, rate limit or network error: the caller recovers and flushes again
+                self.pending = batch[i:] + self.pending
+                raise
+            op["ref"] = {"uri": resp.uri, "cid": resp.cid}
+            self._commit(op)
+
+    def _commit(self, op: Dict[str, Any]):
+        self.committed += 1
+        if self.on_commit:
+            self.on_commit(op["tweet_id"], op["ref"], op["root"])
@@ -0,0 +1,6 @@
+"""
+Benchmarks for the migration backend.
+
+Run from the backend-python directory, e.g. `python -m bench.queueBench`;
+`python -m bench` runs the end-to-end suite on replayed Twitter traffic.
+"""
@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark suite: fetch and format a timeline from replayed Twitter
+traffic, prepare its images, and post it to the in-process fake PDS. Needs
+no cookies, accounts or network.
+
+Each timeline size runs in a fresh process (its own state files in a
+temporary directory, and a clean peak RSS, reported after the fetch and at
+the end) through three stages:
+
+- fetch: iter_user_threads plus the thread URLs of the fixture through
+  iter_threads, with twikit parsing replayed GraphQL responses, the pacer
+  reading their rate limit headers and 429s once a budget is spent
+- images: process_images_parallel over every media URL of the fetched threads
+- posts: migrateTweetsToBluesky on the fetched threads against the fake PDS
+  (image preparation and blob uploads included; the Bluesky rate limiter and
+  the per-migration post limit are lifted so the engine itself is measured)
+
+Twitter's 15-minute windows are compressed (--window) and latencies are
+scaled down by default so the suite fits in CI; pass the real values to see
+wall-clock figures.
+
+    python -m bench
+    python -m bench --sizes 800 --fixture bench/fixtures/someone
+    python -m bench --sizes 3200 --latency 0.3 --latency-p99 1.5 --window 900
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every state file the backend opens, kept inside the run's temporary directory
+STATE_ENV = {
+    "TWITTER_COOKIE_FILES": "cookies.json",
+    "TIMELINE_CACHE_PATH": "timelines.db",
+    "BLOB_CACHE_PATH": "blobs.db",
+    "JOURNAL_DIR": "journals",
+    "NOTIFY_OUTBOX_PATH": "notifications.db",
+    "BSKY_SESSION_PATH": "bsky_sessions.db",
+    "QUEUE_PATH": "migrations.db",
+    "SESSION_ENCRYPTION_KEY": "",
+}
+
+IMAGE_BATCH = 50
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def run_stages(args) -> dict:
+    from bench.latency import LatencyModel
+    from bench.twitterReplay import Cassette, ReplayTransport, install_replay
+    from bench.twitterFixtures import build_cassette
+    from bench.fakePds import FakePDS, make_client
+    from rateLimiter import AccountRateLimiter
+
+    import twitter
+    import bluesky
+    from imageWorkers import image_workers
+
+    cassette = Cassette.load(args.fixture) if args.fixture else build_cassette(args.tweets)
+    options = {
+        "latency": LatencyModel(args.latency, args.latency_p99),
+        "media_latency": LatencyModel(args.media_latency, args.media_latency * 4),
+        "window": args.window,
+    }
+    transports = install_replay(twitter.sessions, cassette, **options)
+    result = {"tweets_requested": args.tweets}
+
+    # 1. Fetch and format
+    migrating = set()
+    threads = []
+    started = time.perf_counter()
+    async for thread in twitter.iter_user_threads(cassette.meta["screen_name"], args.tweets, migrating):
+        threads.append(thread)
+    async for thread in twitter.iter_threads(cassette.meta.get("thread_urls") or [], migrating):
+        threads.append(thread)
+    elapsed = time.perf_counter() - started
+    tweets = sum(len(thread) for thread in threads)
+    result.update({
+        "tweets": tweets,
+        "threads": len(threads),
+        "fetch_seconds": elapsed,
+        "fetch_tweets_per_sec": tweets / elapsed,
+        "twitter_requests": sum(t.requests for t in transports),
+        "twitter_429s": sum(t.rate_limited for t in transports),
+        "twitter_misses": sum(t.misses for t in transports),
+        "fetch_rss_mb": peak_rss_mb(),
+    })
+
+    # 2. Images, in batches so the prepared bytes do not pile up
+    media_client = bluesky.http_client_pool = httpx.AsyncClient(transport=ReplayTransport(cassette, **options))
+    urls = [url for thread in threads for tweet in thread for url in tweet.get("media_urls") or []]
+    images = 0
+    started = time.perf_counter()
+    for i in range(0, len(urls), IMAGE_BATCH):
+        images += len(await bluesky.process_images_parallel(media_client, "did:plc:bench", urls[i:i + IMAGE_BATCH]))
+    elapsed = time.perf_counter() - started
+    result.update({
+        "images": images,
+        "image_failures": len(urls) - images,
+        "images_per_sec": images / elapsed if elapsed else 0.0,
+    })
+
+    # 3. Posting
+    pds = FakePDS(latency=args.pds_latency, hourly_points=None, daily_points=None)
+
+    async def fake_login(handle, password, *rest):
+        client = make_client(pds)
+        await client.login(handle, password)
+        return client
+
+    bluesky.login = fake_login
+    bluesky.rate_limiter = AccountRateLimiter(hourly_limit=10**9, daily_limit=10**9)
+    bluesky.POST_LIMIT = 10**9
+    started = time.perf_counter()
+    await bluesky.migrateTweetsToBluesky(threads, "bench.test", "password", None, f"bench-{args.tweets}", resume=False)
+    elapsed = time.perf_counter() - started
+    posts = sum(1 for uri in pds.records if "/app.bsky.feed.post/" in uri)
+    result.update({
+        "posts": posts,
+        "posts_per_sec": posts / elapsed,
+        "pds_requests": pds.requests,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+    await media_client.aclose()
+    await twitter.timeline_cache.close()
+    image_workers.shutdown()
+    return result
+
+
+def run_child(args):
+    result = asyncio.run(run_stages(args))
+    print("RESULT " + json.dumps(result), flush=True)
+
+
+def run_size(tweets: int, args) -> dict:
+    """Run one timeline size in a child process inside a temporary directory"""
+    from bench.twitterReplay import write_replay_cookies
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        write_replay_cookies(os.path.join(workdir, STATE_ENV["TWITTER_COOKIE_FILES"]))
+        env = {**os.environ, **STATE_ENV, "PYTHONPATH": os.pathsep.join(filter(None, [BACKEND_DIR, os.getenv("PYTHONPATH")]))}
+        command = [
+            sys.executable, "-m", "bench", "--child", "--sizes", str(tweets),
+            "--latency", str(args.latency), "--latency-p99", str(args.latency_p99),
+            "--media-latency", str(args.media_latency), "--pds-latency", str(args.pds_latency),
+            "--window", str(args.window),
+        ]
+        if args.fixture:
+            command += ["--fixture", os.path.abspath(args.fixture)]
+        process = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+
+    lines = process.stdout.splitlines()
+    if args.verbose or process.returncode:
+        print("\n".join(lines[-200:]))
+        print(process.stderr[-5000:], file=sys.stderr)
+    for line in reversed(lines):
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Benchmark for {tweets} tweets failed (exit code {process.returncode})")
+
+
+def main(args):
+    print(
+        f"{'fixture ' + args.fixture if args.fixture else 'synthetic fixtures'}, Twitter latency {args.latency * 1000:.0f}ms "
+        f"(p99 {args.latency_p99 * 1000:.0f}ms), media {args.media_latency * 1000:.0f}ms, PDS {args.pds_latency * 1000:.0f}ms, "
+        f"rate limit window {args.window:g}s\n"
+    )
+    print(f"{'timeline':>8} {'tweets':>7} {'threads':>7} {'fetch/s':>9} {'calls':>6} {'429s':>5} {'images':>7} {'images/s':>9} {'posts':>6} {'posts/s':>8} {'RSS fetch':>9} {'RSS peak':>9}")
+    for tweets in args.sizes:
+        r = run_size(tweets, args)
+        print(
+            f"{tweets:>8} {r['tweets']:>7} {r['threads']:>7} {r['fetch_tweets_per_sec']:>9.1f} {r['twitter_requests']:>6} "
+            f"{r['twitter_429s']:>5} {r['images']:>7} {r['images_per_sec']:>9.1f} {r['posts']:>6} {r['posts_per_sec']:>8.1f} "
+            f"{r['fetch_rss_mb']:>7.0f}MB {r['peak_rss_mb']:>7.0f}MB",
+            flush=True,
+        )
+        if r["twitter_misses"] or r["image_failures"]:
+            print(f"  !! {r['twitter_misses']} requests not in the fixture, {r['image_failures']} images failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 800, 3200], help="Timeline sizes in tweets")
+    parser.add_argument("--fixture", help="Recorded fixture directory (see bench/twitterReplay.py); synthetic timelines otherwise")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median Twitter GraphQL latency in seconds")
+    parser.add_argument("--latency-p99", type=float, default=0.25)
+    parser.add_argument("--media-latency", type=float, default=0.02, help="Median media download latency in seconds")
+    parser.add_argument("--pds-latency", type=float, default=0.02, help="Fake PDS round-trip latency in seconds")
+    parser.add_argument("--window", type=float, default=9.0, help="Twitter rate limit window in seconds (900 on Twitter)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of each run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        args.tweets = args.sizes[0]
+        run_child(args)
+    else:
+        main(args)
@@ -0,0 +1,225 @@
+"""
+Twitter archive import benchmark: parse throughput and memory of
+iter_archive_threads on a synthetic archive ZIP (tweets.js split in parts as
+Twitter does for large accounts, self-threads, replies to others, retweets,
+quotes, links and photos in data/tweets_media/), and the photo read rate
+through the archive:// transport.
+
+--full-load also parses the same tweets.js files with a plain json.loads
+of each part, to compare the memory it takes.
+
+    python -m bench.archiveBench
+    python -m bench.archiveBench --tweets 250000 --full-load
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACCOUNT_ID = "1234567890"
+PART_TWEETS = 50_000  # Tweets per tweets-partN.js
+
+
+def rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def sample_photo(rng: random.Random, size: int) -> bytes:
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def archive_tweets(count: int, media_ratio: float, rng: random.Random):
+    """tweets.js entries, newest first, with the media file names they reference"""
+    tweet_id = 1_800_000_000_000_000_000
+    created_at = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    emitted = 0
+    while emitted < count:
+        # A conversation: a self-thread of 1-6 tweets, or a reply to someone else (and maybe a follow-up)
+        kind = rng.choices(["thread", "reply", "retweet", "quote"], [0.7, 0.15, 0.1, 0.05])[0]
+        size = min(rng.choice([1, 1, 1, 2, 3, 6]) if kind == "thread" else 1 + (kind == "reply" and rng.random() < 0.3), count - emitted)
+        ids = [str(tweet_id - 1000 * (size - i)) for i in range(size)]  # Oldest first
+        entries = []
+        for i, current in enumerate(ids):
+            parent = ids[i - 1] if i else None
+            text = f"Tweet {current} about things &amp; stuff, number {emitted + i}"
+            tweet = {
+                "edit_info": {"initial": {"editTweetIds": [current], "editableUntil": "2024-06-01T00:00:00.000Z", "editsRemaining": "5", "isEditEligible": True}},
+                "retweeted": False,
+                "source": "<a href=\"https://mobile.twitter.com\" rel=\"nofollow\">Twitter Web App</a>",
+                "entities": {"hashtags": [], "symbols": [], "user_mentions": [], "urls": []},
+                "favorite_count": str(rng.randint(0, 50)),
+                "id_str": current,
+                "id": current,
+                "truncated": False,
+                "retweet_count": "0",
+                "created_at": (created_at - timedelta(minutes=size - i)).strftime("%a %b %d %H:%M:%S +0000 %Y"),
+                "favorited": False,
+                "lang": "en",
+            }
+            if kind == "retweet":
+                text = f"RT @someone: {text}"
+            if kind == "reply" and i == 0:
+                text = f"@someone {text}"
+                tweet.update({"in_reply_to_status_id_str": str(tweet_id - 10**9), "in_reply_to_user_id_str": "42", "in_reply_to_screen_name": "someone"})
+            elif parent:
+                text = f"@bench {text}"
+                tweet.update({"in_reply_to_status_id_str": parent, "in_reply_to_user_id_str": ACCOUNT_ID, "in_reply_to_screen_name": "bench"})
+            if kind == "quote" or rng.random() < 0.2:
+                link = f"https://t.co/{rng.getrandbits(40):x}"
+                expanded = f"https://twitter.com/someone/status/{tweet_id - 10**9}" if kind == "quote" else f"https://example.com/{current}"
+                text = f"{text} {link}"
+                tweet["entities"]["urls"].append({"url": link, "expanded_url": expanded, "display_url": expanded[8:30], "indices": ["0", "0"]})
+            start = text.index(" ", 1) + 1 if text.startswith("@") else 0
+            end = len(text)
+            media = []
+            if kind == "thread" and rng.random() < media_ratio:
+                link = f"https://t.co/{rng.getrandbits(40):x}"
+                text = f"{text} {link}"
+                for index in range(rng.choice([1, 1, 2, 4])):
+                    name = f"M{current}{index}"
+                    media.append({
+                        "expanded_url": f"https://twitter.com/bench/status/{current}/photo/{index + 1}",
+                        "url": link,
+                        "media_url_https": f"https://pbs.twimg.com/media/{name}.jpg",
+                        "id_str": f"{current}{index}",
+                        "type": "photo",
+                        "sizes": {"large": {"w": "2048", "h": "1536", "resize": "fit"}, "medium": {"w": "1200", "h": "900", "resize": "fit"}},
+                    })
+                tweet["entities"]["media"] = media[:1]
+                tweet["extended_entities"] = {"media": media}
+            tweet["full_text"] = text
+            tweet["display_text_range"] = [str(start), str(end)]
+            entries.append(({"tweet": tweet}, [f"{current}-M{current}{index}.jpg" for index in range(len(media))]))
+        # Newest first
+        for entry in reversed(entries):
+            yield entry
+        emitted += size
+        tweet_id -= 1000 * (size + rng.randint(1, 50))
+        created_at -= timedelta(minutes=size + rng.randint(1, 600))
+
+
+def build_archive(path: str, tweets: int, media_ratio: float, seed: int) -> dict:
+    """Write the archive entry by entry, without holding the timeline in memory"""
+    rng = random.Random(seed)
+    photos = [sample_photo(rng, 128) for _ in range(8)]
+    media_names = []  # Written once the tweets.js parts are closed
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("data/account.js", "window.YTD.account.part0 = " + json.dumps([{"account": {"accountId": ACCOUNT_ID, "username": "bench", "accountDisplayName": "Bench"}}], indent=2))
+        part = None
+        for i, (entry, media) in enumerate(archive_tweets(tweets, media_ratio, rng)):
+            if i % PART_TWEETS == 0:
+                if part:
+                    part.write(b"\n]")
+                    part.close()
+                index = i // PART_TWEETS
+                name = "data/tweets.js" if index == 0 else f"data/tweets-part{index}.js"
+                part = zf.open(name, "w", force_zip64=True)
+                part.write(f"window.YTD.tweets.part{index} = [\n".encode())
+            else:
+                part.write(b",\n")
+            part.write(json.dumps(entry, indent=2, ensure_ascii=False).encode())
+            media_names.extend(media)
+        if part:
+            part.write(b"\n]")
+            part.close()
+        for name in media_names:
+            # Photos are already compressed: stored, as in Twitter's archives
+            zf.writestr(zipfile.ZipInfo(f"data/tweets_media/{name}"), rng.choice(photos), zipfile.ZIP_STORED)
+    return {"media_files": len(media_names), "bytes": os.path.getsize(path)}
+
+
+async def run(args, workdir):
+    import httpx
+    import twitterArchive
+    from twitterArchive import archive_media, iter_archive_threads, ARCHIVE_SCHEME
+
+    archive_id = "0" * 32
+    os.makedirs(twitterArchive.ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(twitterArchive.ARCHIVE_DIR, f"{archive_id}.zip")
+    started = time.perf_counter()
+    built = build_archive(path, args.tweets, args.media_ratio, args.seed)
+    print(f"Synthetic archive: {args.tweets} tweets, {built['media_files']} photos, {built['bytes'] / 1e6:.1f} MB zipped "
+          f"(built in {time.perf_counter() - started:.1f}s)")
+    baseline = rss_mb()
+
+    threads = tweets = 0
+    media_urls = []
+    started = time.perf_counter()
+    async for thread in iter_archive_threads(archive_id, limit=0):
+        threads += 1
+        tweets += len(thread)
+        for tweet in thread:
+            if len(media_urls) < args.images:
+                media_urls.extend(url for url in tweet["media_urls"] if url.startswith(ARCHIVE_SCHEME))
+    elapsed = time.perf_counter() - started
+    with zipfile.ZipFile(path) as zf:
+        parsed_bytes = sum(zf.getinfo(name).file_size for name in twitterArchive._tweet_parts(zf.namelist()))
+    print(f"  parse            {tweets:8d} tweets in {threads} threads, {elapsed:.2f}s: {tweets / elapsed:8.0f} tweets/s, "
+          f"{parsed_bytes / 1e6 / elapsed:6.1f} MB/s of tweets.js ({parsed_bytes / 1e6:.0f} MB)")
+    print(f"  peak RSS         {rss_mb():8.0f} MB ({rss_mb() - baseline:+.0f} MB while parsing)")
+
+    async with httpx.AsyncClient(mounts={ARCHIVE_SCHEME: archive_media}) as client:
+        semaphore = asyncio.Semaphore(16)
+
+        async def read(url):
+            async with semaphore:
+                response = await client.get(url)
+                response.raise_for_status()
+                return len(response.content)
+
+        started = time.perf_counter()
+        sizes = await asyncio.gather(*[read(url) for url in media_urls[:args.images]])
+        elapsed = time.perf_counter() - started
+    if sizes:
+        print(f"  photos           {len(sizes):8d} read from the ZIP in {elapsed:.2f}s: {len(sizes) / elapsed:8.0f}/s, "
+              f"{sum(sizes) / 1e6 / elapsed:6.1f} MB/s")
+    archive_media.forget(archive_id)
+
+    if args.full_load:
+        before = rss_mb()
+        started = time.perf_counter()
+        loaded = 0
+        with zipfile.ZipFile(path) as zf:
+            for name in twitterArchive._tweet_parts(zf.namelist()):
+                text = zf.read(name).decode("utf-8")
+                entries = json.loads(text[text.index("["):])
+                loaded += len(entries)
+                del text, entries
+        elapsed = time.perf_counter() - started
+        print(f"  json.loads       {loaded:8d} tweets in {elapsed:.2f}s: {loaded / elapsed:8.0f} tweets/s (parse only), "
+              f"peak RSS {rss_mb():.0f} MB ({rss_mb() - before:+.0f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=100_000)
+    parser.add_argument("--media-ratio", type=float, default=0.15, help="Fraction of self-thread tweets with photos")
+    parser.add_argument("--images", type=int, default=2000, help="Photos read back through the archive:// transport")
+    parser.add_argument("--full-load", action="store_true", help="Also parse tweets.js with json.loads of each part")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Keep the archive out of the working tree
+    sys.path.insert(0, BACKEND_DIR)
+    workdir = tempfile.TemporaryDirectory(prefix="archive-bench-")
+    os.environ["ARCHIVE_DIR"] = os.path.join(workdir.name, "archives")
+    try:
+        asyncio.run(run(args, workdir.name))
+    finally:
+        workdir.cleanup()
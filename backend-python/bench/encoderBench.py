@@ -0,0 +1,72 @@
+"""
+Encoder benchmark: the old blind 70% resize vs the size-targeted encoder.
+
+For each synthetic oversized image, reports whether the result fits the
+blob limit, encode time, passes and output size.
+
+    python -m bench.encoderBench
+"""
+
+import os
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from imageEncoder import MAX_BLOB_BYTES, encode_image
+
+
+def legacy_transform(data: bytes) -> bytes:
+    """What process_single_image used to do with oversized images"""
+    with Image.open(BytesIO(data)) as img:
+        fmt = img.format or "JPEG"
+        resized = img.resize((int(img.width * 0.7), int(img.height * 0.7)), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format=fmt, quality=85)
+        return buffer.getvalue()
+
+
+def photo(size, seed_noise=60):
+    return Image.effect_noise(size, seed_noise).convert("RGB")
+
+
+def screenshot(size):
+    img = Image.new("RGB", size, (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    for y in range(0, size[1], 18):
+        draw.text((20, y), os.urandom(60).hex(), fill=(20, 20, 20))
+    return img
+
+
+def encoded(img, fmt, **kwargs):
+    buffer = BytesIO()
+    img.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def samples():
+    yield "photo 4096x3072 JPEG q95", encoded(photo((4096, 3072)), "JPEG", quality=95)
+    yield "photo 2400x1800 JPEG q95", encoded(photo((2400, 1800)), "JPEG", quality=95)
+    yield "noise 2048x2048 JPEG q92", encoded(Image.frombytes("RGB", (2048, 2048), os.urandom(2048 * 2048 * 3)), "JPEG", quality=92)
+    yield "screenshot 2560x1600 PNG", encoded(screenshot((2560, 1600)), "PNG")
+    yield "photo 3000x2000 PNG", encoded(photo((3000, 2000)), "PNG")
+    rgba = photo((2200, 2200)).convert("RGBA")
+    rgba.putalpha(200)
+    yield "transparent 2200x2200 PNG", encoded(rgba, "PNG")
+
+
+def main():
+    print(f"{'image':<28}{'input':>9} | {'legacy':>9}{'fits':>6}{'ms':>8} | {'encoder':>9}{'fits':>6}{'ms':>8}{'passes':>8}")
+    for name, data in samples():
+        start = time.perf_counter()
+        legacy = legacy_transform(data)
+        legacy_ms = (time.perf_counter() - start) * 1000
+        result, stats = encode_image(data)
+        print(
+            f"{name:<28}{len(data) // 1024:>7}KB | {len(legacy) // 1024:>7}KB{'yes' if len(legacy) <= MAX_BLOB_BYTES else 'NO':>6}{legacy_ms:>8.0f} | "
+            f"{len(result) // 1024:>7}KB{'yes' if len(result) <= MAX_BLOB_BYTES else 'NO':>6}{stats['encode_ms']:>8.0f}{stats['passes']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
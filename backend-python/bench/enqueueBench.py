@@ -0,0 +1,156 @@
+"""
+Enqueue latency of POST /posts under a burst of submissions.
+
+Drives the FastAPI app in process (httpx.ASGITransport, real SQLite queue in
+a temporary directory; the workers are not started) with handle resolution
+replaced by a simulated DNS/HTTPS lookup. Handles are drawn from a small pool,
+some of them unknown, so a burst resubmits the same handles as users
+retrying do. Three modes:
+
+- direct: every request resolves its handle (before didCache.py)
+- cached: DidCache in front of the resolver, cold at the start of the burst
+  (concurrent lookups of a handle coalesce into one)
+- worker: DID_RESOLUTION=worker, the job is accepted without resolving
+
+    python -m bench.enqueueBench
+    python -m bench.enqueueBench --requests 2000 --handles 200 --latency 0.3 --latency-p99 3
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATE_ENV = {
+    "TWITTER_COOKIE_FILES": "cookies.json",
+    "TIMELINE_CACHE_PATH": "timelines.db",
+    "BLOB_CACHE_PATH": "blobs.db",
+    "JOURNAL_DIR": "journals",
+    "NOTIFY_OUTBOX_PATH": "notifications.db",
+    "BSKY_SESSION_PATH": "bsky_sessions.db",
+    "QUEUE_PATH": "migrations.db",
+    "SESSION_ENCRYPTION_KEY": "",
+}
+
+
+class SimulatedResolver:
+    """AsyncHandleResolver stand-in: a lookup takes `latency`, unknown handles resolve to None"""
+
+    def __init__(self, latency, unknown):
+        self.latency = latency
+        self.unknown = unknown
+        self.lookups = 0
+
+    async def resolve(self, handle):
+        self.lookups += 1
+        await asyncio.sleep(self.latency.sample())
+        return None if handle in self.unknown else f"did:plc:{abs(hash(handle)) % 10**20:020d}"
+
+
+class DirectLookup:
+    """Resolution on every call, as before the cache"""
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+
+    async def resolve(self, handle):
+        return await self.resolver.resolve(handle)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+    return f"p50 {pick(0.5):8.1f}ms  p95 {pick(0.95):8.1f}ms  p99 {pick(0.99):8.1f}ms  max {samples[-1] * 1000:8.1f}ms"
+
+
+async def burst(app, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def submit(body):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/posts", json=body)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[submit(body) for body in requests])
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+async def run(args):
+    from bench.latency import LatencyModel
+    from jobQueue import SQLiteJobQueue
+
+    import app as api
+    import bluesky
+    from didCache import DidCache
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    handles = [f"user{i}.bsky.social" for i in range(args.handles)]
+    unknown = set(rng.sample(handles, int(len(handles) * args.unknown_ratio)))
+    requests = [
+        {
+            "migrationId": f"enqueue-{i}",
+            "twitterName": f"someone{i}",
+            "bskyHandle": rng.choice(handles),
+            "password": "xxxx-xxxx-xxxx-xxxx",
+            "limit": rng.choice([150, 800]),
+        }
+        for i in range(args.requests)
+    ]
+
+    print(f"{args.requests} POST /posts, {args.concurrency} in flight, {args.handles} handles ({len(unknown)} unknown), "
+          f"resolution latency {args.latency * 1000:.0f}ms (p99 {args.latency_p99 * 1000:.0f}ms)\n")
+    print(f"{'mode':<8} {'req/s':>8} {'lookups':>8}  {'accepted':>8} {'rejected':>8}  latency")
+    for mode in ("direct", "cached", "worker"):
+        resolver = SimulatedResolver(LatencyModel(args.latency, args.latency_p99, args.seed), unknown)
+        bluesky.did_cache = DirectLookup(resolver) if mode == "direct" else DidCache(resolver)
+        api.DID_RESOLUTION = "worker" if mode == "worker" else "request"
+        api.queue = SQLiteJobQueue(path=f"enqueue-{mode}.db")
+
+        latencies, statuses, elapsed = await burst(api.app, requests, args.concurrency)
+        await api.queue.close()
+        rejected = sum(count for status, count in statuses.items() if status != 200)
+        print(f"{mode:<8} {len(latencies) / elapsed:>8.0f} {resolver.lookups:>8}  {statuses.get(200, 0):>8} {rejected:>8}  {percentiles(latencies)}")
+
+    await api.timeline_cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight at once")
+    parser.add_argument("--handles", type=int, default=100, help="Distinct Bluesky handles the requests use")
+    parser.add_argument("--unknown-ratio", type=float, default=0.05, help="Fraction of the handles that don't resolve")
+    parser.add_argument("--latency", type=float, default=0.15, help="Median handle resolution latency in seconds")
+    parser.add_argument("--latency-p99", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Keep the backend's state files out of the working tree
+    sys.path.insert(0, BACKEND_DIR)
+    workdir = tempfile.TemporaryDirectory(prefix="enqueue-bench-")
+    os.environ.update(STATE_ENV)
+    os.chdir(workdir.name)
+    from bench.twitterReplay import write_replay_cookies
+
+    write_replay_cookies(STATE_ENV["TWITTER_COOKIE_FILES"])
+    try:
+        asyncio.run(run(args))
+    finally:
+        os.chdir(BACKEND_DIR)
+        workdir.cleanup()
@@ -0,0 +1,384 @@
+"""
+Stand-in for a Bluesky PDS, in-process or as a local server.
+
+Implements the XRPC the migration engine uses (createSession,
+refreshSession, getProfile, resolveHandle, uploadBlob, createRecord,
+applyWrites) with the limits of the real service:
+
+- Access tokens expire (and atproto refreshes them 15 minutes ahead);
+  refresh tokens rotate and a used one is rejected
+- Writes are charged per operation against a per-account points budget
+  (5000/hour, 35000/day; create 3, update 2, delete 1) and createSession
+  against 30 per 5 minutes and 300 per day. Responses carry ratelimit-*
+  headers; an exhausted budget answers 429 RateLimitExceeded
+- Blobs above 1,000,000 bytes are rejected with BlobTooLarge
+- Latency is constant or a distribution (see bench/latency.py), plus a cost
+  per write and per uploaded MB; 429s can also be injected at random
+- Windows can be compressed with `time_scale` so a load test reaches them
+
+In-process, clients talk to it through httpx.ASGITransport (make_client), so
+no sockets are needed. As a server (see bench/pdsLoad.py for a load driver):
+
+    python -m bench.fakePds --port 2583 --latency 0.05 --latency-p99 0.4
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import httpx
+import libipld
+from atproto import AsyncClient
+from atproto_client.request import AsyncRequest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from batchPoster import compute_record_cid
+
+FAKE_PDS_URL = "http://fake-pds.test"
+
+ACCESS_TTL = 2 * 3600
+REFRESH_TTL = 60 * 86400
+MAX_BLOB_BYTES = 1_000_000
+HOURLY_POINTS = 5000
+DAILY_POINTS = 35000
+WRITE_POINTS = {
+    "com.atproto.repo.applyWrites#create": 3,
+    "com.atproto.repo.applyWrites#update": 2,
+    "com.atproto.repo.applyWrites#delete": 1,
+}
+# (limit, window seconds) per account
+SESSION_LIMITS = ((30, 5 * 60), (300, 86400))
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def _payload(token: str) -> dict:
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return {}
+
+
+def make_jwt(did: str, scope: str, ttl: int) -> str:
+    now = int(time.time())
+    header = _b64({"alg": "ES256K", "typ": "JWT"})
+    payload = _b64({"sub": did, "scope": scope, "iat": now, "exp": now + ttl, "jti": os.urandom(8).hex()})
+    signature = base64.urlsafe_b64encode(b"fake-signature").decode().rstrip("=")
+    return f"{header}.{payload}.{signature}"
+
+
+class XrpcError(Exception):
+    def __init__(self, status: int, error: str, message: str, headers: dict = None):
+        self.status = status
+        self.error = error
+        self.message = message
+        self.headers = headers or {}
+
+
+class _Window:
+    """Fixed window counter, started by its first use (as the PDS rate limiter does)"""
+
+    def __init__(self, limit: int, seconds: float):
+        self.limit = limit
+        self.seconds = seconds
+        self.used = 0
+        self.reset_at = 0.0
+
+    def _roll(self, now: float):
+        if now >= self.reset_at:
+            self.used = 0
+            self.reset_at = now + self.seconds
+
+    def remaining(self, now: float) -> int:
+        self._roll(now)
+        return self.limit - self.used
+
+    def consume(self, cost: int, now: float) -> bool:
+        self._roll(now)
+        if self.used + cost > self.limit:
+            return False
+        self.used += cost
+        return True
+
+
+class _Budget:
+    """Several windows charged together; a request needs room in all of them"""
+
+    def __init__(self, limits, time_scale: float):
+        self.windows = [_Window(limit, seconds / time_scale) for limit, seconds in limits]
+
+    def consume(self, cost: int) -> bool:
+        now = time.time()
+        if any(window.remaining(now) < cost for window in self.windows):
+            return False
+        for window in self.windows:
+            window.consume(cost, now)
+        return True
+
+    def headers(self) -> dict:
+        now = time.time()
+        window = min(self.windows, key=lambda w: w.remaining(now))
+        return {
+            "ratelimit-limit": str(window.limit),
+            "ratelimit-remaining": str(max(window.remaining(now), 0)),
+            "ratelimit-reset": str(int(window.reset_at) + 1),
+            "ratelimit-policy": f"{window.limit};w={round(window.seconds)}",
+        }
+
+
+class FakePDS:
+    def __init__(
+        self,
+        latency=0.02,
+        per_write_latency: float = 0.001,
+        per_mb_latency: float = 0.0,
+        hourly_points: int = HOURLY_POINTS,
+        daily_points: int = DAILY_POINTS,
+        session_limits=SESSION_LIMITS,
+        time_scale: float = 1.0,
+        max_blob_bytes: int = MAX_BLOB_BYTES,
+        access_ttl: int = ACCESS_TTL,
+        error_rate: float = 0.0,
+        seed: int = 1,
+    ):
+        # A number (constant seconds) or anything with sample(), e.g. bench.latency.LatencyModel
+        self.latency = latency
+        self.per_write_latency = per_write_latency
+        self.per_mb_latency = per_mb_latency
+        self.point_limits = [(points, seconds) for points, seconds in ((hourly_points, 3600), (daily_points, 86400)) if points]
+        self.session_limits = session_limits
+        self.time_scale = time_scale
+        self.max_blob_bytes = max_blob_bytes
+        self.access_ttl = access_ttl
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.records = {}
+        self.record_cids = {}
+        self.blobs = {}
+        self.requests = 0
+        self.routes = Counter()
+        self.rate_limited = Counter()
+        self.sessions_created = 0
+        self.refreshes = 0
+        self.rejected_tokens = 0
+        self._point_budgets = {}
+        self._session_budgets = {}
+        self._revoked = set()
+        self.app = self._build_app()
+
+    async def _delay(self, writes: int = 0, size: int = 0):
+        self.requests += 1
+        latency = self.latency.sample() if hasattr(self.latency, "sample") else self.latency
+        await asyncio.sleep(latency + self.per_write_latency * writes + self.per_mb_latency * size / 1_000_000)
+
+    def _did_for(self, identifier: str) -> str:
+        return "did:plc:" + hashlib.sha256(identifier.encode()).hexdigest()[:24]
+
+    def _store(self, did: str, collection: str, rkey: str, record: dict) -> dict:
+        uri = f"at://{did}/{collection}/{rkey}"
+        cid = compute_record_cid(record)
+        self.records[uri] = record
+        self.record_cids[uri] = cid
+        return {"uri": uri, "cid": cid}
+
+    def _inject(self, route: str):
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.rate_limited[f"{route} (injected)"] += 1
+            reset = int(time.time() + 300 / self.time_scale) + 1
+            headers = {"ratelimit-limit": "3000", "ratelimit-remaining": "0", "ratelimit-reset": str(reset), "ratelimit-policy": "3000;w=300"}
+            raise XrpcError(429, "RateLimitExceeded", "Rate Limit Exceeded", headers)
+
+    def _charge(self, budgets: dict, limits, key: str, cost: int, route: str) -> dict:
+        """Take `cost` from the key's budget; returns its ratelimit-* headers or raises a 429"""
+        if not limits:
+            return {}
+        budget = budgets.get(key)
+        if budget is None:
+            budget = budgets[key] = _Budget(limits, self.time_scale)
+        if not budget.consume(cost):
+            self.rate_limited[route] += 1
+            raise XrpcError(429, "RateLimitExceeded", "Rate Limit Exceeded", budget.headers())
+        return budget.headers()
+
+    def _authorize(self, request: Request, scope: str = "com.atproto.access") -> str:
+        """DID of a valid bearer token of `scope`"""
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        payload = _payload(token)
+        if not payload:
+            self.rejected_tokens += 1
+            raise XrpcError(401, "AuthMissing", "Authentication Required")
+        if payload.get("scope") != scope:
+            self.rejected_tokens += 1
+            raise XrpcError(400, "InvalidToken", "Invalid token type")
+        if payload.get("exp", 0) < time.time() or payload.get("jti") in self._revoked:
+            self.rejected_tokens += 1
+            raise XrpcError(400, "ExpiredToken", "Token has expired" if payload.get("exp", 0) < time.time() else "Token has been revoked")
+        return payload["sub"]
+
+    def _session(self, did: str, handle: str) -> dict:
+        return {
+            "accessJwt": make_jwt(did, "com.atproto.access", self.access_ttl),
+            "refreshJwt": make_jwt(did, "com.atproto.refresh", REFRESH_TTL),
+            "handle": handle,
+            "did": did,
+            "active": True,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "routes": dict(self.routes),
+            "rate_limited": dict(self.rate_limited),
+            "records": len(self.records),
+            "blobs": len(self.blobs),
+            "sessions_created": self.sessions_created,
+            "refreshes": self.refreshes,
+            "rejected_tokens": self.rejected_tokens,
+        }
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+        handles = {}  # did -> handle
+
+        @app.exception_handler(XrpcError)
+        async def xrpc_error(request: Request, error: XrpcError):
+            return JSONResponse({"error": error.error, "message": error.message}, status_code=error.status, headers=error.headers)
+
+        @app.middleware("http")
+        async def count_routes(request: Request, call_next):
+            self.routes[request.url.path.rsplit("/", 1)[-1]] += 1
+            return await call_next(request)
+
+        @app.post("/xrpc/com.atproto.server.createSession")
+        async def create_session(request: Request):
+            body = await request.json()
+            await self._delay()
+            handle = body["identifier"]
+            self._inject("createSession")
+            headers = self._charge(self._session_budgets, self.session_limits, handle, 1, "createSession")
+            did = self._did_for(handle)
+            handles[did] = handle
+            self.sessions_created += 1
+            return JSONResponse(self._session(did, handle), headers=headers)
+
+        @app.post("/xrpc/com.atproto.server.refreshSession")
+        async def refresh_session(request: Request):
+            await self._delay()
+            did = self._authorize(request, "com.atproto.refresh")
+            # Rotation: the refresh token just used can't be used again
+            self._revoked.add(_payload(request.headers["authorization"].removeprefix("Bearer ").strip())["jti"])
+            self.refreshes += 1
+            return self._session(did, handles.get(did, did))
+
+        @app.get("/xrpc/com.atproto.identity.resolveHandle")
+        async def resolve_handle(handle: str):
+            await self._delay()
+            return {"did": self._did_for(handle)}
+
+        @app.get("/xrpc/app.bsky.actor.getProfile")
+        async def get_profile(request: Request, actor: str):
+            await self._delay()
+            self._authorize(request)
+            did = actor if actor.startswith("did:") else self._did_for(actor)
+            return {"did": did, "handle": handles.get(did, actor)}
+
+        @app.post("/xrpc/com.atproto.repo.uploadBlob")
+        async def upload_blob(request: Request):
+            data = await request.body()
+            await self._delay(size=len(data))
+            self._authorize(request)
+            self._inject("uploadBlob")
+            if len(data) > self.max_blob_bytes:
+                raise XrpcError(400, "BlobTooLarge", f"This file is too large. It is {len(data)} bytes but the maximum size is {self.max_blob_bytes} bytes.")
+            digest = hashlib.sha256(data).digest()
+            cid = libipld.encode_cid(bytes([0x01, 0x55, 0x12, 0x20]) + digest)
+            self.blobs[cid] = len(data)
+            mime_type = request.headers.get("content-type", "application/octet-stream")
+            return {"blob": {"$type": "blob", "ref": {"$link": cid}, "mimeType": mime_type, "size": len(data)}}
+
+        @app.post("/xrpc/com.atproto.repo.createRecord")
+        async def create_record(request: Request):
+            body = await request.json()
+            await self._delay(writes=1)
+            did = self._authorize(request)
+            self._inject("createRecord")
+            headers = self._charge(self._point_budgets, self.point_limits, did, WRITE_POINTS["com.atproto.repo.applyWrites#create"], "createRecord")
+            rkey = body.get("rkey") or str(len(self.records) + 1)
+            return JSONResponse(self._store(body["repo"], body["collection"], rkey, body["record"]), headers=headers)
+
+        @app.post("/xrpc/com.atproto.repo.applyWrites")
+        async def apply_writes(request: Request):
+            body = await request.json()
+            writes = body["writes"]
+            await self._delay(writes=len(writes))
+            did = self._authorize(request)
+            if len(writes) > 200:
+                raise XrpcError(400, "InvalidRequest", "Too many writes")
+            self._inject("applyWrites")
+            cost = sum(WRITE_POINTS.get(write.get("$type"), 3) for write in writes)
+            headers = self._charge(self._point_budgets, self.point_limits, did, cost, "applyWrites")
+            results = []
+            for write in writes:
+                ref = self._store(body["repo"], write["collection"], write["rkey"], write["value"])
+                results.append({"$type": "com.atproto.repo.applyWrites#createResult", **ref})
+            return JSONResponse({"results": results}, headers=headers)
+
+        @app.get("/_stats")
+        async def get_stats():
+            return self.stats()
+
+        return app
+
+
+def make_client(pds: FakePDS) -> AsyncClient:
+    """atproto AsyncClient whose HTTP traffic goes to the in-process fake PDS"""
+    request = AsyncRequest()
+    request._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=pds.app), follow_redirects=True)
+    return AsyncClient(base_url=f"{FAKE_PDS_URL}/xrpc", request=request)
+
+
+def add_pds_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="Median PDS latency in seconds")
+    parser.add_argument("--latency-p99", type=float, default=0.3)
+    parser.add_argument("--per-write-latency", type=float, default=0.001)
+    parser.add_argument("--per-mb-latency", type=float, default=0.05, help="Extra upload latency per MB of blob")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Divide every rate limit window by this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an injected 429")
+    parser.add_argument("--access-ttl", type=int, default=ACCESS_TTL, help="Access token lifetime in seconds")
+    parser.add_argument("--no-budget", action="store_true", help="Disable the points budget")
+
+
+def pds_from_args(args) -> FakePDS:
+    from bench.latency import LatencyModel
+
+    return FakePDS(
+        latency=LatencyModel(args.latency, args.latency_p99),
+        per_write_latency=args.per_write_latency,
+        per_mb_latency=args.per_mb_latency,
+        hourly_points=None if args.no_budget else HOURLY_POINTS,
+        daily_points=None if args.no_budget else DAILY_POINTS,
+        time_scale=args.time_scale,
+        access_ttl=args.access_ttl,
+        error_rate=args.error_rate,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2583)
+    add_pds_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(pds_from_args(args).app, host=args.host, port=args.port, log_level="warning")
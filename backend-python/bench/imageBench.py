@@ -0,0 +1,109 @@
+"""
+Image processing benchmark: Pillow on the event loop vs the image worker pool.
+
+N concurrent migrations each download and shrink oversized images from an
+in-process HTTP transport (no network). A ticker coroutine measures how late
+the event loop wakes it up, which is what every other migration, /posts and
+/health experience while images are being processed.
+
+    python -m bench.imageBench --images 12 --concurrency 2 4 8
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from io import BytesIO
+
+import httpx
+from PIL import Image
+
+from imageWorkers import ImageWorkerPool
+from imageEncoder import MAX_BLOB_BYTES, encode_image
+
+
+def make_images(count: int):
+    """Oversized photos (noisy JPEG) and screenshots (PNG), all above the blob limit"""
+    images = []
+    for i in range(count):
+        size = (2400, 1800)
+        img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)) if i % 2 else Image.effect_noise(size, 60).convert("RGB")
+        buffer = BytesIO()
+        if i % 3 == 2:
+            img.save(buffer, format="PNG")
+        else:
+            img.save(buffer, format="JPEG", quality=95)
+        assert buffer.tell() > MAX_BLOB_BYTES
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_http_client(images):
+    def handler(request):
+        return httpx.Response(200, content=images[int(request.url.path.strip("/"))])
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://media")
+
+
+async def measure_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run(mode: str, images, concurrency: int, workers: int):
+    pool = ImageWorkerPool(workers=workers) if mode == "pool" else None
+    if pool:
+        # Start the worker processes before timing
+        await asyncio.gather(*[pool.encode(images[0]) for _ in range(workers)])
+
+    async def process(http_client, path):
+        data = (await http_client.get(path)).content
+        if pool:
+            return await pool.encode(data)
+        return encode_image(data)  # the old path: Pillow inside the coroutine
+
+    async def migration(http_client):
+        for i in range(len(images)):
+            await process(http_client, f"/{i}")
+
+    lag = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop, lag))
+    async with make_http_client(images) as http_client:
+        start = time.perf_counter()
+        await asyncio.gather(*[migration(http_client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    if pool:
+        pool.shutdown()
+
+    lag.sort()
+    return {
+        "images_per_s": concurrency * len(images) / elapsed,
+        "lag_p50_ms": statistics.median(lag) * 1000 if lag else 0.0,
+        "lag_p99_ms": lag[int(len(lag) * 0.99)] * 1000 if lag else 0.0,
+        "lag_max_ms": lag[-1] * 1000 if lag else 0.0,
+    }
+
+
+async def main(count, concurrencies, workers):
+    images = make_images(count)
+    print(f"{count} oversized images per migration, {workers} worker processes\n")
+    print(f"{'mode':<14}{'migrations':>11}{'images/s':>10}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}")
+    for concurrency in concurrencies:
+        for mode in ("event loop", "pool"):
+            r = await run(mode, images, concurrency, workers)
+            print(f"{mode:<14}{concurrency:>11}{r['images_per_s']:>10.1f}"
+                  f"{r['lag_p50_ms']:>8.1f}ms{r['lag_p99_ms']:>8.1f}ms{r['lag_max_ms']:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--workers", type=int, default=int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+    args = parser.parse_args()
+    asyncio.run(main(args.images, args.concurrency, args.workers))
@@ -0,0 +1,19 @@
+"""Latency distributions for the simulated services (replayed Twitter, fake PDS)"""
+
+import math
+import random
+from typing import Optional
+
+
+class LatencyModel:
+    """Log-normal request latency: `median` seconds, with `p99` seconds at the 99th percentile"""
+
+    def __init__(self, median: float, p99: Optional[float] = None, seed: int = 1):
+        self.median = median
+        self.sigma = math.log(p99 / median) / 2.326 if p99 and median and p99 > median else 0.0
+        self._random = random.Random(seed)
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self._random.lognormvariate(math.log(self.median), self.sigma) if self.sigma else self.median
@@ -0,0 +1,111 @@
+"""
+AccountRateLimiter microbenchmarks with many concurrent accounts.
+
+- fast path: acquire() overhead when every account is under budget,
+  compared with the previous lock + 1 s polling limiter
+- saturated: every account is over budget, so each grant depends on a
+  timed wake-up; reports wake-ups per grant and how late grants fire
+
+    python -m bench.limiterBench --accounts 1000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from rateLimiter import AccountRateLimiter
+
+
+class PollingRateLimiter:
+    """The limiter this module replaced: fixed windows, one global lock, 1 s polling"""
+
+    def __init__(self, hourly_limit=5000, daily_limit=35000):
+        self.hourly_limit = hourly_limit
+        self.daily_limit = daily_limit
+        self.account_limits = defaultdict(lambda: {"hourly_points": 0, "daily_points": 0})
+        self.lock = asyncio.Lock()
+        self.hourly_reset_times = defaultdict(lambda: datetime.now() + timedelta(hours=1))
+        self.daily_reset_times = defaultdict(lambda: datetime.now() + timedelta(days=1))
+
+    async def _reset_points(self, account_id):
+        now = datetime.now()
+        if now >= self.hourly_reset_times[account_id]:
+            self.account_limits[account_id]["hourly_points"] = 0
+            self.hourly_reset_times[account_id] = now + timedelta(hours=1)
+        if now >= self.daily_reset_times[account_id]:
+            self.account_limits[account_id]["daily_points"] = 0
+            self.daily_reset_times[account_id] = now + timedelta(days=1)
+
+    async def acquire(self, account_id, action_points):
+        while True:
+            async with self.lock:
+                await self._reset_points(account_id)
+                limits = self.account_limits[account_id]
+                if (
+                    limits["hourly_points"] + action_points <= self.hourly_limit
+                    and limits["daily_points"] + action_points <= self.daily_limit
+                ):
+                    limits["hourly_points"] += action_points
+                    limits["daily_points"] += action_points
+                    return True
+            await asyncio.sleep(1)
+
+
+async def fast_path(limiter, accounts, per_account):
+    latencies = []
+
+    async def worker(account_id):
+        for _ in range(per_account):
+            t0 = time.perf_counter()
+            await limiter.acquire(account_id, 3)
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(f"did:plc:{i}") for i in range(accounts)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return elapsed, statistics.mean(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+async def saturated(accounts, per_account, window):
+    # Budget of 10 acquires per window per account, so most acquires have to wait
+    limiter = AccountRateLimiter(hourly_limit=30, daily_limit=10**6, hourly_window=window)
+    lateness = []
+
+    async def worker(account_id):
+        for i in range(per_account):
+            await limiter.acquire(account_id, 3)
+            if i >= 10:
+                # The i-th grant is due (i - 9) emission intervals after the burst
+                ideal = start + (i - 9) * window / 10
+                lateness.append(time.monotonic() - ideal)
+
+    start = time.monotonic()
+    await asyncio.gather(*[worker(f"did:plc:{i}") for i in range(accounts)])
+    elapsed = time.monotonic() - start
+    grants = accounts * per_account
+    lateness.sort()
+    return elapsed, limiter.timer_wakeups, grants, lateness[len(lateness) // 2], lateness[int(len(lateness) * 0.99)]
+
+
+async def main(accounts, per_account):
+    print(f"{accounts} concurrent accounts, {per_account} acquires each\n")
+
+    for name, limiter in (("polling (old)", PollingRateLimiter()), ("GCRA + timer heap", AccountRateLimiter())):
+        elapsed, mean, p99 = await fast_path(limiter, accounts, per_account)
+        print(f"fast path  {name:<18} {accounts * per_account / elapsed:>10.0f} acquires/s  mean {mean * 1e6:6.1f}us  p99 {p99 * 1e6:6.1f}us")
+
+    elapsed, wakeups, grants, p50, p99 = await saturated(accounts, 20, window=1.0)
+    print(f"\nsaturated  {accounts} accounts x 20 acquires, budget 10/s: {elapsed:.2f}s, "
+          f"{wakeups} timer wake-ups for {grants} grants, grant lateness p50 {p50 * 1000:.2f}ms p99 {p99 * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--per-account", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.accounts, args.per_account))
@@ -0,0 +1,96 @@
+"""
+Media variant benchmark on recorded Twitter media metadata.
+
+Compares downloading every photo's original with the variant chosen by
+mediaVariants.select_variant: pixels fetched, estimated bytes on the wire,
+how many images still need a re-encode, and (with --encode) the measured
+encoder CPU time on synthetic images of those dimensions.
+
+    python -m bench.mediaVariantBench [--fixture bench/fixtures/media.json] [--encode 6]
+"""
+
+import argparse
+import json
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from imageEncoder import MAX_BLOB_BYTES, encode_image
+from mediaVariants import _dimensions, select_variant
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "media.json")
+# Typical pbs.twimg.com bytes per pixel; only used to estimate transfer size
+BYTES_PER_PIXEL = {"jpg": 0.35, "png": 1.6}
+
+
+def variant_name(url):
+    return url.rsplit("name=", 1)[-1] if "name=" in url else "orig"
+
+
+def estimated_bytes(media, name):
+    w, h = _dimensions(media)[name]
+    ext = media["media_url_https"].rsplit(".", 1)[-1]
+    return w * h * BYTES_PER_PIXEL.get(ext, 0.35)
+
+
+def synthetic(w, h, ext):
+    img = Image.effect_noise((w, h), 40).convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG" if ext == "png" else "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def main(fixture, encode_count):
+    with open(fixture) as f:
+        media_list = json.load(f)
+
+    totals = {"orig_px": 0, "variant_px": 0, "orig_bytes": 0.0, "variant_bytes": 0.0, "orig_reencode": 0, "variant_reencode": 0}
+    chosen = {}
+    start = time.perf_counter()
+    selections = [select_variant(media) for media in media_list]
+    select_us = (time.perf_counter() - start) / len(media_list) * 1e6
+
+    for media, url in zip(media_list, selections):
+        name = variant_name(url)
+        chosen[name] = chosen.get(name, 0) + 1
+        dims = _dimensions(media)
+        totals["orig_px"] += dims["orig"][0] * dims["orig"][1]
+        totals["variant_px"] += dims[name][0] * dims[name][1]
+        orig_bytes, variant_bytes = estimated_bytes(media, "orig"), estimated_bytes(media, name)
+        totals["orig_bytes"] += orig_bytes
+        totals["variant_bytes"] += variant_bytes
+        totals["orig_reencode"] += orig_bytes > MAX_BLOB_BYTES
+        totals["variant_reencode"] += variant_bytes > MAX_BLOB_BYTES
+
+    print(f"{len(media_list)} photos, selection {select_us:.1f}us each, variants chosen: {chosen}\n")
+    print(f"{'':<22}{'original':>14}{'variant':>14}{'saved':>8}")
+    print(f"{'megapixels fetched':<22}{totals['orig_px'] / 1e6:>14.1f}{totals['variant_px'] / 1e6:>14.1f}{1 - totals['variant_px'] / totals['orig_px']:>8.0%}")
+    print(f"{'est. MB downloaded':<22}{totals['orig_bytes'] / 2**20:>14.1f}{totals['variant_bytes'] / 2**20:>14.1f}{1 - totals['variant_bytes'] / totals['orig_bytes']:>8.0%}")
+    print(f"{'need re-encode (est.)':<22}{totals['orig_reencode']:>14}{totals['variant_reencode']:>14}")
+
+    if encode_count:
+        orig_ms = variant_ms = 0.0
+        for media, url in list(zip(media_list, selections))[:encode_count]:
+            ext = media["media_url_https"].rsplit(".", 1)[-1]
+            dims = _dimensions(media)
+            for key, name in (("orig", "orig"), ("variant", variant_name(url))):
+                data = synthetic(*dims[name], ext)
+                t0 = time.perf_counter()
+                if len(data) > MAX_BLOB_BYTES:
+                    encode_image(data)
+                elapsed = (time.perf_counter() - t0) * 1000
+                if key == "orig":
+                    orig_ms += elapsed
+                else:
+                    variant_ms += elapsed
+        print(f"{'encode CPU ms':<22}{orig_ms:>14.0f}{variant_ms:>14.0f}{1 - variant_ms / orig_ms if orig_ms else 0:>8.0%}  (first {encode_count} photos)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--encode", type=int, default=0, help="also time the encoder on this many photos")
+    args = parser.parse_args()
+    main(args.fixture, args.encode)
@@ -0,0 +1,270 @@
+"""
+Load driver for the Bluesky posting engine against the fake PDS server.
+
+Starts `python -m bench.fakePds` on a free local port (or uses --url) and runs
+many concurrent migrations through the real path: handle resolution,
+bsky_sessions login and token refresh, image preparation, batch_upload_images,
+BatchPoster and AccountRateLimiter. Media is served from synthetic fixtures
+(see twitterFixtures.py). Reports throughput, client-side latency per XRPC
+method, 429s, and time spent waiting in the rate limiter.
+
+--time-scale compresses the PDS rate limit windows and the limiter's windows
+alike, so budgets are reached in a short run:
+
+    python -m bench.pdsLoad --migrations 40 --posts 200 --concurrency 20
+    python -m bench.pdsLoad --migrations 10 --posts 1500 --time-scale 60 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# State files of the engine, kept inside the run's temporary directory
+STATE_ENV = {
+    "BLOB_CACHE_PATH": "blobs.db",
+    "JOURNAL_DIR": "journals",
+    "NOTIFY_OUTBOX_PATH": "notifications.db",
+    "BSKY_SESSION_PATH": "bsky_sessions.db",
+    "SESSION_ENCRYPTION_KEY": "",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_server(args):
+    """Fake PDS in a child process, so its work doesn't share the driver's event loop"""
+    port = free_port()
+    command = [
+        sys.executable, "-m", "bench.fakePds", "--port", str(port),
+        "--latency", str(args.latency), "--latency-p99", str(args.latency_p99),
+        "--per-write-latency", str(args.per_write_latency), "--per-mb-latency", str(args.per_mb_latency),
+        "--time-scale", str(args.time_scale), "--error-rate", str(args.error_rate), "--access-ttl", str(args.access_ttl),
+    ]
+    if args.no_budget:
+        command.append("--no-budget")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR)
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{url}/_stats")
+                return process, url
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("The fake PDS did not start")
+
+
+def build_threads(migration: int, posts: int, media_ratio: float, rng: random.Random):
+    """Threads of 1-6 posts; returns them and the media paths they use"""
+    threads = []
+    media = {}
+    created_at = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    post = 0
+    while post < posts:
+        thread = []
+        for _ in range(min(rng.choice([1, 1, 1, 2, 3, 6]), posts - post)):
+            tweet_id = f"{migration:04d}{post:06d}"
+            media_urls = []
+            if rng.random() < media_ratio:
+                for index in range(rng.choice([1, 1, 2, 4])):
+                    path = f"/media/L{tweet_id}{index}"
+                    media[path] = rng.random() < 0.125
+                    media_urls.append(f"https://pbs.twimg.com{path}?format=jpg&name=medium")
+            thread.append({
+                "id": tweet_id,
+                "created_at_datetime": created_at + timedelta(minutes=post),
+                "text": f"Load test post {post} of migration {migration}",
+                "facets": [],
+                "media_urls": media_urls,
+                "in_reply_to": thread[-1]["id"] if thread else None,
+            })
+            post += 1
+        threads.append(thread)
+    return threads, media
+
+
+def percentiles(samples):
+    if not samples:
+        return "-"
+    samples = sorted(samples)
+    pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+    return f"p50 {pick(0.5):7.1f}ms  p95 {pick(0.95):7.1f}ms  p99 {pick(0.99):7.1f}ms  max {samples[-1] * 1000:7.1f}ms"
+
+
+async def run(args, url):
+    from bench.latency import LatencyModel
+    from bench.twitterFixtures import SyntheticMedia
+    from bench.twitterReplay import Cassette, ReplayTransport
+    from rateLimiter import AccountRateLimiter
+
+    import bluesky
+    from blueskySessions import bsky_sessions
+    from imageWorkers import image_workers
+
+    rng = random.Random(args.seed)
+    workload = []
+    screenshots = {}
+    for migration in range(args.migrations):
+        threads, media = build_threads(migration, args.posts, args.media_ratio, rng)
+        workload.append(threads)
+        screenshots.update(media)
+
+    media_transport = ReplayTransport(Cassette(media=SyntheticMedia(screenshots, args.seed)), media_latency=LatencyModel(0.02, 0.1))
+    bluesky.http_client_pool = httpx.AsyncClient(transport=media_transport)
+
+    # Every DID lives on the fake PDS
+    async def resolve_pds(did):
+        return url
+
+    bsky_sessions.resolve_pds = resolve_pds
+
+    # Client-side latency per XRPC method, on every client the engine logs in with
+    latencies = defaultdict(list)
+    instrumented = set()
+
+    async def on_request(request):
+        request.extensions["started"] = time.perf_counter()
+
+    async def on_response(response):
+        method = response.request.url.path.rsplit(".", 1)[-1]
+        latencies[method].append(time.perf_counter() - response.request.extensions["started"])
+
+    login = bluesky.login
+
+    async def instrumented_login(handle, password, did=None):
+        client = await login(handle, password, did)
+        http = client.request._client
+        if id(http) not in instrumented:
+            instrumented.add(id(http))
+            http.event_hooks["request"].append(on_request)
+            http.event_hooks["response"].append(on_response)
+        return client
+
+    bluesky.login = instrumented_login
+
+    # The engine's limiter, on the same (compressed) windows as the PDS
+    limiter = AccountRateLimiter(hourly_window=3600 / args.time_scale, daily_window=86400 / args.time_scale)
+    waits = []
+    acquire = limiter.acquire
+
+    async def timed_acquire(account_id, points):
+        started = time.perf_counter()
+        try:
+            return await acquire(account_id, points)
+        finally:
+            waits.append(time.perf_counter() - started)
+
+    limiter.acquire = timed_acquire
+    bluesky.rate_limiter = limiter
+
+    if not args.verbose:
+        for name in ("bluesky_migration", "httpx"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    async with httpx.AsyncClient(base_url=url) as pds:
+        handles = [f"load{i}.test" for i in range(args.migrations)]
+        dids = []
+        for handle in handles:
+            response = await pds.get("/xrpc/com.atproto.identity.resolveHandle", params={"handle": handle})
+            dids.append(response.json()["did"])
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        durations = []
+        failures = []
+
+        async def migrate(i):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await bluesky.migrateTweetsToBluesky(workload[i], handles[i], "app-password", dids[i], f"load-{i}", resume=False)
+                    durations.append(time.perf_counter() - started)
+                except Exception as e:
+                    failures.append(f"{handles[i]}: {e}")
+
+        print(f"Running {args.migrations} migrations of {args.posts} posts, {args.concurrency} at a time against {url}")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            started = time.perf_counter()
+            await asyncio.gather(*[migrate(i) for i in range(args.migrations)])
+            elapsed = time.perf_counter() - started
+        stats = (await pds.get("/_stats")).json()
+
+    await bluesky.http_client_pool.aclose()
+    image_workers.shutdown()
+
+    posted = stats["records"]
+    print(f"{args.migrations} migrations x {args.posts} posts, concurrency {args.concurrency}, "
+          f"PDS latency {args.latency * 1000:.0f}ms (p99 {args.latency_p99 * 1000:.0f}ms), time scale {args.time_scale:g}")
+    print(f"  wall time        {elapsed:8.1f}s")
+    print(f"  posts            {posted:8d}  {posted / elapsed:8.1f}/s")
+    images = sum(len(tweet["media_urls"]) for threads in workload for thread in threads for tweet in thread)
+    print(f"  blobs            {stats['blobs']:8d}  {stats['blobs'] / elapsed:8.1f}/s  ({images} images in the workload)")
+    print(f"  migrations       {len(durations):8d} ok, {len(failures)} failed; duration {percentiles(durations)}")
+    print(f"  sessions         {stats['sessions_created']:8d} created, {stats['refreshes']} refreshed, {stats['rejected_tokens']} tokens rejected")
+    limiter_waited = [w for w in waits if w > 0.001]
+    print(f"  rate limiter     {len(waits):8d} acquisitions, {len(limiter_waited)} waited, "
+          f"{sum(waits):.1f}s total; {percentiles(waits)}")
+    rate_limited = ", ".join(f"{route} {count}" for route, count in stats["rate_limited"].items()) or "none"
+    print(f"  429s             {rate_limited}")
+    print("  client latency")
+    for method in sorted(latencies):
+        print(f"    {method:<16} {len(latencies[method]):6d} calls  {percentiles(latencies[method])}")
+    for failure in failures[:5]:
+        print(f"  !! {failure}")
+
+
+async def main(args):
+    process = None
+    url = args.url
+    if not url:
+        process, url = await start_server(args)
+    try:
+        await run(args, url)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    from bench.fakePds import add_pds_arguments
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--migrations", type=int, default=40)
+    parser.add_argument("--posts", type=int, default=200, help="Posts per migration")
+    parser.add_argument("--concurrency", type=int, default=20, help="Migrations running at once")
+    parser.add_argument("--media-ratio", type=float, default=0.2, help="Fraction of posts with images")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show the engine's output")
+    parser.add_argument("--url", help="A fake PDS already running (its own options then apply instead of the ones below)")
+    add_pds_arguments(parser)
+    args = parser.parse_args()
+
+    # Keep the engine's state files out of the working tree
+    sys.path.insert(0, BACKEND_DIR)
+    workdir = tempfile.TemporaryDirectory(prefix="pds-load-")
+    os.environ.update(STATE_ENV)
+    os.chdir(workdir.name)
+    try:
+        asyncio.run(main(args))
+    finally:
+        os.chdir(BACKEND_DIR)
+        workdir.cleanup()
@@ -0,0 +1,96 @@
+"""
+Posting throughput benchmark: one createRecord per post (previous engine)
+versus the batched applyWrites engine, against the in-process fake PDS.
+
+    python -m bench.postingBench --posts 1000 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from atproto import models
+
+from batchPoster import BatchPoster
+from bench.fakePds import FakePDS, make_client
+from rateLimiter import AccountRateLimiter
+
+
+def build_threads(posts: int, thread_length: int):
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+    threads = []
+    for start in range(0, posts, thread_length):
+        threads.append([f"post {i}" for i in range(start, min(start + thread_length, posts))])
+    return threads, created_at
+
+
+def make_record(text, created_at, root, parent):
+    reply = None
+    if parent:
+        reply = {"root": root, "parent": parent}
+    return models.AppBskyFeedPost.Record(text=text, created_at=created_at, reply=reply)
+
+
+async def run_sequential(pds, threads, created_at):
+    client = make_client(pds)
+    await client.login("bench.test", "password")
+    for thread in threads:
+        root = parent = None
+        for text in thread:
+            resp = await client.app.bsky.feed.post.create(client.me.did, make_record(text, created_at, root, parent))
+            parent = {"uri": resp.uri, "cid": resp.cid}
+            root = root or parent
+
+
+async def run_batched(pds, threads, created_at, batch_size):
+    client = make_client(pds)
+    await client.login("bench.test", "password")
+    poster = BatchPoster(client, client.me.did, AccountRateLimiter(hourly_limit=10**9, daily_limit=10**9), batch_size=batch_size)
+    for thread in threads:
+        root = parent = None
+        for text in thread:
+            parent = poster.add(make_record(text, created_at, root, parent), root=root)
+            root = root or parent
+            await poster.flush_if_full()
+    await poster.flush()
+    return poster
+
+
+async def measure(name, pds, coro, posts):
+    requests_before = pds.requests
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {posts / elapsed:>8.1f} posts/s  {elapsed:>7.2f}s  {pds.requests - requests_before:>5} HTTP calls")
+    return result
+
+
+async def main(posts, thread_length, latency, batch_sizes):
+    threads, created_at = build_threads(posts, thread_length)
+    print(f"{posts} posts in threads of {thread_length}, {latency * 1000:.0f}ms PDS latency\n")
+
+    pds = FakePDS(latency=latency, hourly_points=None, daily_points=None)
+    await measure("createRecord (1/post)", pds, run_sequential(pds, threads, created_at), posts)
+
+    for batch_size in batch_sizes:
+        pds = FakePDS(latency=latency, hourly_points=None, daily_points=None)
+        await measure(f"applyWrites (batch {batch_size})", pds, run_batched(pds, threads, created_at, batch_size), posts)
+
+        # Every reply must point at the exact record the fake PDS stored for its parent
+        broken = sum(
+            1 for record in pds.records.values()
+            if record.get("reply") and pds.record_cids.get(record["reply"]["parent"]["uri"]) != record["reply"]["parent"]["cid"]
+        )
+        if broken:
+            print(f"  !! {broken} replies reference a parent CID that does not match the stored record")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--thread-length", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated PDS round-trip latency in seconds")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 25, 100])
+    args = parser.parse_args()
+    asyncio.run(main(args.posts, args.thread_length, args.latency, args.batch_sizes))
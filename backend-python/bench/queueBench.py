@@ -0,0 +1,105 @@
+"""
+Queue benchmark: enqueue/dequeue latency of the persistent job queue
+compared to the in-memory asyncio.Queue it replaced.
+
+    python -m bench.queueBench --jobs 5000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from jobQueue import MemoryJobQueue, SQLiteJobQueue
+
+SAMPLE_JOB = {
+    "migrationId": "bench",
+    "twitterName": "someone",
+    "bskyHandle": "someone.bsky.social",
+    "password": "xxxx-xxxx-xxxx-xxxx",
+    "limit": 800,
+    "threadUrls": None,
+    "did": "did:plc:benchbenchbenchbench",
+    "task_type": "posts",
+}
+
+
+def summarize(name, put_latencies, get_latencies, elapsed_put, elapsed_get):
+    def pct(values, p):
+        values = sorted(values)
+        return values[min(int(len(values) * p), len(values) - 1)] * 1e6
+
+    jobs = len(put_latencies)
+    print(f"{name:<16} enqueue {jobs / elapsed_put:>9.0f}/s  p50 {pct(put_latencies, 0.5):>7.1f}us  p99 {pct(put_latencies, 0.99):>7.1f}us"
+          f" | dequeue+ack {jobs / elapsed_get:>9.0f}/s  p50 {pct(get_latencies, 0.5):>7.1f}us  p99 {pct(get_latencies, 0.99):>7.1f}us"
+          f"  mean {statistics.mean(get_latencies) * 1e6:.1f}us")
+
+
+async def bench_asyncio_queue(jobs):
+    queue = asyncio.Queue()
+    put_latencies, get_latencies = [], []
+
+    start = time.perf_counter()
+    for _ in range(jobs):
+        t0 = time.perf_counter()
+        await queue.put(dict(SAMPLE_JOB))
+        put_latencies.append(time.perf_counter() - t0)
+    elapsed_put = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(jobs):
+        t0 = time.perf_counter()
+        await queue.get()
+        queue.task_done()
+        get_latencies.append(time.perf_counter() - t0)
+    elapsed_get = time.perf_counter() - start
+
+    summarize("asyncio.Queue", put_latencies, get_latencies, elapsed_put, elapsed_get)
+
+
+async def bench_job_queue(name, queue, jobs, concurrency):
+    put_latencies, get_latencies = [], []
+
+    async def producer(count):
+        for _ in range(count):
+            t0 = time.perf_counter()
+            await queue.put(dict(SAMPLE_JOB))
+            put_latencies.append(time.perf_counter() - t0)
+
+    async def consumer(count, worker):
+        for _ in range(count):
+            t0 = time.perf_counter()
+            job = await queue.lease(worker)
+            await queue.ack(job)
+            get_latencies.append(time.perf_counter() - t0)
+
+    per_task = jobs // concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*[producer(per_task) for _ in range(concurrency)])
+    elapsed_put = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[consumer(per_task, f"bench-{i}") for i in range(concurrency)])
+    elapsed_get = time.perf_counter() - start
+
+    summarize(name, put_latencies, get_latencies, elapsed_put, elapsed_get)
+    await queue.close()
+
+
+async def main(jobs, concurrency):
+    print(f"{jobs} jobs, {concurrency} concurrent producers/consumers for the job queues\n")
+    await bench_asyncio_queue(jobs)
+    await bench_job_queue("MemoryJobQueue", MemoryJobQueue(), jobs, concurrency)
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteJobQueue(os.path.join(tmp, "bench.db"))
+        await bench_job_queue("SQLiteJobQueue", queue, jobs, concurrency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.jobs, args.concurrency))
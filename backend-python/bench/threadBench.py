@@ -0,0 +1,167 @@
+"""
+Thread reconstruction benchmark over a synthetic "Replies" timeline.
+
+The timeline mixes standalone tweets, deep self-threads (some branching),
+replies to other people with follow-ups, and retweets with self-replies
+under them. Pages come newest first with a shuffled order inside each page,
+as conversation modules do. Compares ThreadBuilder with the per-reply scan
+of the threads collected so far that process_replies did, and checks the
+threads it builds.
+
+    python -m bench.threadBench --tweets 3200 --max-depth 400
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from threadBuilder import SKIPPED_REPLY, ThreadBuilder
+
+PAGE_SIZE = 40
+
+
+def synthetic_timeline(tweets, max_depth, seed=1):
+    """(newest-first tweet list, {root id: expected thread ids}, ids that must not be posted)"""
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    timeline = []
+    expected = {}
+    dropped = set()
+    next_id = 1_000_000_000_000_000_000
+
+    def new_tweet(in_reply_to=None, **extra):
+        nonlocal next_id
+        next_id += rng.randint(1, 10_000)
+        tweet = {
+            "id": str(next_id),
+            "created_at_datetime": start + timedelta(seconds=len(timeline)),
+            "text": f"tweet {len(timeline)}",
+            "facets": [],
+            "media_urls": [],
+            "in_reply_to": in_reply_to,
+        }
+        tweet.update(extra)
+        timeline.append(tweet)
+        return tweet
+
+    while len(timeline) < tweets:
+        kind = rng.random()
+        if kind < 0.55:
+            root = new_tweet()
+            expected[root["id"]] = [root["id"]]
+        elif kind < 0.8:
+            # Self-thread, occasionally branching off an earlier tweet
+            depth = min(rng.choice([2, 3, 5, 10, 25, max_depth]), tweets - len(timeline))
+            root = new_tweet()
+            ids = [root["id"]]
+            for _ in range(depth - 1):
+                parent = ids[-1] if rng.random() > 0.05 else rng.choice(ids)
+                ids.append(new_tweet(parent)["id"])
+            expected[root["id"]] = ids
+        elif kind < 0.9:
+            # Reply to someone else, then the user's own follow-ups under it
+            reply = new_tweet(str(rng.randint(1, 10**18)), skipped=SKIPPED_REPLY)
+            dropped.add(reply["id"])
+            parent = reply["id"]
+            for _ in range(rng.randint(0, 3)):
+                parent = new_tweet(parent)["id"]
+                dropped.add(parent)
+        else:
+            # Retweet (not migrated); a self-reply under it starts its own thread
+            retweet = new_tweet(skipped="repost")
+            dropped.add(retweet["id"])
+            if rng.random() < 0.5:
+                head = new_tweet(retweet["id"])
+                expected[head["id"]] = [head["id"]]
+
+    for tweet in timeline:
+        if tweet.get("skipped"):
+            # The markers format_timeline_tweet returns carry nothing else
+            for key in ("created_at_datetime", "text", "facets", "media_urls", "in_reply_to"):
+                tweet.pop(key)
+
+    timeline.reverse()
+    pages = []
+    for i in range(0, len(timeline), PAGE_SIZE):
+        page = timeline[i:i + PAGE_SIZE]
+        rng.shuffle(page)
+        pages.append(page)
+    return pages, expected, dropped
+
+
+def build_with_index(pages):
+    builder = ThreadBuilder()
+    threads = []
+    for page in pages:
+        for tweet in page:
+            builder.add(tweet)
+        threads.extend(builder.take())
+    threads.extend(builder.flush())
+    return threads
+
+
+def build_with_scan(pages):
+    """The previous approach: each reply looks for its parent by scanning the threads built so far"""
+    tweets = sorted((tweet for page in pages for tweet in page), key=lambda tweet: int(tweet["id"]))
+    threads = []
+    dropped = set()
+    for tweet in tweets:
+        parent = tweet.get("in_reply_to")
+        if tweet.get("skipped") == SKIPPED_REPLY or parent in dropped:
+            dropped.add(tweet["id"])
+            continue
+        if tweet.get("skipped"):
+            continue
+        for thread in threads:
+            if any(str(t["id"]) == str(parent) for t in thread):
+                thread.append(tweet)
+                break
+        else:
+            threads.append([tweet])
+    threads.reverse()
+    return threads
+
+
+def check(threads, expected, dropped):
+    seen = set()
+    for thread in threads:
+        ids = [tweet["id"] for tweet in thread]
+        assert ids[0] in expected, f"unexpected thread root {ids[0]}"
+        assert sorted(ids, key=int) == sorted(expected[ids[0]], key=int), f"thread {ids[0]} is incomplete"
+        position = {tweet_id: i for i, tweet_id in enumerate(ids)}
+        for tweet in thread[1:]:
+            assert position[tweet["in_reply_to"]] < position[tweet["id"]], "reply posted before its parent"
+        seen.update(ids)
+    assert not seen & dropped, "a reply to someone else (or a follow-up to it) was kept"
+    assert len(seen) == sum(len(ids) for ids in expected.values()), "a tweet was posted twice or lost"
+    roots = [int(thread[0]["id"]) for thread in threads]
+    assert roots == sorted(roots, reverse=True), "threads are not newest first"
+
+
+def run(name, build, pages, expected, dropped, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        threads = build(pages)
+        timings.append(time.perf_counter() - started)
+    check(threads, expected, dropped)
+    best = min(timings)
+    tweets = sum(len(page) for page in pages)
+    print(f"{name:<8} {best * 1000:>9.2f} ms  {tweets / best:>12,.0f} tweets/s  {len(threads)} threads")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=3200)
+    parser.add_argument("--max-depth", type=int, default=400, help="Length of the deepest self-threads")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages, expected, dropped = synthetic_timeline(args.tweets, args.max_depth)
+    longest = max(len(ids) for ids in expected.values())
+    print(f"{args.tweets} tweets in {len(pages)} pages, {len(expected)} threads (longest {longest}), {len(dropped)} not migrated")
+    index = run("index", build_with_index, pages, expected, dropped, args.repeat)
+    scan = run("scan", build_with_scan, pages, expected, dropped, max(1, args.repeat // 5))
+    print(f"speedup  {scan / index:.0f}x")
@@ -0,0 +1,324 @@
+"""
+Synthetic Twitter cassettes for the replay harness (see twitterReplay.py),
+built in the shape twikit parses from the live GraphQL API, so the suite
+runs in CI without a recorded fixture.
+
+- A "Replies" timeline of N tweets in pages of 40 entries: standalone
+  tweets, self-threads (as separate entries and as conversation modules),
+  replies to other accounts with the account's follow-ups, retweets, t.co
+  links and photos with their size metadata
+- UserByScreenName for the account, and TweetDetail for a few thread URLs
+  of another account plus one pointing into the account's own timeline
+- Media generated on request from a few base photos and screenshots (one
+  in eight above the Bluesky blob limit); every URL gets distinct bytes
+"""
+
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Dict, List, Mapping
+
+from PIL import Image
+
+from bench.twitterReplay import Cassette, media_key
+
+SCREEN_NAME = "benchaccount"
+USER_ID = "1000001"
+FRIEND_NAME = "benchfriend"
+FRIEND_ID = "1000002"
+PAGE_ENTRIES = 40
+FIRST_TWEET_ID = 1_600_000_000_000_000_000
+START_TIME = datetime(2022, 1, 1, tzinfo=timezone.utc)
+FRIEND_THREADS = 5
+
+
+def _timestamp(tweet_id: int) -> str:
+    return (START_TIME + timedelta(minutes=(tweet_id - FIRST_TWEET_ID) // 1000)).strftime("%a %b %d %H:%M:%S %z %Y")
+
+
+def user_result(user_id: str, screen_name: str) -> Dict:
+    return {
+        "__typename": "User",
+        "rest_id": user_id,
+        "is_blue_verified": False,
+        "legacy": {
+            "created_at": "Mon Jan 04 10:00:00 +0000 2010",
+            "name": screen_name.title(),
+            "screen_name": screen_name,
+            "profile_image_url_https": f"https://pbs.twimg.com/profile_images/{user_id}/avatar_normal.jpg",
+            "location": "",
+            "description": "Benchmark account",
+            "entities": {"description": {"urls": []}},
+            "pinned_tweet_ids_str": [],
+            "verified": False,
+            "possibly_sensitive": False,
+            "can_dm": False,
+            "can_media_tag": True,
+            "want_retweets": False,
+            "default_profile": True,
+            "default_profile_image": False,
+            "has_custom_timelines": False,
+            "followers_count": 1200,
+            "fast_followers_count": 0,
+            "normal_followers_count": 1200,
+            "friends_count": 300,
+            "favourites_count": 5000,
+            "listed_count": 10,
+            "media_count": 400,
+            "statuses_count": 3200,
+            "is_translator": False,
+            "translator_type": "none",
+            "withheld_in_countries": [],
+        },
+    }
+
+
+def tweet_result(tweet_id: int, user: Dict, text: str, reply_to: int = None, reply_to_user: str = None,
+                 urls: List[Dict] = (), media: List[Dict] = ()) -> Dict:
+    entities = {"hashtags": [], "urls": list(urls), "user_mentions": [], "symbols": []}
+    if media:
+        entities["media"] = list(media)
+    return {
+        "__typename": "Tweet",
+        "rest_id": str(tweet_id),
+        "core": {"user_results": {"result": user}},
+        "edit_control": {"editable_until_msecs": "0", "is_edit_eligible": False, "edits_remaining": "5"},
+        "is_translatable": False,
+        "views": {"state": "Enabled", "count": "100"},
+        "legacy": {
+            "created_at": _timestamp(tweet_id),
+            "full_text": text,
+            "lang": "en",
+            "is_quote_status": False,
+            "quote_count": 0,
+            "reply_count": 0,
+            "favorite_count": 3,
+            "favorited": False,
+            "retweet_count": 0,
+            "entities": entities,
+            "in_reply_to_status_id_str": str(reply_to) if reply_to else None,
+            "in_reply_to_user_id_str": reply_to_user,
+            "user_id_str": user["rest_id"],
+            "id_str": str(tweet_id),
+        },
+    }
+
+
+def _item(result: Dict) -> Dict:
+    return {"itemType": "TimelineTweet", "tweet_results": {"result": result}, "tweetDisplayType": "Tweet"}
+
+
+def tweet_entry(result: Dict) -> Dict:
+    return {"entryId": f"tweet-{result['rest_id']}", "sortIndex": result["rest_id"],
+            "content": {"entryType": "TimelineTimelineItem", "itemContent": _item(result)}}
+
+
+def conversation_entry(results: List[Dict], prefix: str = "profile-conversation", display_type: str = None) -> Dict:
+    entry_id = f"{prefix}-{results[0]['rest_id']}"
+    items = []
+    for result in results:
+        item = _item(result)
+        if display_type:
+            item["tweetDisplayType"] = display_type
+        items.append({"entryId": f"{entry_id}-tweet-{result['rest_id']}", "item": {"itemContent": item}})
+    return {"entryId": entry_id, "sortIndex": results[-1]["rest_id"],
+            "content": {"entryType": "TimelineTimelineModule", "displayType": "VerticalConversation", "items": items}}
+
+
+def cursor_entry(kind: str, value: str) -> Dict:
+    return {"entryId": f"cursor-{kind.lower()}-{value}", "sortIndex": "0",
+            "content": {"entryType": "TimelineTimelineCursor", "value": value, "cursorType": kind}}
+
+
+def timeline_response(entries: List[Dict]) -> Dict:
+    return {"data": {"user": {"result": {"__typename": "User", "timeline_v2": {"timeline": {"instructions": [
+        {"type": "TimelineClearCache"},
+        {"type": "TimelineAddEntries", "entries": entries},
+    ]}}}}}}
+
+
+def media_entity(tweet_id: int, index: int, rng: random.Random) -> Dict:
+    landscape = rng.random() < 0.7
+    width, height = (rng.choice([1600, 2048, 4096]), rng.choice([900, 1152, 2304])) if landscape else (1080, 1350)
+    sizes = {"thumb": {"w": 150, "h": 150, "resize": "crop"}}
+    for name, bound in (("small", 680), ("medium", 1200), ("large", 2048)):
+        ratio = min(1.0, bound / max(width, height))
+        sizes[name] = {"w": round(width * ratio), "h": round(height * ratio), "resize": "fit"}
+    name = f"B{tweet_id % 10**12:012d}{index}"
+    screenshot = rng.random() < 0.125
+    return {
+        "type": "photo",
+        "id_str": f"{tweet_id}{index}",
+        "media_url_https": f"https://pbs.twimg.com/media/{name}.{'png' if screenshot else 'jpg'}",
+        "url": f"https://t.co/m{tweet_id % 10**8}",
+        "original_info": {"width": width, "height": height},
+        "sizes": sizes,
+    }
+
+
+class _TimelineWriter:
+    """Lays out the account's tweets newest first, in timeline entries"""
+
+    def __init__(self, tweets: int, seed: int):
+        self.rng = random.Random(seed)
+        self.target = tweets
+        self.written = 0
+        self.next_id = FIRST_TWEET_ID
+        self.user = user_result(USER_ID, SCREEN_NAME)
+        self.friend = user_result(FRIEND_ID, FRIEND_NAME)
+        self.media = []
+        self.entries = []  # oldest first while writing
+        self.self_threads = []
+
+    def _id(self) -> int:
+        self.next_id += self.rng.randint(1_000, 9_000)
+        return self.next_id
+
+    def _own(self, text: str, reply_to: int = None, reply_to_user: str = None) -> Dict:
+        tweet_id = self._id()
+        urls = []
+        media = []
+        roll = self.rng.random()
+        if roll < 0.2:
+            link = f"https://t.co/{tweet_id % 10**10:010d}"
+            urls.append({"url": link, "expanded_url": f"https://example.com/posts/{tweet_id}", "display_url": "example.com/posts/…", "indices": [0, 0]})
+            text = f"{text} {link}"
+        elif roll < 0.45:
+            media = [media_entity(tweet_id, i, self.rng) for i in range(self.rng.choice([1, 1, 1, 2, 4]))]
+            self.media.extend(media)
+            text = f"{text} {media[0]['url']}"
+        self.written += 1
+        return tweet_result(tweet_id, self.user, text, reply_to, reply_to_user, urls, media)
+
+    def _filler(self, words: int) -> str:
+        vocabulary = ("migrating", "bluesky", "thread", "timeline", "photo", "today", "weekend", "coffee", "release", "notes")
+        return " ".join(self.rng.choice(vocabulary) for _ in range(words))
+
+    def write(self):
+        """Timeline entries newest first"""
+        # Written oldest first (ids grow), reversed at the end as on the profile
+        while self.written < self.target:
+            roll = self.rng.random()
+            left = self.target - self.written
+            if roll < 0.55 or left < 2:
+                self.entries.append(tweet_entry(self._own(self._filler(self.rng.randint(5, 40)))))
+            elif roll < 0.75:
+                length = min(self.rng.randint(2, 8), left)
+                thread = [self._own(f"1/ {self._filler(20)}")]
+                for position in range(2, length + 1):
+                    thread.append(self._own(f"{position}/ {self._filler(25)}", int(thread[-1]["rest_id"]), USER_ID))
+                self.self_threads.append(thread[0]["rest_id"])
+                if self.rng.random() < 0.5:
+                    self.entries.append(conversation_entry(thread))
+                else:
+                    self.entries.extend(tweet_entry(tweet) for tweet in thread)
+            elif roll < 0.9:
+                other = tweet_result(self._id(), self.friend, self._filler(12))
+                reply = self._own(f"@{FRIEND_NAME} {self._filler(10)}", int(other["rest_id"]), FRIEND_ID)
+                conversation = [other, reply]
+                if self.rng.random() < 0.3 and left > 2:
+                    conversation.append(self._own(self._filler(8), int(reply["rest_id"]), USER_ID))
+                self.entries.append(conversation_entry(conversation))
+            else:
+                retweet = tweet_result(self._id(), self.user, f"RT @{FRIEND_NAME}: {self._filler(15)}")
+                self.written += 1
+                self.entries.append(tweet_entry(retweet))
+        self.entries.reverse()
+        return self.entries
+
+
+def _thread_detail(focal: List[Dict], focal_index: int = 0) -> Dict:
+    """TweetDetail around focal[focal_index]: ancestors, the tweet, then its self-thread continuation"""
+    entries = [tweet_entry(tweet) for tweet in focal[:focal_index + 1]]
+    rest = focal[focal_index + 1:]
+    if rest:
+        entries.append(conversation_entry(rest, prefix="conversationthread", display_type="SelfThread"))
+    return {"data": {"threaded_conversation_with_injections_v2": {"instructions": [
+        {"type": "TimelineAddEntries", "entries": entries},
+    ]}}}
+
+
+def _variables(**variables) -> str:
+    return json.dumps(variables, sort_keys=True)
+
+
+def build_cassette(tweets: int, seed: int = 7) -> Cassette:
+    """Cassette for a `tweets`-tweet timeline; meta names the account and the thread URLs it serves"""
+    writer = _TimelineWriter(tweets, seed)
+    entries = writer.write()
+    responses = {}
+
+    def store(operation: str, body: Dict, **variables):
+        responses[f"{operation} {_variables(**variables)}"] = {"status": 200, "body": json.dumps(body)}
+
+    store("UserByScreenName", {"data": {"user": {"result": writer.user}}}, screen_name=SCREEN_NAME)
+
+    pages = [entries[i:i + PAGE_ENTRIES] for i in range(0, len(entries), PAGE_ENTRIES)] + [[]]
+    for number, page in enumerate(pages):
+        top = f"top-{number}"
+        bottom = f"page-{number + 1}"
+        variables = {"userId": USER_ID} if number == 0 else {"userId": USER_ID, "cursor": f"page-{number}"}
+        store("UserTweetsAndReplies", timeline_response([*page, cursor_entry("Top", top), cursor_entry("Bottom", bottom)]), **variables)
+
+    # Thread URLs: threads of another account, a duplicate, and one into the account's own timeline
+    thread_urls = []
+    rng = random.Random(seed + 1)
+    next_id = FIRST_TWEET_ID + tweets * 20_000
+    for number in range(FRIEND_THREADS):
+        thread = []
+        for position in range(rng.randint(3, 8)):
+            next_id += rng.randint(1_000, 9_000)
+            reply_to = int(thread[-1]["rest_id"]) if thread else None
+            thread.append(tweet_result(next_id, writer.friend, f"{position + 1}/ thread by a friend", reply_to, FRIEND_ID if reply_to else None))
+        for index in (0, 1):
+            store("TweetDetail", _thread_detail(thread, index), focalTweetId=thread[index]["rest_id"])
+        if number == 1:
+            # A URL to a later tweet first: the root's URL is then served from the thread cache
+            thread_urls.append(f"https://x.com/{FRIEND_NAME}/status/{thread[1]['rest_id']}")
+        thread_urls.append(f"https://x.com/{FRIEND_NAME}/status/{thread[0]['rest_id']}")
+    thread_urls.append(thread_urls[0].replace("x.com", "twitter.com"))
+    if writer.self_threads:
+        thread_urls.append(f"https://x.com/{SCREEN_NAME}/status/{writer.self_threads[-1]}")
+
+    media = SyntheticMedia({media_key(entity["media_url_https"]): entity["media_url_https"].endswith(".png") for entity in writer.media}, seed)
+    return Cassette(responses, media, {
+        "screen_name": SCREEN_NAME,
+        "limit": tweets,
+        "thread_urls": thread_urls,
+        "synthetic": True,
+    })
+
+
+class SyntheticMedia(Mapping):
+    """Image bytes by media path, generated from a few base images when served"""
+
+    def __init__(self, screenshots: Dict[str, bool], seed: int):
+        self.screenshots = screenshots
+        self.keys = {key: index for index, key in enumerate(screenshots)}
+        self.seed = seed
+        self._bases = None
+
+    def _base_images(self) -> List[bytes]:
+        if self._bases is None:
+            bases = []
+            for index, (size, fmt) in enumerate((((1200, 900), "JPEG"), ((1600, 900), "JPEG"), ((1080, 1350), "JPEG"), ((1600, 1000), "PNG"))):
+                image = Image.effect_noise(size, 20 + index * 10).convert("RGB")
+                buffer = BytesIO()
+                image.save(buffer, format=fmt, **({"quality": 80} if fmt == "JPEG" else {}))
+                bases.append(buffer.getvalue())
+            self._bases = bases
+        return self._bases
+
+    def __getitem__(self, key: str) -> bytes:
+        index = self.keys[key]
+        bases = self._base_images()
+        # Screenshots are the oversized ones; the trailing bytes make each URL's content distinct
+        base = bases[3] if self.screenshots[key] else bases[index % 3]
+        return base + f"{self.seed}:{key}".encode()
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,278 @@
+"""
+Record/replay of Twitter traffic, so the fetch pipeline runs without cookies
+or network.
+
+- Recording hooks the httpx client of every twikit session and stores each
+  GraphQL response (body and rate limit headers) under a key built from the
+  operation and the variables that select the data (user, focal tweet,
+  cursor); the media of the fetched tweets is downloaded next to it
+- Replay swaps each session's httpx client for ReplayTransport: twikit still
+  builds and parses real requests and responses, and the pacer still reads
+  x-rate-limit-* headers. Latency is log-normal per request, and every
+  operation has a budget per window (the documented 15-minute budgets by
+  default, over a window that can be shortened) after which it answers 429
+- Media is served by URL path, whatever variant (?name=) is asked for
+
+Record a fixture (needs live cookies):
+
+    python -m bench.twitterReplay record --user someone --limit 800 --out bench/fixtures/someone
+
+Replay it in the benchmark suite:
+
+    python -m bench --fixture bench/fixtures/someone
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Mapping, MutableMapping, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from bench.latency import LatencyModel
+import twitterPacer
+from twitterPacer import DEFAULT_LIMITS, endpoint_from_url
+
+# Variables that decide what a GraphQL request returns; the rest are feature flags
+KEY_VARIABLES = ("screen_name", "userId", "focalTweetId", "tweetId", "tweetIds", "cursor")
+RESPONSES_FILE = "responses.json.gz"
+MEDIA_DIR = "media"
+USER_STATE_PATH = "/help-center/forms/api/prod/user_state.json"
+
+
+def request_key(url) -> Optional[str]:
+    """'Operation {selecting variables}' for a GraphQL URL, None for anything else"""
+    url = httpx.URL(str(url))
+    operation = endpoint_from_url(str(url))
+    if operation is None:
+        return None
+    variables = json.loads(url.params.get("variables") or "{}")
+    selected = {name: variables[name] for name in KEY_VARIABLES if name in variables}
+    return f"{operation} {json.dumps(selected, sort_keys=True)}"
+
+
+def media_key(url) -> str:
+    """A media file's path without extension: variants are asked for as ?format=jpg&name=..."""
+    return os.path.splitext(urlsplit(str(url)).path)[0]
+
+
+class Cassette:
+    """Recorded responses by request key, and media bytes by URL path"""
+
+    def __init__(self, responses: Optional[Dict[str, Dict[str, Any]]] = None, media: Optional[Mapping[str, bytes]] = None, meta: Optional[Dict[str, Any]] = None):
+        self.responses = responses if responses is not None else {}
+        self.media: MutableMapping[str, bytes] = media if media is not None else {}
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with gzip.open(os.path.join(path, RESPONSES_FILE), "rt") as f:
+            data = json.load(f)
+        return cls(data["responses"], _MediaFiles(os.path.join(path, MEDIA_DIR), data["media"]), data.get("meta"))
+
+    def save(self, path: str):
+        media_dir = os.path.join(path, MEDIA_DIR)
+        os.makedirs(media_dir, exist_ok=True)
+        index = {}
+        for key, content in self.media.items():
+            name = hashlib.sha1(key.encode()).hexdigest()
+            with open(os.path.join(media_dir, name), "wb") as f:
+                f.write(content)
+            index[key] = name
+        with gzip.open(os.path.join(path, RESPONSES_FILE), "wt") as f:
+            json.dump({"meta": self.meta, "responses": self.responses, "media": index}, f)
+
+
+class _MediaFiles(Mapping):
+    """Media of a saved cassette, read from disk when served"""
+
+    def __init__(self, directory: str, index: Dict[str, str]):
+        self.directory = directory
+        self.index = index
+
+    def __getitem__(self, key: str) -> bytes:
+        with open(os.path.join(self.directory, self.index[key]), "rb") as f:
+            return f.read()
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _Budget:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset_at = time.time() + window
+
+    def take(self) -> bool:
+        now = time.time()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "x-rate-limit-limit": str(self.limit),
+            "x-rate-limit-remaining": str(max(self.remaining, 0)),
+            "x-rate-limit-reset": str(math.ceil(self.reset_at)),
+        }
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves a cassette to one twikit session (budgets are per account, as on
+    Twitter). Unknown requests get a 404 and are counted in `misses`.
+    """
+
+    def __init__(self, cassette: Cassette, latency: Optional[LatencyModel] = None, media_latency: Optional[LatencyModel] = None,
+                 window: float = 15 * 60, limits: Optional[Dict[str, int]] = None):
+        self.cassette = cassette
+        self.latency = latency or LatencyModel(0.0)
+        self.media_latency = media_latency or LatencyModel(0.0)
+        self.window = window
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self._budgets: Dict[str, _Budget] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.misses = 0
+
+    def _budget(self, operation: str) -> _Budget:
+        budget = self._budgets.get(operation)
+        if budget is None:
+            limit = self.limits.get(operation, self.limits["default"])
+            budget = self._budgets[operation] = _Budget(limit, self.window)
+        return budget
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        url = request.url
+        if url.path == USER_STATE_PATH:
+            return httpx.Response(200, json={"userState": "normal"}, request=request)
+
+        key = request_key(url)
+        if key is None:
+            await asyncio.sleep(self.media_latency.sample())
+            content = self.cassette.media.get(media_key(url))
+            if content is None:
+                self.misses += 1
+                return httpx.Response(404, request=request)
+            return httpx.Response(200, content=content, headers={"content-type": "image/jpeg"}, request=request)
+
+        await asyncio.sleep(self.latency.sample())
+        budget = self._budget(endpoint_from_url(str(url)))
+        if not budget.take():
+            self.rate_limited += 1
+            return httpx.Response(429, json={"errors": [{"code": 88, "message": "Rate limit exceeded"}]}, headers=budget.headers(), request=request)
+        recorded = self.cassette.responses.get(key)
+        if recorded is None:
+            self.misses += 1
+            return httpx.Response(404, json={"errors": [{"code": 34, "message": f"Not in cassette: {key}"}]}, request=request)
+        return httpx.Response(recorded.get("status", 200), content=recorded["body"].encode(), headers={"content-type": "application/json", **budget.headers()}, request=request)
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "misses": self.misses}
+
+
+def install_replay(pool, cassette: Cassette, window: float = 15 * 60, **transport_options):
+    """Point every session of a TwitterSessionPool at the cassette; returns the transports"""
+    # The pacer assumes the same (compressed) window until it has seen one
+    twitterPacer.WINDOW_SECONDS = window
+    transports = []
+    for session in pool.sessions:
+        client = session.client
+        cookies = client.get_cookies()
+        transport = ReplayTransport(cassette, window=window, **transport_options)
+        client.http = httpx.AsyncClient(transport=transport)
+        client.set_cookies(cookies)
+        # The transaction id normally needs the x.com home page and its scripts
+        client.client_transaction.home_page_response = True
+        client.client_transaction.generate_transaction_id = lambda method, path, **kwargs: "replay"
+        session.pacer.attach(client.http)
+        transports.append(transport)
+    return transports
+
+
+def write_replay_cookies(path: str):
+    """A cookie file twikit accepts, for replay sessions"""
+    with open(path, "w") as f:
+        json.dump({"auth_token": "replay", "ct0": "replay"}, f)
+
+
+class TwitterRecorder:
+    """Stores the GraphQL responses of the attached sessions into a cassette"""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def attach(self, pool):
+        for session in pool.sessions:
+            session.client.http.event_hooks["response"].append(self._on_response)
+
+    async def _on_response(self, response: httpx.Response):
+        key = request_key(response.request.url)
+        if key is None or response.status_code == 429:
+            return
+        await response.aread()
+        self.cassette.responses[key] = {"status": response.status_code, "body": response.text}
+
+    async def record_media(self, threads, http_client: httpx.AsyncClient):
+        from mediaVariants import fallback_urls
+
+        for thread in threads:
+            for tweet in thread:
+                for url in tweet.get("media_urls") or []:
+                    key = media_key(url)
+                    if key in self.cassette.media:
+                        continue
+                    for candidate in [url, *fallback_urls(url)]:
+                        response = await http_client.get(candidate)
+                        if response.status_code < 400:
+                            self.cassette.media[key] = response.content
+                            break
+
+
+async def record(args):
+    import twitter
+
+    cassette = Cassette(meta={"screen_name": args.user, "limit": args.limit, "thread_urls": args.thread})
+    recorder = TwitterRecorder(cassette)
+    recorder.attach(twitter.sessions)
+    # A cold fetch, so every page goes through the recorder
+    twitter.timeline_cache = twitter.TimelineCache(os.path.join(args.out, "timelines.db"))
+    threads = []
+    if args.user:
+        threads += [thread async for thread in twitter.iter_user_threads(args.user, args.limit)]
+    threads += [thread async for thread in twitter.iter_threads(args.thread)]
+    async with httpx.AsyncClient(follow_redirects=True, timeout=30) as http_client:
+        await recorder.record_media(threads, http_client)
+    await twitter.timeline_cache.close()
+    os.remove(os.path.join(args.out, "timelines.db"))
+    cassette.save(args.out)
+    print(f"Recorded {len(cassette.responses)} responses, {len(cassette.media)} media files, {sum(map(len, threads))} tweets to {args.out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    recorder = commands.add_parser("record", help="Fetch a timeline and/or thread URLs with live cookies and save them")
+    recorder.add_argument("--user", help="Screen name whose timeline to record")
+    recorder.add_argument("--limit", type=int, default=800)
+    recorder.add_argument("--thread", nargs="*", default=[], help="Thread URLs to record")
+    recorder.add_argument("--out", required=True, help="Fixture directory")
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    asyncio.run(record(args))
@@ -0,0 +1,154 @@
+"""
+CONTENT-ADDRESSED BLOB CACHE
+==============================
+- (DID, sha256 of the processed image bytes) -> uploaded blob ref, so the
+  same picture is never uploaded twice to the same account
+- Source URL -> processed sha256, so a hit skips the download and the
+  resize as well
+- Blobs that no post references yet are garbage collected by the PDS, so a
+  fresh upload only lives BLOB_CACHE_UNREFERENCED_MINUTES until a post that
+  uses it is committed (confirm), then BLOB_CACHE_TTL_DAYS
+"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from sqliteStore import SQLiteStore
+
+BLOB_CACHE_PATH = os.getenv("BLOB_CACHE_PATH", "blobs.db")
+BLOB_CACHE_TTL = float(os.getenv("BLOB_CACHE_TTL_DAYS", "30")) * 86400
+BLOB_CACHE_UNREFERENCED_TTL = float(os.getenv("BLOB_CACHE_UNREFERENCED_MINUTES", "30")) * 60
+PRUNE_EVERY = 500  # Writes between expiry sweeps
+
+
+def blob_cid(blob: Dict[str, Any]) -> Optional[str]:
+    ref = blob.get("ref")
+    return ref.get("$link") if isinstance(ref, dict) else None
+
+
+class BlobCache(SQLiteStore):
+    """
+    Uploaded blob refs keyed by (DID, sha256), indexed by CID so a committed
+    post can extend them, and a source URL -> sha256 table shared by all DIDs
+    """
+
+    def __init__(self, path: str = BLOB_CACHE_PATH, ttl: float = BLOB_CACHE_TTL, unreferenced_ttl: float = BLOB_CACHE_UNREFERENCED_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.unreferenced_ttl = unreferenced_ttl
+        self.url_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._open(path, "blob-cache")
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                did TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                cid TEXT,
+                blob TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (did, sha256)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS blobs_cid ON blobs (did, cid)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _get_blob(self, did: str, sha256: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT blob FROM blobs WHERE did = ? AND sha256 = ? AND expires_at > ?", (did, sha256, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def get_blob(self, did: str, sha256: str) -> Optional[Dict[str, Any]]:
+        """Blob ref (JSON form) already uploaded by this DID for these bytes"""
+        blob = await self._run(self._get_blob, did, sha256)
+        if blob is not None:
+            self.hash_hits += 1
+        return blob
+
+    def _lookup_url(self, did: str, url: str):
+        row = self._conn.execute(
+            "SELECT sha256 FROM sources WHERE url = ? AND expires_at > ?", (url, time.time())
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], self._get_blob(did, row[0])
+
+    async def lookup_url(self, did: str, url: str) -> Optional[Dict[str, Any]]:
+        """Blob ref for a source URL this DID already uploaded (no download needed)"""
+        _, blob = await self._run(self._lookup_url, did, url)
+        if blob is None:
+            self.misses += 1
+        else:
+            self.url_hits += 1
+        return blob
+
+    def _put(self, did: str, sha256: str, blob: Dict[str, Any], url: Optional[str]):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO blobs (did, sha256, cid, blob, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (did, sha256, blob_cid(blob), json.dumps(blob), now + self.unreferenced_ttl),
+        )
+        if url:
+            self._put_source(url, sha256)
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune()
+
+    async def put(self, did: str, sha256: str, blob: Dict[str, Any], url: Optional[str] = None):
+        """Remember a fresh upload (short-lived until confirm) and where its bytes came from"""
+        await self._run(self._put, did, sha256, blob, url)
+
+    def _put_source(self, url: str, sha256: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sources (url, sha256, expires_at) VALUES (?, ?, ?)",
+            (url, sha256, time.time() + self.ttl),
+        )
+
+    async def put_source(self, url: str, sha256: str):
+        """Remember which processed bytes a URL produced"""
+        await self._run(self._put_source, url, sha256)
+
+    def _confirm(self, did: str, cids):
+        self._conn.executemany(
+            "UPDATE blobs SET expires_at = ? WHERE did = ? AND cid = ?",
+            [(time.time() + self.ttl, did, cid) for cid in cids],
+        )
+
+    def confirm(self, did: str, blobs: Iterable[Dict[str, Any]]):
+        """A committed post references these blobs: keep them for the full TTL.
+        Safe to call from synchronous callbacks; the write is queued, not awaited."""
+        cids = [cid for cid in (blob_cid(blob) for blob in blobs) if cid]
+        if cids:
+            self._submit(self._confirm, did, cids)
+
+    def _prune(self) -> int:
+        now = time.time()
+        removed = self._conn.execute("DELETE FROM blobs WHERE expires_at <= ?", (now,)).rowcount
+        removed += self._conn.execute("DELETE FROM sources WHERE expires_at <= ?", (now,)).rowcount
+        return removed
+
+    async def prune(self) -> int:
+        return await self._run(self._prune)
+
+    def stats(self) -> Dict[str, int]:
+        return {"url_hits": self.url_hits, "hash_hits": self.hash_hits, "misses": self.misses}
+
+
+blob_cache = BlobCache()
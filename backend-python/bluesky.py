@@ -8,23 +8,34 @@ OPTIMIZED BLUESKY MIGRATION ENGINE
 - Comprehensive error recovery
 """
 
-from atproto import AsyncClient, models
+from atproto import models
+from atproto_client.models.blob_ref import BlobRef
 import httpx
 import asyncio
-from atproto_identity.handle.resolver import AsyncHandleResolver
 from rateLimiter import AccountRateLimiter
-from PIL import Image, ImageFile
+from migrationJournal import MigrationJournal
+from batchPoster import BatchPoster
+from pipeline import ByteBudget, iterate
+from imageWorkers import image_workers
+from imageEncoder import MAX_BLOB_BYTES
+from blobCache import blob_cache
+from mediaVariants import fallback_urls
+from blueskySessions import bsky_sessions
+from didCache import did_cache
+from twitterArchive import archive_media, ARCHIVE_SCHEME
+from progressBus import progress_bus
+from metrics import IMAGE_STAGE, POSTS, POST_ERRORS
+import hashlib
+import os
 from datetime import timezone, datetime
-from io import BytesIO
 import gc
+from collections import deque
+from contextlib import suppress
 from typing import List, Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
 
 
-ImageFile.LOAD_TRUNCATED_IMAGES = True  # Handle incomplete images gracefully
-
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,7 +49,6 @@ logger = logging.getLogger('bluesky_migration')
 
 # Initialize the rate limiter
 rate_limiter = AccountRateLimiter()
-resolver = AsyncHandleResolver()
 
 def log_migration_event(event_type: str, migration_id: str, details: dict = None):
     """Log structured migration events for monitoring and debugging"""
@@ -51,6 +61,22 @@ def log_migration_event(event_type: str, migration_id: str, details: dict = None
     logger.info(f"MIGRATION_EVENT: {json.dumps(log_entry)}")
     return log_entry
 
+# How many threads may have their images downloaded ahead of the thread being posted
+IMAGE_PREFETCH_THREADS = int(os.getenv("IMAGE_PREFETCH_THREADS", "3"))
+# Prepared image bytes held ahead of posting, shared by all concurrent migrations
+IMAGE_PREFETCH_BYTES = int(os.getenv("IMAGE_PREFETCH_MB", "128")) * 1024 * 1024
+image_budget = ByteBudget(IMAGE_PREFETCH_BYTES)
+IMAGE_DOWNLOAD = IMAGE_STAGE.labels("download")
+IMAGE_RESIZE = IMAGE_STAGE.labels("resize")
+IMAGE_UPLOAD = IMAGE_STAGE.labels("upload")
+POSTS_CREATED = POSTS.labels("success")
+# Posts written per migration at most
+POST_LIMIT = 1500
+# Times a migration renews a rejected Bluesky session before giving up
+MAX_SESSION_RECOVERIES = 3
+# Attempts at writing the last partial batch before the migration fails
+FINAL_FLUSH_ATTEMPTS = 5
+
 # Global connection pool for HTTP requests
 HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
 http_client_pool = None
@@ -64,69 +90,71 @@ async def get_http_client():
         http_client_pool = httpx.AsyncClient(
             timeout=HTTP_TIMEOUT,
             limits=limits,
-            follow_redirects=True
+            follow_redirects=True,
+            # Photos of an uploaded Twitter archive, read from the ZIP (see twitterArchive.py)
+            mounts={ARCHIVE_SCHEME: archive_media}
         )
     return http_client_pool
 
-async def login(bskyHandle, password):
-    client = AsyncClient()
-    await client.login(bskyHandle, password)
-    return client
-
-async def process_single_image(http_client: httpx.AsyncClient, url: str) -> Optional[models.AppBskyEmbedImages.Image]:
-    """Process a single image with proper error handling and cleanup"""
-    img = None
-    img_buffer = None
-    buffer = None
+async def login(bskyHandle, password, did=None):
+    """Client on the account's own PDS, resuming a cached session when possible (see blueskySessions.py).
+    Hand it back with bsky_sessions.release(client) when done."""
+    did = did or await require_did(bskyHandle)
+    return await bsky_sessions.get_client(did, bskyHandle, password)
 
+async def process_single_image(http_client: httpx.AsyncClient, url: str) -> Optional[bytes]:
+    """Download an image; oversized ones are shrunk in the image worker pool"""
     try:
-        # Download image
-        response = await http_client.get(url)
+        # Download image, falling back to larger Twitter variants if this one is unavailable
+        candidates = [url, *fallback_urls(url)]
+        with IMAGE_DOWNLOAD.time():
+            for candidate in candidates:
+                response = await http_client.get(candidate)
+                if response.status_code < 400 or candidate is candidates[-1]:
+                    break
+                print(f"Media variant unavailable ({response.status_code}): {candidate}")
         response.raise_for_status()
-
-        # Process image in memory
-        img_buffer = BytesIO(response.content)
-        img = Image.open(img_buffer)
+        img_data = response.content
 
         # Check file size and resize if necessary
-        if len(response.content) > 976 * 1024:  # 976 KB
-            print(f"Image too large, resizing: {url}")
-            img = img.resize(
-                (int(img.width * 0.7), int(img.height * 0.7)),
-                Image.Resampling.LANCZOS
+        if len(img_data) > MAX_BLOB_BYTES:
+            with IMAGE_RESIZE.time():
+                img_data, stats = await image_workers.encode(img_data)
+            print(
+                f"Re-encoded {url}: {stats['source_format']} {stats['original_bytes'] // 1024} KB -> "
+                f"{stats['format']} {stats['width']}x{stats['height']} {stats['bytes'] // 1024} KB "
+                f"in {stats['encode_ms']} ms ({stats['passes']} passes)"
             )
-            buffer = BytesIO()
-            format_to_use = img.format if img.format else "JPEG"
-            img.save(buffer, format=format_to_use, quality=85)  # Add quality parameter
-            img_data = buffer.getvalue()
-        else:
-            img_data = response.content
 
         return img_data
 
     except Exception as e:
         print(f"Failed to process image from URL {url}: {e}")
         return None
-    finally:
-        # Ensure cleanup of all resources
-        try:
-            if img is not None:
-                img.close()
-        except:
-            pass
-        try:
-            if img_buffer is not None:
-                img_buffer.close()
-        except:
-            pass
-        try:
-            if buffer is not None:
-                buffer.close()
-        except:
-            pass
-
-async def process_images_parallel(http_client: httpx.AsyncClient, urls: List[str], max_concurrent: int = 5) -> List[models.AppBskyEmbedImages.Image]:
-    """Process multiple images in parallel with concurrency control"""
+
+async def prepare_image(http_client: httpx.AsyncClient, did: str, url: str) -> Optional[Dict[str, Any]]:
+    """
+    An image ready to attach: {"url", "blob"} when this account already has it
+    uploaded (no download at all), otherwise {"url", "sha256", "data"}
+    """
+    blob = await blob_cache.lookup_url(did, url)
+    if blob is not None:
+        return {"url": url, "blob": blob}
+
+    img_data = await process_single_image(http_client, url)
+    if img_data is None:
+        return None
+    digest = hashlib.sha256(img_data).hexdigest()
+
+    # Same bytes from a different URL (or a retried migration)
+    blob = await blob_cache.get_blob(did, digest)
+    if blob is not None:
+        await blob_cache.put_source(url, digest)
+        return {"url": url, "blob": blob, "sha256": digest}
+    return {"url": url, "sha256": digest, "data": img_data}
+
+async def process_images_parallel(http_client: httpx.AsyncClient, did: str, urls: List[str], max_concurrent: int = 5) -> List[Dict[str, Any]]:
+    """Prepare multiple images in parallel with concurrency control (see prepare_image)"""
     if not urls:
         return []
 
@@ -135,33 +163,20 @@ async def process_images_parallel(http_client: httpx.AsyncClient, urls: List[str
 
     async def process_with_semaphore(url: str):
         async with semaphore:
-            img_data = await process_single_image(http_client, url)
-            return img_data
+            return await prepare_image(http_client, did, url)
 
     # Process all images concurrently
-    raw_images = await asyncio.gather(
+    prepared = await asyncio.gather(
         *[process_with_semaphore(url) for url in urls],
         return_exceptions=True
     )
 
     # Filter out None values and exceptions
-    valid_images = [img for img in raw_images if img is not None and not isinstance(img, Exception)]
+    return [image for image in prepared if image is not None and not isinstance(image, Exception)]
 
-    # Upload images to Bluesky (this needs to be done sequentially due to API limits)
-    uploaded_images = []
-    for img_data in valid_images:
-        try:
-            # This will need to be passed from the main function
-            # For now, we'll return the raw data and upload later
-            uploaded_images.append(img_data)
-        except Exception as e:
-            print(f"Failed to upload image: {e}")
-
-    return valid_images  # Return raw image data for batch upload
-
-async def batch_upload_images(client, image_data_list: List[bytes], max_concurrent: int = 3) -> List[models.AppBskyEmbedImages.Image]:
-    """Upload multiple images to Bluesky with concurrency control"""
-    if not image_data_list:
+async def batch_upload_images(client, did: str, prepared_images: List[Dict[str, Any]], max_concurrent: int = 3) -> List[models.AppBskyEmbedImages.Image]:
+    """Upload prepared images to Bluesky with concurrency control, reusing cached blobs"""
+    if not prepared_images:
         return []
 
     uploaded_images = []
@@ -169,10 +184,14 @@ async def batch_upload_images(client, image_data_list: List[bytes], max_concurre
     # Use semaphore to limit concurrent uploads
     semaphore = asyncio.Semaphore(max_concurrent)
 
-    async def upload_single_image(img_data: bytes):
+    async def upload_single_image(prepared: Dict[str, Any]):
+        if prepared.get("blob") is not None:
+            return models.AppBskyEmbedImages.Image(alt='', image=BlobRef.model_validate(prepared["blob"]))
         async with semaphore:
             try:
-                upload = await client.upload_blob(img_data)
+                with IMAGE_UPLOAD.time():
+                    upload = await client.upload_blob(prepared["data"])
+                await blob_cache.put(did, prepared["sha256"], models.get_model_as_dict(upload.blob), prepared["url"])
                 return models.AppBskyEmbedImages.Image(alt='', image=upload.blob)
             except Exception as e:
                 error_msg = str(e).lower()
@@ -188,7 +207,7 @@ async def batch_upload_images(client, image_data_list: List[bytes], max_concurre
 
     # Upload all images concurrently
     upload_results = await asyncio.gather(
-        *[upload_single_image(img_data) for img_data in image_data_list],
+        *[upload_single_image(prepared) for prepared in prepared_images],
         return_exceptions=True
     )
 
@@ -197,42 +216,165 @@ async def batch_upload_images(client, image_data_list: List[bytes], max_concurre
         if result is not None and not isinstance(result, Exception):
             uploaded_images.append(result)
 
-    print(f"Successfully uploaded {len(uploaded_images)}/{len(image_data_list)} images")
+    reused = sum(1 for prepared in prepared_images if prepared.get("blob") is not None)
+    print(f"Successfully attached {len(uploaded_images)}/{len(prepared_images)} images ({reused} reused from cache)")
     return uploaded_images
 
-async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id: str = None):
-    """Optimized Bluesky migration with parallel processing and error recovery"""
-    if not tweets:
+def classify_error(error_msg: str) -> str:
+    """Error class of a lowercased exception message, as handled in migrateTweetsToBluesky"""
+    if "rate limit" in error_msg or "429" in error_msg:
+        return "rate_limit"
+    if any(s in error_msg for s in ("unauthorized", "403", "expiredtoken", "invalidtoken")):
+        return "auth"
+    if "not found" in error_msg or "404" in error_msg:
+        return "not_found"
+    if "bad request" in error_msg or "400" in error_msg:
+        return "bad_request"
+    return "other"
+
+def needs_images(tweet: Dict[str, Any], journal: MigrationJournal) -> bool:
+    """True if the tweet has media that still has to be downloaded for this run"""
+    if not tweet.get('media_urls'):
+        return False
+    tweet_id = tweet.get('id')
+    return journal.get_post(tweet_id) is None and journal.get_blobs(tweet_id) is None
+
+async def preprocess_thread_images(http_client: httpx.AsyncClient, did: str, tweet_thread, journal: MigrationJournal) -> Dict[int, List[Dict[str, Any]]]:
+    """Download and prepare the images of every tweet in a thread, keyed by tweet index"""
+    # Tweets already posted or with blobs recorded in the journal are skipped
+    indexes = [i for i, tweet in enumerate(tweet_thread) if needs_images(tweet, journal)]
+    results = await asyncio.gather(*[
+        process_images_parallel(http_client, did, tweet_thread[i]['media_urls'], max_concurrent=5)
+        for i in indexes
+    ])
+    return dict(zip(indexes, results))
+
+def prepared_bytes(thread_image_data: Dict[int, List[Dict[str, Any]]]) -> int:
+    return sum(len(image["data"]) for images in thread_image_data.values() for image in images if image.get("data"))
+
+async def prefetch_threads(threads, http_client: httpx.AsyncClient, did: str, journal: MigrationJournal, lookahead: int = IMAGE_PREFETCH_THREADS, budget: Optional[ByteBudget] = None):
+    """
+    Image prefetch stage: the images of up to `lookahead` upcoming threads are
+    downloaded and prepared concurrently while the current one is posted.
+    Yields (thread, images, held_bytes) in order; the consumer releases
+    held_bytes from the budget once the thread is posted.
+    """
+    budget = budget or image_budget
+    source = iterate(threads).__aiter__()
+    pending = deque()  # [thread, task or None if not started yet, reserved bytes]
+    exhausted = False
+
+    def start(entry, force: bool) -> bool:
+        # Reserve the worst case (every image at the blob limit) until the real size is known
+        thread = entry[0]
+        estimate = MAX_BLOB_BYTES * sum(len(tweet['media_urls']) for tweet in thread if needs_images(tweet, journal))
+        if force:
+            budget.force_acquire(estimate)
+        elif not budget.try_acquire(estimate):
+            return False
+        entry[1] = asyncio.create_task(preprocess_thread_images(http_client, did, thread, journal))
+        entry[2] = estimate
+        return True
+
+    try:
+        while True:
+            # Start look-ahead in order while it fits the global budget; the next thread always starts
+            for i, entry in enumerate(pending):
+                if entry[1] is None and not start(entry, force=i == 0):
+                    break
+            else:
+                while not exhausted and len(pending) < lookahead:
+                    try:
+                        entry = [await source.__anext__(), None, 0]
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    pending.append(entry)
+                    if not start(entry, force=len(pending) == 1):
+                        break
+
+            if not pending:
+                return
+
+            thread, task, reserved = pending.popleft()
+            try:
+                thread_image_data = await task
+            except BaseException:
+                budget.release(reserved)
+                raise
+            held = prepared_bytes(thread_image_data)
+            budget.release(reserved - held)
+            yield thread, thread_image_data, held
+    finally:
+        for _, task, reserved in pending:
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError, Exception):
+                    await task
+            budget.release(reserved)
+        if hasattr(source, "aclose"):
+            await source.aclose()
+
+async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id: str = None, resume: bool = True):
+    """Optimized Bluesky migration with parallel processing and error recovery.
+
+    `tweets` is a list of threads or an async iterable yielding them as they
+    are fetched; images of upcoming threads are prepared while the current
+    one is posted. Every created post is checkpointed in the migration
+    journal; with `resume` a retried migration skips tweets already posted.
+    """
+    streaming = hasattr(tweets, "__aiter__")
+    if not streaming and not tweets:
         print("No tweets to migrate")
         log_migration_event("MIGRATION_START", migration_id or "unknown", {"status": "no_tweets"})
         return
 
     migration_id = migration_id or f"migration_{int(datetime.now().timestamp())}"
+    total_threads = "?" if streaming else len(tweets)
 
     # Log migration start
     log_migration_event("MIGRATION_START", migration_id, {
         "bsky_handle": bskyHandle,
         "did": did,
-        "total_threads": len(tweets),
-        "total_tweets": sum(len(thread) for thread in tweets)
+        "total_threads": None if streaming else len(tweets),
+        "total_tweets": None if streaming else sum(len(thread) for thread in tweets),
+        "streaming": streaming
     })
 
     # Initialize clients and counters (per-migration instances)
-    client = await login(bskyHandle, password)
+    client = await login(bskyHandle, password, did)
     http_client = await get_http_client()
+    journal = MigrationJournal(migration_id, resume=resume)
+
+    def on_commit(tweet_id, ref, root):
+        journal.record_post(tweet_id, ref["uri"], ref["cid"], root)
+        POSTS_CREATED.inc()
+        # Blobs referenced by a stored post are safe to reuse from the cache
+        blob_cache.confirm(client.me.did, journal.get_blobs(tweet_id) or [])
+
+    # Posts are written in applyWrites batches and checkpointed once stored
+    poster = BatchPoster(client, client.me.did, rate_limiter, on_commit=on_commit)
 
     posts_made = 0
     successful_posts = 0
     failed_posts = 0
+    resumed_posts = 0
     threads_processed = 0
+    session_recoveries = 0
 
-    print(f"Starting optimized migration for {bskyHandle} with {len(tweets)} threads")
-    logger.info(f"Migration {migration_id}: Started processing {len(tweets)} threads for {bskyHandle}")
+    print(f"Starting optimized migration for {bskyHandle} with {total_threads} threads")
+    logger.info(f"Migration {migration_id}: Started processing {total_threads} threads for {bskyHandle}")
+
+    # Images of the next few threads are prepared while the current one is posted
+    prepared_threads = prefetch_threads(tweets, http_client, client.me.did, journal)
+    held_bytes = 0
 
     try:
-        for thread_idx, tweet_thread in enumerate(tweets):
-            if posts_made >= 1500:
-                print("Post limit of 1500 reached. Stopping migration.")
+        thread_idx = -1
+        async for tweet_thread, thread_image_data, held_bytes in prepared_threads:
+            thread_idx += 1
+            if posts_made >= POST_LIMIT:
+                print(f"Post limit of {POST_LIMIT} reached. Stopping migration.")
                 log_migration_event("MIGRATION_LIMIT_REACHED", migration_id, {
                     "posts_made": posts_made,
                     "threads_processed": threads_processed
@@ -240,39 +382,45 @@ async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id
                 break
 
             threads_processed += 1
-            print(f"Processing thread {thread_idx + 1}/{len(tweets)} ({len(tweet_thread)} tweets)")
-            logger.info(f"Migration {migration_id}: Processing thread {thread_idx + 1}/{len(tweets)} with {len(tweet_thread)} tweets")
-
-            # Pre-process all images for the thread to optimize I/O
-            thread_image_data = {}
-            if any(tweet.get('media_urls') for tweet in tweet_thread):
-                print("Pre-processing all images for thread...")
-                for i, tweet in enumerate(tweet_thread):
-                    if tweet.get('media_urls'):
-                        image_data = await process_images_parallel(
-                            http_client, tweet['media_urls'], max_concurrent=5
-                        )
-                        thread_image_data[i] = image_data
+            if thread_idx == 0:
+                progress_bus.update(migration_id, stage="posting")
+            # Renew the tokens here rather than inside a write
+            await bsky_sessions.refresh_if_expiring(client)
+            print(f"Processing thread {thread_idx + 1}/{total_threads} ({len(tweet_thread)} tweets)")
+            logger.info(f"Migration {migration_id}: Processing thread {thread_idx + 1}/{total_threads} with {len(tweet_thread)} tweets")
 
             parent_post = None
             root_post = None
+            thread_posts = {}  # tweet id -> post, for a reply to an earlier tweet than the previous one (branching threads)
 
             for tweet_idx, tweet in enumerate(tweet_thread):
-                if posts_made >= 1500:
+                if posts_made >= POST_LIMIT:
                     break
 
-                try:
-                    # Acquire rate limiter points
-                    await rate_limiter.acquire(did, 3)
+                # Already posted in a previous attempt: reattach the thread to the recorded post
+                recorded = journal.get_post(tweet.get('id'))
+                if recorded:
+                    root_post = recorded["root"]
+                    parent_post = {"uri": recorded["uri"], "cid": recorded["cid"]}
+                    thread_posts[str(tweet.get('id'))] = parent_post
+                    posts_made += 1
+                    resumed_posts += 1
+                    POSTS.labels("resumed").inc()
+                    continue
 
-                    # Use pre-processed images for this tweet
+                added = False
+                try:
+                    # Reuse blobs uploaded by a previous attempt, otherwise upload the pre-processed images
+                    recorded_blobs = journal.get_blobs(tweet.get('id'))
                     image_data_list = thread_image_data.get(tweet_idx, [])
 
-                    # Upload images to Bluesky using optimized batch upload
                     images = []
-                    if image_data_list:
+                    if recorded_blobs:
+                        images = [models.AppBskyEmbedImages.Image(alt='', image=BlobRef.model_validate(blob)) for blob in recorded_blobs]
+                    elif image_data_list:
                         print(f"Uploading {len(image_data_list)} images for tweet {tweet_idx + 1}")
-                        images = await batch_upload_images(client, image_data_list, max_concurrent=3)
+                        images = await batch_upload_images(client, client.me.did, image_data_list, max_concurrent=3)
+                        journal.record_blobs(tweet.get('id'), [models.get_model_as_dict(image.image) for image in images])
 
                     # Format timestamp
                     created_at = tweet['created_at_datetime']
@@ -280,15 +428,16 @@ async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id
 
                     # Create reply structure
                     reply = None
-                    if parent_post:
+                    reply_parent = thread_posts.get(str(tweet.get('in_reply_to')), parent_post)
+                    if reply_parent:
                         reply = {
                             "root": {
                                 "uri": root_post["uri"],
                                 "cid": root_post["cid"]
                             },
                             "parent": {
-                                "uri": parent_post["uri"],
-                                "cid": parent_post["cid"]
+                                "uri": reply_parent["uri"],
+                                "cid": reply_parent["cid"]
                             }
                         }
 
@@ -306,37 +455,45 @@ async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id
                         facets=tweet['facets'] if tweet['facets'] else None
                     )
 
-                    # Post to Bluesky
-                    resp = await client.app.bsky.feed.post.create(client.me.did, post)
-
-                    # Update thread tracking
+                    # Queue the post; its uri/cid are known locally so the thread can continue right away
+                    parent_post = poster.add(post, tweet.get('id'), root=root_post)
+                    thread_posts[str(tweet.get('id'))] = parent_post
                     if not root_post:
-                        root_post = resp
-                    parent_post = resp
-
+                        root_post = parent_post
+                    added = True
                     posts_made += 1
-                    successful_posts += 1
+
+                    # Write a full batch to Bluesky (rate limiter points are charged per post)
+                    await poster.flush_if_full()
+                    successful_posts = poster.committed
+                    progress_bus.update(migration_id, posts_made=posts_made, successful_posts=successful_posts)
 
                     if posts_made % 10 == 0:
                         print(f"Progress: {posts_made} posts created ({successful_posts} successful, {failed_posts} failed)")
 
                 except Exception as e:
-                    failed_posts += 1
-                    error_msg = str(e).lower()
+                    # A post that made it into the batch is retried with the next flush
+                    if not added:
+                        failed_posts += 1
+                    error_class = classify_error(str(e).lower())
+                    POST_ERRORS.labels(error_class).inc()
 
                     # Categorize and handle different types of errors
-                    if "rate limit" in error_msg or "429" in error_msg:
+                    if error_class == "rate_limit":
                         print(f"Rate limit hit for tweet {tweet_idx + 1} in thread {thread_idx + 1}: {e}")
                         print("Waiting 60 seconds before continuing...")
                         await asyncio.sleep(60)
-                    elif "unauthorized" in error_msg or "403" in error_msg:
+                    elif error_class == "auth":
                         print(f"Authentication error for tweet {tweet_idx + 1}: {e}")
-                        print("This may indicate session expiry. Migration may need to be restarted.")
-                        raise  # Re-raise auth errors as they require user intervention
-                    elif "not found" in error_msg or "404" in error_msg:
+                        if session_recoveries >= MAX_SESSION_RECOVERIES:
+                            raise  # Still rejected after logging in again: needs user intervention
+                        # Most likely an expired or revoked session: renew it and carry on
+                        session_recoveries += 1
+                        await bsky_sessions.recover(client)
+                    elif error_class == "not_found":
                         print(f"Resource not found for tweet {tweet_idx + 1}: {e}")
                         print("Continuing with next tweet...")
-                    elif "bad request" in error_msg or "400" in error_msg:
+                    elif error_class == "bad_request":
                         print(f"Bad request for tweet {tweet_idx + 1}: {e}")
                         print("This may be due to invalid data. Continuing with next tweet...")
                     else:
@@ -345,19 +502,51 @@ async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id
 
                     continue
 
+            # The thread's images are uploaded: free its share of the prefetch budget
+            image_budget.release(held_bytes)
+            held_bytes = 0
+            progress_bus.update(migration_id, posts_made=posts_made, failed_posts=failed_posts, threads_processed=threads_processed)
+
             # Memory cleanup after each thread
             if thread_idx % 5 == 0:
                 gc.collect()
 
-        print(f"Migration completed: {successful_posts} successful, {failed_posts} failed, {posts_made} total posts")
+        # Write the last partial batch, recovering from rate limits and expired sessions as above
+        for attempt in range(1, FINAL_FLUSH_ATTEMPTS + 1):
+            try:
+                await bsky_sessions.refresh_if_expiring(client)
+                await poster.flush()
+                break
+            except Exception as e:
+                error_class = classify_error(str(e).lower())
+                POST_ERRORS.labels(error_class).inc()
+                print(f"Writing the last {len(poster.pending)} posts failed (attempt {attempt}/{FINAL_FLUSH_ATTEMPTS}): {e}")
+                if attempt == FINAL_FLUSH_ATTEMPTS:
+                    raise
+                if error_class == "rate_limit":
+                    print("Waiting 60 seconds before continuing...")
+                    await asyncio.sleep(60)
+                elif error_class == "auth":
+                    if session_recoveries >= MAX_SESSION_RECOVERIES:
+                        raise
+                    session_recoveries += 1
+                    await bsky_sessions.recover(client)
+                else:
+                    await asyncio.sleep(5 * attempt)
+        successful_posts = poster.committed
+        failed_posts += poster.failed
+        progress_bus.update(migration_id, successful_posts=successful_posts, failed_posts=failed_posts)
+
+        print(f"Migration completed: {successful_posts} successful, {failed_posts} failed, {resumed_posts} resumed, {posts_made} total posts")
 
         # Log successful completion
         log_migration_event("MIGRATION_COMPLETED", migration_id, {
             "successful_posts": successful_posts,
             "failed_posts": failed_posts,
+            "resumed_posts": resumed_posts,
             "total_posts": posts_made,
             "threads_processed": threads_processed,
-            "success_rate": (successful_posts / posts_made * 100) if posts_made > 0 else 0
+            "success_rate": ((successful_posts + resumed_posts) / posts_made * 100) if posts_made > 0 else 0
         })
         logger.info(f"Migration {migration_id}: Completed successfully. {successful_posts}/{posts_made} posts created.")
 
@@ -374,16 +563,21 @@ async def migrateTweetsToBluesky(tweets, bskyHandle, password, did, migration_id
         logger.error(f"Migration {migration_id}: Failed with error: {e}")
         raise
     finally:
-        # Cleanup
-        try:
-            await http_client.aclose()
-        except:
-            pass
-        # Reset global client pool to ensure clean state for next migration
-        global http_client_pool
-        http_client_pool = None
+        # Cleanup (the shared HTTP client pool stays open for concurrent migrations)
+        await prepared_threads.aclose()
+        image_budget.release(held_bytes)
+        POSTS.labels("failed").inc(failed_posts)
+        bsky_sessions.release(client)
+        journal.close()
         gc.collect()
 
 async def resolve_did(handle):
-    """Resolve a handle to a DID."""
-    return await resolver.resolve(handle)
+    """Resolve a handle to a DID (None if it doesn't resolve); cached, see didCache.py"""
+    return await did_cache.resolve(handle)
+
+async def require_did(handle):
+    """Like resolve_did, for a migration that can't go on without it"""
+    did = await resolve_did(handle)
+    if not did:
+        raise ValueError(f"Could not resolve the Bluesky handle {handle}")
+    return did
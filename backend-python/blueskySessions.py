@@ -0,0 +1,279 @@
+"""
+BLUESKY SESSION MANAGER
+=========================
+- The user's DID document is resolved once (cached for PDS_CACHE_MINUTES) and
+  the client talks to their PDS directly instead of going through the
+  bsky.social entryway
+- Sessions are kept per DID and resumed on the next migration instead of a
+  fresh createSession (which is rate limited per account: 30/5 min, 300/day)
+- At rest every session string is Fernet-encrypted with a key derived from
+  SESSION_ENCRYPTION_KEY, the DID and the user's app password, so only a
+  request that knows the password can resume it. Without
+  SESSION_ENCRYPTION_KEY sessions are only kept in memory
+- Tokens are refreshed between batches once they are within
+  BSKY_REFRESH_MARGIN_MINUTES of expiry; an expired or revoked session
+  mid-migration is refreshed, or re-created with the password, instead of
+  failing the migration
+- Concurrent migrations of the same DID share one client, so a rotated
+  refresh token is never used twice
+- atproto (pinned to 0.0.55 in requirements.txt) has no public way to
+  force a token refresh; _refresh_session() is the one place that calls its
+  internal one (under the client's own refresh lock), and an atproto without
+  it fails at import
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from atproto import AsyncClient
+from atproto_identity.did.resolver import AsyncDidResolver
+from atproto_server.auth.jwt import get_jwt_payload
+from cryptography.fernet import Fernet, InvalidToken
+
+from sqliteStore import SQLiteStore
+
+BSKY_SESSION_PATH = os.getenv("BSKY_SESSION_PATH", "bsky_sessions.db")
+SESSION_ENCRYPTION_KEY = os.getenv("SESSION_ENCRYPTION_KEY", "")
+BSKY_REFRESH_MARGIN = float(os.getenv("BSKY_REFRESH_MARGIN_MINUTES", "30")) * 60
+PDS_CACHE_TTL = float(os.getenv("PDS_CACHE_MINUTES", "60")) * 60
+DEFAULT_PDS = "https://bsky.social"  # Entryway, used when the DID document can't be resolved
+KEY_DERIVATION_ROUNDS = 100_000
+
+
+if not hasattr(AsyncClient, "_refresh_and_set_session"):
+    raise ImportError("This atproto version has no AsyncClient._refresh_and_set_session; see blueskySessions.py")
+
+
+async def _refresh_session(client: AsyncClient):
+    """
+    Exchange the refresh token for new tokens. The client only refreshes on its
+    own within 15 minutes of expiry, not after the PDS rejected a token, so this
+    uses its internal method (it also fires on_session_change, which persists them).
+    It holds the client's own refresh lock, so a request that auto-refreshes at
+    the same time waits and then sends the rotated refresh token
+    """
+    async with client._refresh_lock:
+        await client._refresh_and_set_session()
+
+
+def _derive_key(secret: str, did: str, password: str) -> bytes:
+    """Fernet key for one account's session; a different password can't decrypt it"""
+    raw = hashlib.pbkdf2_hmac("sha256", password.encode(), f"{secret}:{did}".encode(), KEY_DERIVATION_ROUNDS)
+    return base64.urlsafe_b64encode(raw)
+
+
+class _LiveSession:
+    def __init__(self, client: AsyncClient, key: bytes, handle: str, password: str):
+        self.client = client
+        self.key = key
+        self.handle = handle
+        self.password = password
+        self.users = 0
+        self.expires_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class BlueskySessionManager(SQLiteStore):
+    """
+    Live sessions shared in memory per DID; the latest tokens of each DID are
+    kept Fernet-encrypted in SQLite, and only when SESSION_ENCRYPTION_KEY is set
+    """
+
+    def __init__(self, path: str = BSKY_SESSION_PATH, secret: str = SESSION_ENCRYPTION_KEY, refresh_margin: float = BSKY_REFRESH_MARGIN):
+        self.path = path
+        self.secret = secret
+        self.refresh_margin = refresh_margin
+        self._did_resolver = AsyncDidResolver()
+        self._pds: Dict[str, tuple] = {}
+        self._live: Dict[str, _LiveSession] = {}  # DID -> session new migrations may share
+        self._clients: Dict[int, _LiveSession] = {}  # id(client) -> session, for every client in use
+        self._pending: Dict[str, list] = {}  # DID -> [login lock, callers using it]
+        self.logins = 0
+        self.resumed = 0
+        self.shared = 0
+        self.refreshes = 0
+        self.recoveries = 0
+        if self.secret:
+            # Rotated refresh tokens must survive a crash, so every commit is synced
+            self._open(path, "bsky-sessions", synchronous="FULL")
+        else:
+            print("SESSION_ENCRYPTION_KEY is not set; Bluesky sessions are only kept in memory")
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                did TEXT PRIMARY KEY,
+                token BLOB NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _load(self, did: str) -> Optional[bytes]:
+        row = self._conn.execute("SELECT token FROM sessions WHERE did = ?", (did,)).fetchone()
+        return row[0] if row else None
+
+    def _save(self, did: str, token: bytes):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (did, token, updated_at) VALUES (?, ?, ?)", (did, token, time.time())
+        )
+
+    def _delete(self, did: str):
+        self._conn.execute("DELETE FROM sessions WHERE did = ?", (did,))
+
+    async def resolve_pds(self, did: str) -> str:
+        """PDS endpoint from the DID document (did:plc or did:web)"""
+        cached = self._pds.get(did)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        endpoint = None
+        try:
+            doc = await self._did_resolver.resolve(did)
+            endpoint = doc.get_pds_endpoint() if doc else None
+        except Exception as e:
+            print(f"Could not resolve the DID document of {did}: {e}")
+        if not endpoint:
+            print(f"No PDS endpoint for {did}; using {DEFAULT_PDS}")
+            return DEFAULT_PDS
+        self._pds[did] = (endpoint.rstrip("/"), time.monotonic() + PDS_CACHE_TTL)
+        return self._pds[did][0]
+
+    async def get_client(self, did: str, handle: str, password: str) -> AsyncClient:
+        """Logged-in client for `did` on its own PDS. Call release() when the migration ends"""
+        key = await asyncio.to_thread(_derive_key, self.secret, did, password)
+        # One login per DID at a time, so concurrent migrations end up sharing it
+        pending = self._pending.setdefault(did, [asyncio.Lock(), 0])
+        pending[1] += 1
+        try:
+            async with pending[0]:
+                return await self._open_client(did, handle, password, key)
+        finally:
+            pending[1] -= 1
+            if not pending[1]:
+                del self._pending[did]
+
+    async def _open_client(self, did: str, handle: str, password: str, key: bytes) -> AsyncClient:
+        live = self._live.get(did)
+        if live and hmac.compare_digest(live.key, key):
+            live.users += 1
+            self.shared += 1
+            return live.client
+
+        client = AsyncClient(base_url=await self.resolve_pds(did))
+        live = _LiveSession(client, key, handle, password)
+        client.on_session_change(lambda event, session: self._on_session_change(did, live, session))
+
+        if not await self._resume(did, live):
+            await client.login(handle, password)
+            self.logins += 1
+        if client.me.did != did:
+            raise ValueError(f"Logged in as {client.me.did}, expected {did}")
+
+        self._live[did] = live
+        self._clients[id(client)] = live
+        live.users += 1
+        return client
+
+    async def _resume(self, did: str, live: _LiveSession) -> bool:
+        if self._conn is None:
+            return False
+        token = await self._run(self._load, did)
+        if token is None:
+            return False
+        try:
+            session_string = Fernet(live.key).decrypt(token).decode()
+            # Refreshes right away if the stored access token is about to expire
+            await live.client.login(session_string=session_string)
+        except InvalidToken:
+            # Encrypted for another password: the account will log in afresh and overwrite it
+            return False
+        except Exception as e:
+            print(f"Stored Bluesky session for {did} is no longer valid ({e}); logging in")
+            return False
+        self.resumed += 1
+        return True
+
+    async def _on_session_change(self, did: str, live: _LiveSession, session):
+        """Every login, import and refresh: track expiry and persist the new tokens"""
+        if session.did != did:
+            return
+        payload = get_jwt_payload(session.access_jwt)
+        live.expires_at = float(payload.exp or 0)
+        if self._conn is not None:
+            token = Fernet(live.key).encrypt(session.encode().encode())
+            await self._run(self._save, did, token)
+
+    async def refresh_if_expiring(self, client: AsyncClient):
+        """Refresh between batches rather than letting a write run into an expired token"""
+        live = self._find(client)
+        if live is None or live.expires_at - time.time() > self.refresh_margin:
+            return
+        async with live.lock:
+            if live.expires_at - time.time() > self.refresh_margin:
+                return  # Another migration sharing the client already refreshed
+            try:
+                await _refresh_session(client)
+                self.refreshes += 1
+            except Exception as e:
+                print(f"Bluesky token refresh failed ({e}); logging in again")
+                await self._login_again(live)
+
+    async def recover(self, client: AsyncClient):
+        """The PDS rejected our token mid-migration: refresh, or log in again with the password"""
+        live = self._find(client)
+        if live is None:
+            raise RuntimeError("Unknown Bluesky client")
+        async with live.lock:
+            self.recoveries += 1
+            try:
+                await _refresh_session(client)
+                self.refreshes += 1
+            except Exception as e:
+                print(f"Bluesky session could not be refreshed ({e}); logging in again")
+                await self._login_again(live)
+
+    async def _login_again(self, live: _LiveSession):
+        await live.client.login(live.handle, live.password)
+        self.logins += 1
+
+    def _find(self, client: AsyncClient) -> Optional[_LiveSession]:
+        return self._clients.get(id(client))
+
+    def release(self, client: AsyncClient):
+        """A migration is done with the client; the last user drops it from memory (tokens stay stored)"""
+        live = self._clients.get(id(client))
+        if live is None:
+            return
+        live.users -= 1
+        if live.users <= 0:
+            del self._clients[id(client)]
+            did = live.client.me.did
+            if self._live.get(did) is live:
+                del self._live[did]
+
+    async def forget(self, did: str):
+        """Drop a stored session (e.g. the user revoked the app password)"""
+        self._live.pop(did, None)
+        if self._conn is not None:
+            await self._run(self._delete, did)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live": len(self._live),
+            "logins": self.logins,
+            "resumed": self.resumed,
+            "shared": self.shared,
+            "refreshes": self.refreshes,
+            "recoveries": self.recoveries,
+            "persistent": self._conn is not None,
+        }
+
+
+bsky_sessions = BlueskySessionManager()
@@ -0,0 +1,97 @@
+"""
+HANDLE -> DID CACHE
+=====================
+- In front of AsyncHandleResolver (DNS TXT, then HTTPS .well-known), so a
+  handle submitted again is answered from memory for DID_CACHE_MINUTES
+- Handles that don't resolve are remembered for DID_NEGATIVE_CACHE_SECONDS,
+  so a typo resubmitted in a loop doesn't hit DNS every time (short, as the
+  resolver can't tell "no such handle" from a transient failure)
+- Concurrent lookups of the same handle share one resolution
+- Bounded LRU (DID_CACHE_SIZE handles)
+- DID_RESOLUTION=worker: POST /posts accepts the job without resolving
+  and the migration resolves the handle when it starts, so the API doesn't
+  wait on DNS/HTTPS at all ("request", the default, rejects a handle that
+  doesn't resolve up front)
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from atproto_identity.handle.resolver import AsyncHandleResolver
+
+from metrics import DID_LOOKUPS, DID_RESOLVE
+
+DID_CACHE_TTL = float(os.getenv("DID_CACHE_MINUTES", "60")) * 60
+DID_NEGATIVE_CACHE_TTL = float(os.getenv("DID_NEGATIVE_CACHE_SECONDS", "60"))
+DID_CACHE_SIZE = int(os.getenv("DID_CACHE_SIZE", "10000"))
+DID_RESOLVE_TIMEOUT = float(os.getenv("DID_RESOLVE_TIMEOUT", "5"))
+DID_RESOLUTION = os.getenv("DID_RESOLUTION", "request")  # "request" or "worker"
+
+
+def normalize_handle(handle: str) -> str:
+    return handle.strip().lstrip("@").lower()
+
+
+class DidCache:
+    def __init__(self, resolver=None, ttl: float = DID_CACHE_TTL, negative_ttl: float = DID_NEGATIVE_CACHE_TTL, max_size: int = DID_CACHE_SIZE):
+        self.resolver = resolver or AsyncHandleResolver(timeout=DID_RESOLVE_TIMEOUT)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()  # handle -> (DID or None, expiry)
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def resolve(self, handle: str) -> Optional[str]:
+        """DID of `handle`, or None if it doesn't resolve"""
+        key = normalize_handle(handle)
+        cached = self._entries.get(key)
+        if cached and cached[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            if cached[0]:
+                self.hits += 1
+                DID_LOOKUPS.labels("hit").inc()
+            else:
+                self.negative_hits += 1
+                DID_LOOKUPS.labels("negative").inc()
+            return cached[0]
+
+        task = self._pending.get(key)
+        if task:
+            self.coalesced += 1
+            DID_LOOKUPS.labels("coalesced").inc()
+        else:
+            self.misses += 1
+            DID_LOOKUPS.labels("miss").inc()
+            task = self._pending[key] = asyncio.create_task(self._resolve(key))
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # A caller that goes away (client disconnect) doesn't cancel the lookup for the others
+        return await asyncio.shield(task)
+
+    async def _resolve(self, key: str) -> Optional[str]:
+        with DID_RESOLVE.time():
+            did = await self.resolver.resolve(key)
+        self._entries[key] = (did, time.monotonic() + (self.ttl if did else self.negative_ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return did
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "handles": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "resolving": len(self._pending),
+        }
+
+
+did_cache = DidCache()
@@ -0,0 +1,116 @@
+"""
+SIZE-TARGETED IMAGE ENCODER
+=============================
+- Large JPEGs are decoded at reduced scale with Image.draft (DCT scaling),
+  which is several times faster than a full decode followed by a resize
+- Dimensions are capped first, then quality/dimensions are searched to land
+  just under the blob budget in as few encode passes as possible
+- Lossless sources (PNG screenshots, GIF) are re-encoded as JPEG when that is
+  what it takes to fit; transparency is kept as PNG only if PNG fits
+- Returns per-image stats (encode time, passes, bytes saved)
+"""
+
+import time
+from io import BytesIO
+from typing import Any, Dict, Tuple
+
+from PIL import Image, ImageFile
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True  # Handle incomplete images gracefully
+
+MAX_BLOB_BYTES = 976 * 1024  # Bluesky image blob limit
+MAX_DIMENSION = 2000  # Bluesky clients never display images larger than this
+MAX_PASSES = 6
+START_QUALITY = 85
+MIN_QUALITY = 55
+
+
+def _fit_within(width: int, height: int, max_dimension: int) -> Tuple[int, int]:
+    scale = min(1.0, max_dimension / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if fmt == "PNG":
+        img.save(buffer, format="PNG")
+    else:
+        img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def encode_image(data: bytes, max_bytes: int = MAX_BLOB_BYTES, max_dimension: int = MAX_DIMENSION) -> Tuple[bytes, Dict[str, Any]]:
+    """Re-encode an image to fit in max_bytes. Returns (bytes, stats)"""
+    start = time.perf_counter()
+    passes = 0
+
+    with Image.open(BytesIO(data)) as source:
+        source_format = source.format or "JPEG"
+        width, height = _fit_within(source.width, source.height, max_dimension)
+        # Rough output size if the source format were kept at the target dimensions
+        same_format_estimate = len(data) * (width * height) / (source.width * source.height)
+
+        if source_format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers the target size
+            source.draft("RGB", (width, height))
+
+        img = source.convert("RGBA" if _has_alpha(source) else "RGB")
+
+    if img.size != (width, height):
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+
+    result = None
+    fmt = "JPEG"
+    if img.mode == "RGBA":
+        # Keep transparency when PNG fits; otherwise flatten onto white for JPEG
+        if same_format_estimate <= max_bytes * 1.5:
+            passes += 1
+            candidate = _encode(img, "PNG", 0)
+            if len(candidate) <= max_bytes:
+                result, fmt = candidate, "PNG"
+        if result is None:
+            flattened = Image.new("RGB", img.size, (255, 255, 255))
+            flattened.paste(img, mask=img.getchannel("A"))
+            img = flattened
+
+    quality = START_QUALITY
+    while result is None and passes < MAX_PASSES:
+        passes += 1
+        candidate = _encode(img, "JPEG", quality)
+        if len(candidate) <= max_bytes:
+            result = candidate
+            break
+
+        # JPEG size is roughly proportional to pixel count; quality only buys ~2x
+        ratio = max_bytes / len(candidate)
+        if ratio > 0.7 and quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 15)
+        else:
+            scale = (ratio * 0.9) ** 0.5
+            img = img.resize(
+                (max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                Image.Resampling.LANCZOS
+            )
+
+    if result is None:
+        # Last resort: small enough by construction
+        img.thumbnail((1000, 1000), Image.Resampling.LANCZOS)
+        passes += 1
+        result = _encode(img, "JPEG", MIN_QUALITY)
+
+    stats = {
+        "source_format": source_format,
+        "format": fmt,
+        "passes": passes,
+        "width": img.width,
+        "height": img.height,
+        "original_bytes": len(data),
+        "bytes": len(result),
+        "bytes_saved": len(data) - len(result),
+        "encode_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    return result, stats
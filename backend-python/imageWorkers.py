@@ -0,0 +1,79 @@
+"""
+IMAGE WORKER POOL
+===================
+- Pillow decode/resize/encode runs in a process pool, never on the event loop
+- Submissions are bounded (IMAGE_QUEUE_SIZE) so concurrent migrations can't
+  pile up unbounded image bytes waiting for a worker
+- IMAGE_WORKERS=0 falls back to a thread (still off the event loop)
+- A crashed worker process is replaced on the next submission
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from imageEncoder import encode_image
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", str(max(IMAGE_WORKERS, 1) * 2)))
+
+
+class ImageWorkerPool:
+    def __init__(self, workers: int = IMAGE_WORKERS, queue_size: int = IMAGE_QUEUE_SIZE):
+        self.workers = workers
+        self._slots = asyncio.Semaphore(max(queue_size, 1))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.processed = 0
+        self.failed = 0
+        self.bytes_saved = 0
+        self.encode_ms = 0.0
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._executor is None:
+            # spawn: never fork a process that already runs an event loop and sqlite threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run a picklable function on a worker once a submission slot is free"""
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            try:
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool:
+                print("Image worker pool broke; starting a new one")
+                self._executor = None
+                self.failed += 1
+                raise
+            self.processed += 1
+            return result
+
+    async def encode(self, data: bytes) -> Tuple[bytes, Dict[str, Any]]:
+        """Re-encode an oversized image to fit the blob limit (see imageEncoder.py)"""
+        result, stats = await self.run(encode_image, data)
+        self.bytes_saved += stats["bytes_saved"]
+        self.encode_ms += stats["encode_ms"]
+        return result, stats
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "bytes_saved": self.bytes_saved,
+            "avg_encode_ms": round(self.encode_ms / self.processed, 1) if self.processed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_workers = ImageWorkerPool()
@@ -0,0 +1,74 @@
+"""
+MIGRATION CREDENTIALS
+=======================
+- The Bluesky app password of a queued migration is never written to the job
+  queue in plaintext: it is kept in memory, keyed by job id, until the job is
+  finished
+- With SESSION_ENCRYPTION_KEY set it is also stored in the job Fernet-encrypted
+  (key derived from SESSION_ENCRYPTION_KEY alone), so a job redelivered after a
+  restart, or leased by another process, can still log in
+- A job whose password is in neither place fails and asks the user to submit
+  the migration again
+"""
+
+import base64
+import hashlib
+from typing import Any, Dict, Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from blueskySessions import SESSION_ENCRYPTION_KEY, KEY_DERIVATION_ROUNDS
+from jobQueue import Job
+
+SEALED_FIELD = "sealedPassword"
+
+
+class MissingCredentials(RuntimeError):
+    """The job's password was only kept in memory by a process that is gone"""
+
+    def __init__(self):
+        super().__init__("The migration was interrupted and its credentials are gone; please submit it again.")
+
+
+class JobCredentials:
+    def __init__(self, secret: str = SESSION_ENCRYPTION_KEY):
+        self._fernet: Optional[Fernet] = None
+        if secret:
+            raw = hashlib.pbkdf2_hmac("sha256", secret.encode(), b"migration-credentials", KEY_DERIVATION_ROUNDS)
+            self._fernet = Fernet(base64.urlsafe_b64encode(raw))
+        self._passwords: Dict[str, str] = {}
+
+    def seal(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Job payload to persist: `data` without the password (encrypted when a key is configured)"""
+        data = dict(data)
+        password = data.pop("password", None)
+        if password is not None and self._fernet is not None:
+            data[SEALED_FIELD] = self._fernet.encrypt(password.encode()).decode()
+        return data
+
+    def remember(self, job_id: str, password: str):
+        self._passwords[job_id] = password
+
+    def available(self, job: Job) -> bool:
+        return job.id in self._passwords or (self._fernet is not None and SEALED_FIELD in job.data) or "password" in job.data
+
+    def password(self, job: Job) -> str:
+        """Password of a leased job; raises MissingCredentials if it can't be recovered"""
+        password = self._passwords.get(job.id)
+        if password is not None:
+            return password
+        sealed = job.data.get(SEALED_FIELD)
+        if sealed and self._fernet is not None:
+            try:
+                return self._fernet.decrypt(sealed.encode()).decode()
+            except InvalidToken:
+                pass  # Sealed under another SESSION_ENCRYPTION_KEY
+        if "password" in job.data:
+            return job.data["password"]  # Queued before passwords were kept out of the queue
+        raise MissingCredentials()
+
+    def forget(self, job_id: str):
+        self._passwords.pop(job_id, None)
+
+
+job_credentials = JobCredentials()
@@ -0,0 +1,425 @@
+"""
+DURABLE MIGRATION JOB QUEUE
+=============================
+- SQLite (WAL mode) backend by default so queued migrations survive restarts
+- Leases with visibility timeouts: a job whose processor dies is redelivered
+- At-least-once delivery: a job is only removed once it has been acked
+- Pluggable: any JobQueue implementation can be passed to MigrationScheduler
+- Weighted fair order instead of FIFO: every job gets a virtual finish tag
+  (virtual time at enqueue + cost / weight) and the smallest tag is leased
+  first, so cheap and heavily weighted jobs overtake expensive ones while
+  the advancing virtual time still bounds how long anything waits. A job
+  waiting longer than QUEUE_MAX_WAIT goes before everything else
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "sqlite")
+QUEUE_PATH = os.getenv("QUEUE_PATH", "migrations.db")
+VISIBILITY_TIMEOUT = float(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "300"))
+MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_MAX_WAIT = float(os.getenv("QUEUE_MAX_WAIT", "3600"))
+POLL_INTERVAL = 1.0  # Upper bound on how long an idle processor waits before re-checking
+
+
+@dataclass
+class Job:
+    id: str
+    data: Dict[str, Any]
+    attempts: int
+    lease_token: str
+    lease_expires_at: float
+    enqueued_at: float = 0.0
+
+
+class JobQueue:
+    """Interface shared by all queue backends"""
+
+    visibility_timeout: float = VISIBILITY_TIMEOUT
+
+    async def put(self, data: Dict[str, Any], weight: float = 1.0, cost: float = 1.0) -> str:
+        """Enqueue a job; its share of the queue grows with `weight` and shrinks with `cost`"""
+        raise NotImplementedError
+
+    async def lease(self, worker: str, visibility_timeout: Optional[float] = None) -> Job:
+        """Block until a job is available and lease it to `worker`"""
+        raise NotImplementedError
+
+    async def extend(self, job: Job, visibility_timeout: Optional[float] = None) -> bool:
+        """Push the lease deadline forward. Returns False if the lease was lost"""
+        raise NotImplementedError
+
+    async def ack(self, job: Job) -> bool:
+        """Remove a finished job. Returns False if the lease was lost"""
+        raise NotImplementedError
+
+    async def release(self, job: Job, delay: float = 0) -> bool:
+        """Give a job back to the queue without counting it as finished"""
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+    async def positions(self, key: str) -> Dict[Any, int]:
+        """data[key] -> 1-based position of each job waiting to be leased, in lease order"""
+        raise NotImplementedError
+
+    async def position(self, job_id: str) -> Optional[int]:
+        """1-based position of one waiting job (None once it is leased or gone)"""
+        raise NotImplementedError
+
+    async def position_of(self, key: str, value: Any) -> Optional[int]:
+        """position() of the waiting job whose data[key] is `value` (None if there is none)"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def _worker_id(worker: str) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{worker}"
+
+
+class MemoryJobQueue(JobQueue):
+    """Process-local backend with the same lease semantics (no durability)"""
+
+    def __init__(self, visibility_timeout: float = VISIBILITY_TIMEOUT, max_wait: float = QUEUE_MAX_WAIT):
+        self.visibility_timeout = visibility_timeout
+        self.max_wait = max_wait
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+
+    async def put(self, data: Dict[str, Any], weight: float = 1.0, cost: float = 1.0) -> str:
+        job_id = uuid.uuid4().hex
+        self._seq += 1
+        self._jobs[job_id] = {
+            "data": data,
+            "seq": self._seq,
+            "enqueued_at": time.time(),
+            "visible_at": time.time(),
+            "vfinish": self._virtual_time + cost / weight,
+            "attempts": 0,
+            "lease_token": None,
+        }
+        self._wakeup.set()
+        return job_id
+
+    def _order(self, now: float):
+        overdue_before = now - self.max_wait
+        return lambda entry: (entry["enqueued_at"] > overdue_before, entry["vfinish"], entry["seq"])
+
+    def _try_lease(self, visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        visible = [(job_id, entry) for job_id, entry in self._jobs.items() if entry["visible_at"] <= now]
+        if not visible:
+            return None
+        order = self._order(now)
+        job_id, entry = min(visible, key=lambda item: order(item[1]))
+        self._virtual_time = max(self._virtual_time, entry["vfinish"])
+        entry["attempts"] += 1
+        entry["lease_token"] = uuid.uuid4().hex
+        entry["visible_at"] = now + visibility_timeout
+        return Job(job_id, entry["data"], entry["attempts"], entry["lease_token"], entry["visible_at"], entry["enqueued_at"])
+
+    def _next_visible_in(self) -> float:
+        if not self._jobs:
+            return POLL_INTERVAL
+        soonest = min(entry["visible_at"] for entry in self._jobs.values())
+        return min(max(soonest - time.time(), 0.01), POLL_INTERVAL)
+
+    async def lease(self, worker: str, visibility_timeout: Optional[float] = None) -> Job:
+        while True:
+            self._wakeup.clear()
+            job = self._try_lease(visibility_timeout or self.visibility_timeout)
+            if job:
+                return job
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_visible_in())
+            except asyncio.TimeoutError:
+                pass
+
+    def _owned(self, job: Job) -> Optional[Dict[str, Any]]:
+        entry = self._jobs.get(job.id)
+        if entry is None or entry["lease_token"] != job.lease_token:
+            return None
+        return entry
+
+    async def extend(self, job: Job, visibility_timeout: Optional[float] = None) -> bool:
+        entry = self._owned(job)
+        if entry is None:
+            return False
+        entry["visible_at"] = time.time() + (visibility_timeout or self.visibility_timeout)
+        job.lease_expires_at = entry["visible_at"]
+        return True
+
+    async def ack(self, job: Job) -> bool:
+        if self._owned(job) is None:
+            return False
+        del self._jobs[job.id]
+        return True
+
+    async def release(self, job: Job, delay: float = 0) -> bool:
+        entry = self._owned(job)
+        if entry is None:
+            return False
+        entry["visible_at"] = time.time() + delay
+        entry["lease_token"] = None
+        self._wakeup.set()
+        return True
+
+    async def size(self) -> int:
+        return len(self._jobs)
+
+    async def positions(self, key: str) -> Dict[Any, int]:
+        waiting = sorted((entry for entry in self._jobs.values() if entry["lease_token"] is None), key=self._order(time.time()))
+        return {entry["data"].get(key): i + 1 for i, entry in enumerate(waiting)}
+
+    async def position(self, job_id: str) -> Optional[int]:
+        entry = self._jobs.get(job_id)
+        if entry is None or entry["lease_token"] is not None:
+            return None
+        order = self._order(time.time())
+        mine = order(entry)
+        return 1 + sum(1 for other in self._jobs.values() if other["lease_token"] is None and order(other) < mine)
+
+    async def position_of(self, key: str, value: Any) -> Optional[int]:
+        for job_id, entry in self._jobs.items():
+            if entry["lease_token"] is None and entry["data"].get(key) == value:
+                return await self.position(job_id)
+        return None
+
+
+# Overdue jobs first, then by virtual finish tag (ties: FIFO). One parameter: the overdue cutoff
+_FAIR_ORDER = "enqueued_at > ?, vfinish, seq"
+# data keys position_of() looks jobs up by, each with an index on its value
+_INDEXED_KEYS = ("migrationId",)
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite-backed queue. All statements run on one dedicated thread so the
+    event loop never blocks on disk I/O and the connection is never shared
+    across threads. Several processes may point at the same file: leasing
+    uses BEGIN IMMEDIATE so a job is handed to exactly one worker at a time.
+    """
+
+    def __init__(self, path: str = QUEUE_PATH, visibility_timeout: float = VISIBILITY_TIMEOUT, max_wait: float = QUEUE_MAX_WAIT):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-queue")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup = asyncio.Event()
+        self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                data TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                visible_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_token TEXT,
+                vfinish REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Queue files from before fair ordering: their jobs keep a tag of 0 and go first
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "vfinish" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN vfinish REAL NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_visible_at ON jobs (visible_at)")
+        # position(): jobs ahead of one are counted by range scans instead of a full table scan
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_fair ON jobs (vfinish, seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_enqueued_at ON jobs (enqueued_at)")
+        for key in _INDEXED_KEYS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS jobs_{key} ON jobs (json_extract(data, '$.{key}'))")
+        conn.execute("CREATE TABLE IF NOT EXISTS queue_state (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        self._conn = conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _virtual_time(self) -> float:
+        row = self._conn.execute("SELECT value FROM queue_state WHERE key = 'virtual_time'").fetchone()
+        return row[0] if row else 0.0
+
+    def _put(self, job_id: str, payload: str, increment: float) -> None:
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO jobs (id, data, enqueued_at, visible_at, vfinish) VALUES (?, ?, ?, ?, ?)",
+            (job_id, payload, now, now, self._virtual_time() + increment),
+        )
+
+    async def put(self, data: Dict[str, Any], weight: float = 1.0, cost: float = 1.0) -> str:
+        job_id = uuid.uuid4().hex
+        await self._run(self._put, job_id, json.dumps(data), cost / weight)
+        self._wakeup.set()
+        return job_id
+
+    def _try_lease(self, owner: str, visibility_timeout: float) -> Optional[Job]:
+        now = time.time()
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT id, data, attempts, enqueued_at, vfinish FROM jobs WHERE visible_at <= ? ORDER BY {_FAIR_ORDER} LIMIT 1",
+                (now, now - self.max_wait),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, payload, attempts, enqueued_at, vfinish = row
+            # Virtual time follows the tags being served, so later jobs can't overtake forever
+            conn.execute(
+                "INSERT INTO queue_state (key, value) VALUES ('virtual_time', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (vfinish,),
+            )
+            token = uuid.uuid4().hex
+            expires_at = now + visibility_timeout
+            conn.execute(
+                "UPDATE jobs SET visible_at = ?, attempts = ?, lease_owner = ?, lease_token = ? WHERE id = ?",
+                (expires_at, attempts + 1, owner, token, job_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(job_id, json.loads(payload), attempts + 1, token, expires_at, enqueued_at)
+
+    def _next_visible_in(self) -> float:
+        row = self._conn.execute("SELECT MIN(visible_at) FROM jobs").fetchone()
+        if not row or row[0] is None:
+            return POLL_INTERVAL
+        return min(max(row[0] - time.time(), 0.01), POLL_INTERVAL)
+
+    async def lease(self, worker: str, visibility_timeout: Optional[float] = None) -> Job:
+        owner = _worker_id(worker)
+        timeout = visibility_timeout or self.visibility_timeout
+        while True:
+            self._wakeup.clear()
+            job = await self._run(self._try_lease, owner, timeout)
+            if job:
+                return job
+            wait_for = await self._run(self._next_visible_in)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait_for)
+            except asyncio.TimeoutError:
+                pass
+
+    def _extend(self, job_id: str, token: str, expires_at: float) -> bool:
+        cur = self._conn.execute(
+            "UPDATE jobs SET visible_at = ? WHERE id = ? AND lease_token = ?",
+            (expires_at, job_id, token),
+        )
+        return cur.rowcount == 1
+
+    async def extend(self, job: Job, visibility_timeout: Optional[float] = None) -> bool:
+        expires_at = time.time() + (visibility_timeout or self.visibility_timeout)
+        extended = await self._run(self._extend, job.id, job.lease_token, expires_at)
+        if extended:
+            job.lease_expires_at = expires_at
+        return extended
+
+    def _ack(self, job_id: str, token: str) -> bool:
+        cur = self._conn.execute("DELETE FROM jobs WHERE id = ? AND lease_token = ?", (job_id, token))
+        return cur.rowcount == 1
+
+    async def ack(self, job: Job) -> bool:
+        return await self._run(self._ack, job.id, job.lease_token)
+
+    def _release(self, job_id: str, token: str, visible_at: float) -> bool:
+        cur = self._conn.execute(
+            "UPDATE jobs SET visible_at = ?, lease_owner = NULL, lease_token = NULL WHERE id = ? AND lease_token = ?",
+            (visible_at, job_id, token),
+        )
+        return cur.rowcount == 1
+
+    async def release(self, job: Job, delay: float = 0) -> bool:
+        released = await self._run(self._release, job.id, job.lease_token, time.time() + delay)
+        self._wakeup.set()
+        return released
+
+    def _size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    async def size(self) -> int:
+        return await self._run(self._size)
+
+    def _positions(self, key: str) -> Dict[Any, int]:
+        rows = self._conn.execute(
+            f"SELECT json_extract(data, ?) FROM jobs WHERE lease_token IS NULL ORDER BY {_FAIR_ORDER}",
+            (f"$.{key}", time.time() - self.max_wait),
+        ).fetchall()
+        return {row[0]: i + 1 for i, row in enumerate(rows)}
+
+    async def positions(self, key: str) -> Dict[Any, int]:
+        return await self._run(self._positions, key)
+
+    def _position(self, where: str, *params) -> Optional[int]:
+        # Waiting jobs ahead of it in _FAIR_ORDER, counted without reading their data
+        row = self._conn.execute(f"SELECT enqueued_at, vfinish, seq FROM jobs WHERE {where} AND lease_token IS NULL", params).fetchone()
+        if row is None:
+            return None
+        enqueued_at, vfinish, seq = row
+        cutoff = time.time() - self.max_wait
+        if enqueued_at <= cutoff:
+            # Overdue: only overdue jobs with a smaller tag go first
+            return 1 + self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lease_token IS NULL AND enqueued_at <= ? AND (vfinish, seq) < (?, ?)",
+                (cutoff, vfinish, seq),
+            ).fetchone()[0]
+        # Every overdue job goes first, then the others by tag
+        overdue = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE lease_token IS NULL AND enqueued_at <= ?", (cutoff,)
+        ).fetchone()[0]
+        return 1 + overdue + self._conn.execute(
+            # Unary +: scan jobs_fair up to this job rather than every job that isn't overdue
+            "SELECT COUNT(*) FROM jobs WHERE lease_token IS NULL AND +enqueued_at > ? AND (vfinish, seq) < (?, ?)",
+            (cutoff, vfinish, seq),
+        ).fetchone()[0]
+
+    async def position(self, job_id: str) -> Optional[int]:
+        return await self._run(self._position, "id = ?", job_id)
+
+    async def position_of(self, key: str, value: Any) -> Optional[int]:
+        if key not in _INDEXED_KEYS:
+            raise ValueError(f"Jobs are not indexed by {key}")
+        return await self._run(self._position, f"json_extract(data, '$.{key}') = ?", value)
+
+    async def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+        self._executor.shutdown(wait=True)
+
+
+def create_job_queue(backend: str = QUEUE_BACKEND, **kwargs) -> JobQueue:
+    """Build the queue backend selected by QUEUE_BACKEND ("sqlite" or "memory")"""
+    if backend == "sqlite":
+        return SQLiteJobQueue(**kwargs)
+    if backend == "memory":
+        return MemoryJobQueue(**kwargs)
+    raise ValueError(f"Unknown queue backend: {backend}")
@@ -0,0 +1,68 @@
+"""
+TWITTER MEDIA VARIANT SELECTION
+=================================
+- pbs.twimg.com serves every photo in several sizes (?format=jpg&name=small,
+  medium, large, orig); the media entities already list their dimensions in
+  `sizes` and `original_info`
+- We request the smallest variant that still covers what Bluesky displays
+  (MEDIA_TARGET_DIMENSION on the longest side), instead of the full original
+- If that variant can't be downloaded, progressively larger ones are tried
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+MEDIA_TARGET_DIMENSION = int(os.getenv("MEDIA_TARGET_DIMENSION", "2000"))
+
+# Named variants in increasing size; "orig" is the uploaded file
+VARIANT_ORDER = ["small", "medium", "large", "orig"]
+_VARIANT_URL = re.compile(r"^(https://pbs\.twimg\.com/[^?]+)\?format=(\w+)&name=(\w+)$")
+_MEDIA_URL = re.compile(r"^(https://pbs\.twimg\.com/[^?]+)\.(jpg|jpeg|png|webp)$")
+
+
+def _variant_url(base: str, fmt: str, name: str) -> str:
+    return f"{base}?format={fmt}&name={name}"
+
+
+def _dimensions(media: Dict[str, Any]) -> Dict[str, Tuple[int, int]]:
+    """Known (width, height) per variant name; crop variants (thumb) are left out"""
+    dims = {}
+    for name, size in (media.get("sizes") or {}).items():
+        if name in VARIANT_ORDER and size.get("resize", "fit") == "fit" and size.get("w") and size.get("h"):
+            dims[name] = (int(size["w"]), int(size["h"]))
+    original = media.get("original_info") or {}
+    if original.get("width") and original.get("height"):
+        dims["orig"] = (int(original["width"]), int(original["height"]))
+    return dims
+
+
+def select_variant(media: Dict[str, Any], target: int = MEDIA_TARGET_DIMENSION) -> Optional[str]:
+    """URL of the smallest variant whose longest side covers min(original, target)"""
+    url = media.get("media_url_https")
+    match = _MEDIA_URL.match(url or "")
+    if not match:
+        return url
+    base, fmt = match.group(1), match.group(2)
+    fmt = "jpg" if fmt == "jpeg" else fmt
+
+    dims = _dimensions(media)
+    if not dims:
+        return _variant_url(base, fmt, "large")
+
+    needed = min(max(dims.get("orig", (target, target))), target)
+    for name in VARIANT_ORDER:
+        if name in dims and max(dims[name]) >= needed:
+            return _variant_url(base, fmt, name)
+    return _variant_url(base, fmt, "orig")
+
+
+def fallback_urls(url: str) -> List[str]:
+    """Larger variants to try if `url` could not be downloaded"""
+    match = _VARIANT_URL.match(url or "")
+    if not match:
+        return []
+    base, fmt, name = match.groups()
+    if name not in VARIANT_ORDER:
+        return []
+    return [_variant_url(base, fmt, larger) for larger in VARIANT_ORDER[VARIANT_ORDER.index(name) + 1:]]
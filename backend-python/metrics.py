@@ -0,0 +1,193 @@
+"""
+OPERATIONAL METRICS
+=====================
+- Counters, gauges and histograms rendered in the Prometheus text format
+  (served on /metrics)
+- Everything runs on the event loop thread, so recording is a dict lookup
+  and an addition: no locks, no allocation once a label set has been seen
+- Histograms count per bucket (found with bisect) and only accumulate the
+  counts when scraped
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds; from a fast HTTP call to an hours-long rate limit wait
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WAIT_BUCKETS = (0.01, 0.1, 1, 5, 15, 60, 300, 900, 3600, 14400)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        """The child for one label set (cached: keep a reference in hot code)"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self._children.items():
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("target", "start")
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return _Timer(self._default())
+
+    def _render_child(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Queue and processors
+QUEUE_DEPTH = Gauge("bluemigrate_queue_depth", "Migrations waiting or running")
+QUEUE_WAIT = Histogram("bluemigrate_queue_wait_seconds", "Time from enqueue to first lease", buckets=WAIT_BUCKETS)
+PROCESSOR_BUSY = Counter("bluemigrate_processor_busy_seconds_total", "Time each processor spent on migrations", ["processor"])
+STAGE_ACTIVE = Gauge("bluemigrate_stage_active_workers", "Workers busy in each scheduler stage", ["stage"])
+STAGE_UTILIZATION = Gauge("bluemigrate_stage_utilization", "Busy fraction of each stage's workers since start", ["stage"])
+MIGRATIONS = Counter("bluemigrate_migrations_total", "Finished migrations", ["result"])
+
+# Twitter
+TWITTER_CALLS = Counter("bluemigrate_twitter_calls_total", "Twitter API calls", ["endpoint", "outcome"])
+TWITTER_LATENCY = Histogram("bluemigrate_twitter_call_seconds", "Twitter API call latency (after pacing)", ["endpoint"])
+TWITTER_PACING_WAIT = Histogram("bluemigrate_twitter_pacing_wait_seconds", "Time waiting for a Twitter endpoint slot", ["endpoint"], WAIT_BUCKETS)
+
+# Bluesky
+RATE_LIMIT_WAIT = Histogram("bluemigrate_bluesky_rate_limit_wait_seconds", "Time waiting in AccountRateLimiter.acquire", buckets=WAIT_BUCKETS)
+IMAGE_STAGE = Histogram("bluemigrate_image_seconds", "Image pipeline latency", ["stage"])
+POSTS = Counter("bluemigrate_posts_total", "Bluesky posts by result", ["result"])
+POST_ERRORS = Counter("bluemigrate_post_errors_total", "Errors while migrating tweets", ["error_class"])
+DID_LOOKUPS = Counter("bluemigrate_did_lookups_total", "Handle to DID lookups by cache outcome", ["result"])
+DID_RESOLVE = Histogram("bluemigrate_did_resolve_seconds", "Handle resolution latency on a cache miss")
+
+# Imported at startup: the process start time for /health
+STARTED_AT = time.time()
@@ -0,0 +1,119 @@
+"""
+MIGRATION CHECKPOINT JOURNAL
+==============================
+- Append-only JSON-lines file per migrationId
+- Records every tweet posted to Bluesky (uri/cid plus its thread root)
+  and the blob refs uploaded for it
+- A retried or redelivered migration replays the journal to skip tweets
+  that were already posted and reattach replies to the recorded parents
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journals")
+JOURNAL_RETENTION_DAYS = float(os.getenv("JOURNAL_RETENTION_DAYS", "7"))
+
+
+def _journal_path(migration_id: str, directory: str) -> str:
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", migration_id)
+    return os.path.join(directory, f"{safe_id}.jsonl")
+
+
+class MigrationJournal:
+    def __init__(self, migration_id: str, directory: str = JOURNAL_DIR, resume: bool = True):
+        os.makedirs(directory, exist_ok=True)
+        self.migration_id = migration_id
+        self.path = _journal_path(migration_id, directory)
+        self.posts: Dict[str, Dict[str, Any]] = {}
+        self.blobs: Dict[str, List[Dict[str, Any]]] = {}
+
+        if resume:
+            self._load()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        self._truncate_torn_tail()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring corrupt journal line in {self.path}")
+                    continue
+                tweet_id = entry.get("tweet_id")
+                if entry.get("type") == "post":
+                    self.posts[tweet_id] = entry
+                elif entry.get("type") == "blobs":
+                    self.blobs[tweet_id] = entry["blobs"]
+
+        if self.posts:
+            print(f"Journal for {self.migration_id}: resuming with {len(self.posts)} posts already created")
+
+    def _truncate_torn_tail(self):
+        """Drop a partial last line left by a crash so new entries start on a fresh line"""
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                print(f"Truncated torn write at the end of {self.path}")
+
+    def _append(self, entry: Dict[str, Any]):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def get_post(self, tweet_id) -> Optional[Dict[str, Any]]:
+        """Return {"uri", "cid", "root"} for an already-posted tweet"""
+        if tweet_id is None:
+            return None
+        return self.posts.get(str(tweet_id))
+
+    def get_blobs(self, tweet_id) -> Optional[List[Dict[str, Any]]]:
+        if tweet_id is None:
+            return None
+        return self.blobs.get(str(tweet_id))
+
+    def record_blobs(self, tweet_id, blobs: List[Dict[str, Any]]):
+        if tweet_id is None or not blobs:
+            return
+        entry = {"type": "blobs", "tweet_id": str(tweet_id), "blobs": blobs, "ts": time.time()}
+        self._append(entry)
+        self.blobs[entry["tweet_id"]] = blobs
+
+    def record_post(self, tweet_id, uri: str, cid: str, root: Dict[str, str]):
+        if tweet_id is None:
+            return
+        entry = {"type": "post", "tweet_id": str(tweet_id), "uri": uri, "cid": cid, "root": root, "ts": time.time()}
+        self._append(entry)
+        self.posts[entry["tweet_id"]] = entry
+
+    def close(self):
+        try:
+            self._file.close()
+        except Exception:
+            pass
+
+
+def prune_journals(directory: str = JOURNAL_DIR, max_age_days: float = JOURNAL_RETENTION_DAYS) -> int:
+    """Delete journals that have not been written to for `max_age_days`"""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".jsonl") and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    if removed:
+        print(f"Pruned {removed} old migration journals")
+    return removed
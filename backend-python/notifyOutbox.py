@@ -0,0 +1,274 @@
+"""
+MIGRATION STATUS OUTBOX
+=========================
+- Status notifications are written to a SQLite outbox before anything is sent,
+  so a frontend outage or a restart never loses a finished migration's status
+- One long-lived pooled HTTP client delivers them in batches
+  ({"notifications": [...]}) to the frontend's /api/notify
+- A newer status for the same migration replaces an undelivered older one
+- Failed deliveries are retried with exponential backoff (capped at
+  NOTIFY_MAX_BACKOFF seconds) until the frontend accepts them; a notification
+  the frontend itself rejects NOTIFY_MAX_REJECTIONS times is dropped
+- An unexpected error (SQLite, a malformed reply) is logged and the delivery
+  loop backs off and carries on, so delivery never stops silently
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from sqliteStore import SQLiteStore
+
+NOTIFY_OUTBOX_PATH = os.getenv("NOTIFY_OUTBOX_PATH", "notifications.db")
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "50"))
+NOTIFY_BATCH_DELAY = float(os.getenv("NOTIFY_BATCH_DELAY", "0.5"))  # Seconds to gather more status changes
+NOTIFY_MAX_BACKOFF = float(os.getenv("NOTIFY_MAX_BACKOFF", "600"))
+NOTIFY_MAX_REJECTIONS = int(os.getenv("NOTIFY_MAX_REJECTIONS", "10"))
+BASE_BACKOFF = 2.0
+HTTP_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+
+def backoff_delay(failures: int) -> float:
+    """Exponential backoff with full jitter on the upper half"""
+    delay = min(BASE_BACKOFF * 2 ** max(failures - 1, 0), NOTIFY_MAX_BACKOFF)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_results(body: Any) -> Dict[str, Dict[str, Any]]:
+    """Per-notification outcomes of a {"results": [{"migrationId": ..., "success": ...}, ...]} reply, by migration id"""
+    results = body.get("results") if isinstance(body, dict) else None
+    if not isinstance(results, list):
+        return {}
+    return {
+        result["migrationId"]: result
+        for result in results
+        if isinstance(result, dict) and isinstance(result.get("migrationId"), str)
+    }
+
+
+class NotifyOutbox(SQLiteStore):
+    """
+    At most one undelivered row per migration, each with its own failure and
+    rejection counts and next attempt time; a background task delivers the
+    due rows once start() has been called
+    """
+
+    def __init__(self, path: str = NOTIFY_OUTBOX_PATH, url: Optional[str] = None, batch_size: int = NOTIFY_BATCH_SIZE, batch_delay: float = NOTIFY_BATCH_DELAY):
+        self.path = path
+        self.url = url
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self.enqueued = 0
+        self.coalesced = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.batches = 0
+        self.delivery_latency = 0.0
+        self.last_error: Optional[str] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._open(path, "notify-outbox")
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                migration_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                failures INTEGER NOT NULL DEFAULT 0,
+                rejections INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)")
+
+    def _endpoint(self) -> str:
+        # Read when sending: API_FRONTEND_URL may come from a .env loaded after import
+        return self.url or f"{os.getenv('API_FRONTEND_URL')}/api/notify"
+
+    def _put(self, migration_id: str, payload: str) -> bool:
+        now = time.time()
+        replaced = self._conn.execute("SELECT 1 FROM outbox WHERE migration_id = ?", (migration_id,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO outbox (migration_id, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+            (migration_id, payload, now, now),
+        )
+        return replaced is not None
+
+    async def enqueue(self, notification: Dict[str, Any]):
+        """Store a status change; it is delivered in the background"""
+        replaced = await self._run(self._put, notification["migrationId"], json.dumps(notification))
+        self.enqueued += 1
+        if replaced:
+            self.coalesced += 1
+        if self._wake is not None:
+            self._wake.set()
+
+    def _due(self, limit: int) -> List[tuple]:
+        return self._conn.execute(
+            "SELECT migration_id, payload, created_at FROM outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+
+    def _next_due_in(self) -> Optional[float]:
+        row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def _delivered(self, rows: List[tuple]):
+        # Only delete the version that was sent; a newer status enqueued meanwhile stays
+        self._conn.executemany(
+            "DELETE FROM outbox WHERE migration_id = ? AND created_at = ?", [(row[0], row[2]) for row in rows]
+        )
+
+    def _failed(self, rows: List[tuple], rejected: bool) -> int:
+        """Reschedule after a failure; returns how many rejected notifications were dropped"""
+        dropped = 0
+        for migration_id, _, created_at in rows:
+            failures, rejections = self._conn.execute(
+                "SELECT failures, rejections FROM outbox WHERE migration_id = ? AND created_at = ?", (migration_id, created_at)
+            ).fetchone() or (None, None)
+            if failures is None:
+                continue
+            if rejected and rejections + 1 >= NOTIFY_MAX_REJECTIONS:
+                self._conn.execute("DELETE FROM outbox WHERE migration_id = ? AND created_at = ?", (migration_id, created_at))
+                dropped += 1
+                continue
+            self._conn.execute(
+                "UPDATE outbox SET failures = ?, rejections = ?, next_attempt_at = ? WHERE migration_id = ? AND created_at = ?",
+                (failures + 1, rejections + int(rejected), time.time() + backoff_delay(failures + 1), migration_id, created_at),
+            )
+        return dropped
+
+    def _pending(self):
+        return self._conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox").fetchone()
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(max_keepalive_connections=4, max_connections=8),
+            )
+        return self._http
+
+    async def _send(self, rows: List[tuple]):
+        notifications = [json.loads(row[1]) for row in rows]
+        try:
+            response = await self._client().post(self._endpoint(), json={"notifications": notifications})
+            response.raise_for_status()
+        except Exception as e:
+            # Frontend unreachable or erroring: everything in the batch is retried
+            self.failed_batches += 1
+            self.last_error = str(e)
+            await self._run(self._failed, rows, False)
+            print(f"Failed to deliver {len(rows)} notifications ({e}); retrying with backoff")
+            return
+
+        # Per-notification outcome; a frontend that doesn't report one accepted everything
+        try:
+            results = parse_results(response.json())
+        except ValueError:
+            results = {}
+        accepted = [row for row in rows if results.get(row[0], {}).get("success", True)]
+        rejected = [row for row in rows if not results.get(row[0], {}).get("success", True)]
+
+        now = time.time()
+        self.batches += 1
+        self.delivered += len(accepted)
+        self.delivery_latency += sum(now - row[2] for row in accepted)
+        await self._run(self._delivered, accepted)
+        if rejected:
+            self.rejected += len(rejected)
+            dropped = await self._run(self._failed, rejected, True)
+            self.dropped += dropped
+            for row in rejected:
+                print(f"Frontend rejected the notification for migration {row[0]}: {results[row[0]].get('error')}")
+
+    async def _deliver_loop(self):
+        errors = 0
+        while True:
+            try:
+                await self._deliver_due()
+                errors = 0
+            except Exception as e:
+                errors += 1
+                self.last_error = str(e)
+                print(f"Notification delivery error ({type(e).__name__}: {e}); retrying with backoff")
+                await asyncio.sleep(backoff_delay(errors))
+
+    async def _deliver_due(self):
+        self._wake.clear()
+        wait = await self._run(self._next_due_in)
+        if wait is None or wait > 0:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            return
+        # Let status changes that arrive together go out together
+        await asyncio.sleep(self.batch_delay)
+        rows = await self._run(self._due, self.batch_size)
+        if rows:
+            await self._send(rows)
+
+    def _on_loop_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Notification delivery stopped: {task.exception()!r}")
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._deliver_loop())
+            self._task.add_done_callback(self._on_loop_done)
+
+    async def flush(self, timeout: float = 5.0):
+        """Try to deliver everything that is due now (used at shutdown)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rows = await self._run(self._due, self.batch_size)
+            if not rows:
+                return
+            failed = self.failed_batches
+            await self._send(rows)
+            if self.failed_batches > failed:
+                return
+
+    async def stats(self) -> Dict[str, Any]:
+        pending, oldest = await self._run(self._pending)
+        return {
+            "pending": pending,
+            "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "delivered": self.delivered,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "avg_delivery_seconds": round(self.delivery_latency / self.delivered, 2) if self.delivered else 0.0,
+            "last_error": self.last_error,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        await super().close()
+
+
+notify_outbox = NotifyOutbox()
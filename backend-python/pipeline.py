@@ -0,0 +1,150 @@
+"""
+Helpers for the streaming fetch -> image preprocessing -> posting pipeline.
+"""
+
+import asyncio
+from contextlib import suppress
+
+
+class _StageFailed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+async def buffered(source, maxsize: int):
+    """
+    Run the async iterable `source` in a background task, at most `maxsize`
+    items ahead of the consumer. The producer blocks when the buffer is full
+    (backpressure) and its exceptions are re-raised in the consumer.
+    """
+    queue = asyncio.Queue(maxsize=max(1, maxsize))
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put(item)
+            await queue.put(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(_StageFailed(e))
+        finally:
+            if hasattr(source, "aclose"):
+                await source.aclose()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageFailed):
+                raise item.error
+            yield item
+    finally:
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
+
+
+class StageBuffer:
+    """
+    Hand-off between two stages that run in different tasks: one task runs
+    feed(source), another iterates the buffer. Unlike buffered(), the
+    producer's lifetime is owned by whoever calls feed(), so a stage worker
+    can fill it and move on to other work once the source is exhausted.
+    The producer blocks while `maxsize` items are waiting; closing the
+    consumer side cancels a producer that is still running.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue = asyncio.Queue(maxsize=max(1, maxsize))
+        self._producer = None
+        self.closed = False
+        self.items = 0
+
+    async def feed(self, source):
+        """Move everything from `source` into the buffer. Returns when the source is exhausted or the consumer closed"""
+        if self.closed:
+            return
+        self._producer = asyncio.create_task(self._produce(source))
+        # wait() rather than await: the producer being cancelled must not cancel the caller
+        await asyncio.wait([self._producer])
+
+    async def _produce(self, source):
+        try:
+            async for item in source:
+                await self._queue.put(item)
+                self.items += 1
+            await self._queue.put(_DONE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(_StageFailed(e))
+        finally:
+            if hasattr(source, "aclose"):
+                await source.aclose()
+
+    def __aiter__(self):
+        return self._consume()
+
+    async def _consume(self):
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageFailed):
+                raise item.error
+            yield item
+
+    async def aclose(self):
+        self.closed = True
+        if self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._producer
+
+
+class ByteBudget:
+    """
+    Bytes that pipelines across all migrations may hold ahead of their
+    consumers. Look-ahead work only starts if it fits (try_acquire); the item
+    a consumer waits for next always proceeds (force_acquire), so a migration
+    can never be starved by the others' look-ahead.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self.peak = 0
+        self.deferred = 0
+
+    def try_acquire(self, n: int) -> bool:
+        if self.used + n > self.capacity:
+            self.deferred += 1
+            return False
+        self.force_acquire(n)
+        return True
+
+    def force_acquire(self, n: int):
+        self.used += n
+        self.peak = max(self.peak, self.used)
+
+    def release(self, n: int):
+        self.used = max(self.used - n, 0)
+
+    def stats(self):
+        return {"capacity": self.capacity, "used": self.used, "peak": self.peak, "deferred": self.deferred}
+
+
+async def iterate(items):
+    """Async iterator over a plain list or an async iterable of items"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
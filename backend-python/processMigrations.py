@@ -1,118 +1,288 @@
 import asyncio
-import httpx
-from bluesky import migrateTweetsToBluesky
-from twitter import get_user_tweets, extract_thread
+from bluesky import migrateTweetsToBluesky, require_did, POST_LIMIT
+from twitter import iter_user_threads, iter_threads
+from twitterArchive import iter_archive_threads, remove_archive, archive_media
+from pipeline import StageBuffer, buffered
+from jobQueue import JobQueue, Job, MAX_ATTEMPTS
+from jobCredentials import job_credentials, MissingCredentials
+from notifyOutbox import notify_outbox
+from progressBus import progress_bus
+from metrics import MIGRATIONS, PROCESSOR_BUSY, QUEUE_WAIT
 from dotenv import load_dotenv
 import os
 import time
+from typing import Optional
 
 load_dotenv()
-api_frontend_url = os.getenv("API_FRONTEND_URL")
 
-# Add migration request to the queue
-async def add_to_queue(queue: asyncio.Queue, request_data: dict):
-    await queue.put(request_data)
+# Threads fetched from Twitter ahead of the Bluesky side (bounds memory per migration).
+# A fetch worker keeps pace with its job's posting and leases the next job once the last of it is fetched
+PIPELINE_BUFFER_THREADS = int(os.getenv("PIPELINE_BUFFER_THREADS", "50"))
 
-# Process migration tasks from the queue
-async def process_queue(queue: asyncio.Queue, processor_name: str = "default"):
-    last_processed_time = None
+# Queue order (see jobQueue.py): the frontend asks for more than the free limit only for premium users
+FREE_TWEET_LIMIT = int(os.getenv("FREE_TWEET_LIMIT", "150"))
+PREMIUM_WEIGHT = float(os.getenv("QUEUE_PREMIUM_WEIGHT", "10"))
+JOB_BASE_COST = 10  # Login, DID resolution and the first timeline page, whatever the size
+THREAD_URL_COST = 15  # Fetching and posting one thread given by URL
 
-    print(f"Queue processor {processor_name} started")
+# Weight and estimated cost (roughly posts to write) of a migration request
+def job_priority(request_data: dict):
+    premium = (request_data.get("limit") or 0) > FREE_TWEET_LIMIT
+    cost = JOB_BASE_COST + THREAD_URL_COST * len(request_data.get("threadUrls") or [])
+    if request_data.get("twitterName") or request_data.get("archiveId"):
+        cost += min(request_data.get("limit") or 800, POST_LIMIT)
+    return (PREMIUM_WEIGHT if premium else 1.0), cost
 
+# Add migration request to the queue (the password stays out of it, see jobCredentials.py)
+async def add_to_queue(queue: JobQueue, request_data: dict):
+    weight, cost = job_priority(request_data)
+    job_id = await queue.put(job_credentials.seal(request_data), weight=weight, cost=cost)
+    job_credentials.remember(job_id, request_data["password"])
+    progress_bus.update(request_data.get("migrationId"), stage="queued")
+    return job_id
+
+# Keep the lease of a running job alive so it is not redelivered to another processor
+async def keep_lease_alive(queue: JobQueue, job: Job, processor_name: str):
+    interval = queue.visibility_timeout / 3
     while True:
-        try:
-            # Wait for a task from the queue
-            request_data = await queue.get()
-            print(f"[{processor_name}] Processing migration task: {request_data.get('migrationId', 'unknown')}")
-
-            # SMART WAITING: Check rate limit status before enforcing gaps
-            if last_processed_time:
-                elapsed_time = time.time() - last_processed_time
-                # Adaptive waiting based on rate limit reset status
-                # Check if we need to wait for Twitter rate limit reset
-                from twitter import RESET_TIME, endpoint_counters, endpoint_start_times, ENDPOINT_RATE_LIMITS
-
-                # Check if any endpoint counters are still active
-                needs_wait = False
-                max_remaining_time = 0
-
-                for endpoint, limit in ENDPOINT_RATE_LIMITS.items():
-                    if endpoint in endpoint_counters and endpoint_counters[endpoint] > 0:
-                        start_time = endpoint_start_times.get(endpoint, time.time())
-                        elapsed = time.time() - start_time
-                        if elapsed < RESET_TIME:
-                            remaining = RESET_TIME - elapsed
-                            max_remaining_time = max(max_remaining_time, remaining)
-                            needs_wait = True
-
-                if needs_wait and max_remaining_time > 60:  # Only wait if more than 1 minute remaining
-                    sleep_time = min(max_remaining_time + 30, 300)  # Cap at 5 minutes
-                    print(f"[{processor_name}] RATE LIMIT ACTIVE: Waiting {sleep_time:.2f} seconds for Twitter rate limits to reset.")
-                    await asyncio.sleep(sleep_time)
-                elif elapsed_time < 60:  # Minimum 1 minute gap for safety
-                    sleep_time = 60 - elapsed_time
-                    print(f"[{processor_name}] MINIMUM GAP: Waiting {sleep_time:.2f} seconds before next migration.")
-                    await asyncio.sleep(sleep_time)
-
-            # Perform migration
-            await perform_migration(request_data)
-            success = True
-            error_message = None
+        await asyncio.sleep(interval)
+        if not await queue.extend(job):
+            print(f"[{processor_name}] Lost lease on job {job.id}; it may be redelivered.")
+            return
 
-        except Exception as e:
-            success = False
-            error_message = str(e)
-            print(f"[{processor_name}] Error processing task: {e}")
+# Workers per stage: fetching is bound by the Twitter budget, posting by the per-DID Bluesky budgets
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "0"))  # 0: one per Twitter session
+POST_CONCURRENCY = int(os.getenv("POST_CONCURRENCY", "4"))
 
-        finally:
-            # Notify task status
-            await notify_task_status(request_data, success=success, error_message=error_message, processor_name=processor_name)
 
-            # Always update the last processed time regardless of success to enforce rate limiting
-            last_processed_time = time.time()
-            queue.task_done()
+class _StageStats:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.active = 0
+        self.busy = 0.0
+        self.jobs = 0
+        self.started_at = time.monotonic()
 
-# Perform migration
-async def perform_migration(request_data: dict):
-    await migrate_tweets(request_data)
+    def begin(self) -> float:
+        self.active += 1
+        return time.monotonic()
 
-# Migrate user tweets
-async def migrate_tweets(request_data: dict):
-    limit = request_data.get("limit", 800)
-    print(f"Starting tweet migration for {request_data['twitterName']} with limit {limit}.")
+    def end(self, began: float):
+        self.active -= 1
+        self.busy += time.monotonic() - began
+        self.jobs += 1
 
-    tweets = await get_user_tweets(request_data["twitterName"], limit=limit)
+    def status(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "jobs": self.jobs,
+            "utilization": round(self.busy / (elapsed * self.workers), 3),
+        }
 
-    # Extract thread data if thread URLs are provided
-    thread_urls = request_data.get("threadUrls", [])
-    if thread_urls:
-        threads = await extract_threads(thread_urls)
-        tweets.extend(threads)
 
-    await migrateTweetsToBluesky(tweets, request_data["bskyHandle"], request_data["password"], request_data["did"], request_data["migrationId"])
+class _Handoff:
+    """A leased job on its way from the fetch stage to the post stage"""
+
+    def __init__(self, job: Job, heartbeat: asyncio.Task):
+        self.job = job
+        self.heartbeat = heartbeat
+        self.threads = StageBuffer(PIPELINE_BUFFER_THREADS)
+
+
+class MigrationScheduler:
+    """
+    Two worker pools over one job queue. A fetch worker leases a job, hands
+    it to the post stage right away and streams its threads into the job's
+    buffer, holding its slot (so FETCH_CONCURRENCY bounds the Twitter
+    fetches running at once) until the fetch is done; it then leases the
+    next job while the previous one is still being posted. A post worker
+    writes one job at a time and finishes it (ack + notification). Jobs in
+    flight are bounded by the total number of workers, and so is the memory
+    their buffers hold.
+    """
+
+    def __init__(self, queue: JobQueue, fetch_concurrency: int, post_concurrency: int):
+        self.queue = queue
+        self.fetch = _StageStats(max(1, fetch_concurrency))
+        self.post = _StageStats(max(1, post_concurrency))
+        self._handoffs = asyncio.Queue()
+        self._in_flight = asyncio.Semaphore(self.fetch.workers + self.post.workers)
+        self.tasks = []
+
+    def start(self):
+        for i in range(self.fetch.workers):
+            self.tasks.append(asyncio.create_task(self._fetch_worker(f"fetch-{i + 1}")))
+        for i in range(self.post.workers):
+            self.tasks.append(asyncio.create_task(self._post_worker(f"post-{i + 1}")))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Jobs handed off but not picked up by a post worker yet
+        while not self._handoffs.empty():
+            handoff = self._handoffs.get_nowait()
+            handoff.heartbeat.cancel()
+            await handoff.threads.aclose()
+            await self.queue.release(handoff.job)
+
+    def running(self) -> int:
+        return sum(1 for task in self.tasks if not task.done())
+
+    def status(self):
+        return {"fetch": self.fetch.status(), "post": self.post.status(), "waiting_for_post": self._handoffs.qsize()}
+
+    # Fetch stage
+    async def _fetch_worker(self, name: str):
+        print(f"Queue processor {name} started")
+        busy_seconds = PROCESSOR_BUSY.labels(name)
+        while True:
+            await self._in_flight.acquire()
+            try:
+                job = await self.queue.lease(name)
+            except BaseException:
+                self._in_flight.release()
+                raise
+            began = self.fetch.begin()
+            request_data = job.data
+            if job.attempts == 1 and job.enqueued_at:
+                QUEUE_WAIT.observe(time.time() - job.enqueued_at)
+            handoff = _Handoff(job, asyncio.create_task(keep_lease_alive(self.queue, job, name)))
+            print(f"[{name}] Fetching migration task: {request_data.get('migrationId', 'unknown')} (attempt {job.attempts})")
+            progress_bus.update(request_data.get("migrationId"), stage="fetching")
+
+            # Posting starts as soon as the first thread is in the buffer
+            self._handoffs.put_nowait(handoff)
+            try:
+                # A job that keeps killing its processor must not be redelivered forever
+                if job.attempts > MAX_ATTEMPTS:
+                    await handoff.threads.feed(_abandoned(job))
+                elif not job_credentials.available(job):
+                    # Can't log in to Bluesky: don't spend the Twitter budget on it
+                    await handoff.threads.feed(_no_credentials())
+                else:
+                    await handoff.threads.feed(stream_threads(request_data, request_data.get("limit", 800)))
+            finally:
+                self.fetch.end(began)
+                busy_seconds.inc(time.monotonic() - began)
+
+    # Post stage
+    async def _post_worker(self, name: str):
+        print(f"Queue processor {name} started")
+        busy_seconds = PROCESSOR_BUSY.labels(name)
+        while True:
+            handoff = await self._handoffs.get()
+            began = self.post.begin()
+            job, request_data = handoff.job, handoff.job.data
+            try:
+                print(f"[{name}] Posting migration task: {request_data.get('migrationId', 'unknown')}")
+                await migrate_tweets(request_data, handoff.threads, job_credentials.password(job))
+                success = True
+                error_message = None
+
+            except asyncio.CancelledError:
+                # Shutting down: hand the job back so it is picked up again on restart
+                handoff.heartbeat.cancel()
+                await asyncio.shield(handoff.threads.aclose())
+                await asyncio.shield(self.queue.release(job))
+                self._in_flight.release()
+                raise
 
-    print(f"Migration completed for {request_data['twitterName']}")
+            except Exception as e:
+                success = False
+                error_message = str(e)
+                print(f"[{name}] Error processing task: {e}")
+                await handoff.threads.aclose()
 
-# Extract thread data from URLs
-async def extract_threads(thread_urls: list):
-    threads = []
-    for url in thread_urls:
+            finally:
+                self.post.end(began)
+                busy_seconds.inc(time.monotonic() - began)
+
+            MIGRATIONS.labels("success" if success else "failed").inc()
+            progress_bus.finish(request_data.get("migrationId"), success, error_message)
+            try:
+                await self._finish(job, success, error_message, name)
+            except Exception as e:
+                # Still leased: redelivered once the lease expires (posts already written are resumed from the journal)
+                print(f"[{name}] Could not finish task {job.id}: {e}")
+            finally:
+                handoff.heartbeat.cancel()
+                self._in_flight.release()
+
+    async def _finish(self, job: Job, success: bool, error_message: Optional[str], name: str):
+        request_data = job.data
         try:
-            print(f"Extracting thread for URL: {url}")
-            thread = await extract_thread(url)
-            if thread:
-                threads.append(thread)
-            else:
-                print(f"No thread data returned for URL: {url}")
+            await notify_task_status(request_data, success=success, error_message=error_message, processor_name=name)
         except Exception as e:
-            print(f"Error extracting thread for URL {url}: {e}")
-            # Continue processing other threads instead of failing entirely
-            continue
-    return threads
+            print(f"[{name}] Could not store the status notification of task {job.id}: {e}")
+        await self.queue.ack(job)
+        job_credentials.forget(job.id)
+        # A failed archive migration can be submitted again until the archive is pruned
+        if request_data.get("archiveId"):
+            if success:
+                remove_archive(request_data["archiveId"])
+            else:
+                archive_media.forget(request_data["archiveId"])
+
+async def _abandoned(job: Job):
+    raise RuntimeError(f"Migration abandoned after {job.attempts - 1} interrupted attempts")
+    yield
+
+async def _no_credentials():
+    raise MissingCredentials()
+    yield
+
+# Migrate user tweets: `threads` is filled by the fetch stage, or fetched here when not given
+async def migrate_tweets(request_data: dict, threads=None, password: str = None):
+    limit = request_data.get("limit", 800)
+    print(f"Starting tweet migration for {request_data.get('twitterName') or 'threads'} with limit {limit}.")
 
-# Notify task status
+    if threads is None:
+        # Twitter pagination runs in its own task, a bounded buffer ahead of image preprocessing and posting
+        threads = buffered(stream_threads(request_data, limit), PIPELINE_BUFFER_THREADS)
+    try:
+        await migrateTweetsToBluesky(threads, request_data["bskyHandle"], password or request_data["password"], request_data["did"], request_data["migrationId"])
+    finally:
+        await threads.aclose()
+
+    print(f"Migration completed for {request_data.get('twitterName') or 'threads'}")
+
+# Fetch stage: timeline threads first, then the requested thread URLs (minus tweets the timeline already covered)
+async def stream_threads(request_data: dict, limit: int):
+    migration_id = request_data.get("migrationId")
+    fetched = 0
+    migrating = set()
+    # Accepted without a DID (DID_RESOLUTION=worker): an unknown handle fails before any Twitter call
+    if not request_data.get("did"):
+        await require_did(request_data["bskyHandle"])
+    if request_data.get("archiveId"):
+        # An uploaded Twitter archive replaces the timeline (see twitterArchive.py)
+        progress_bus.update(migration_id, expected_posts=min(limit or POST_LIMIT, POST_LIMIT))
+        async for thread in iter_archive_threads(request_data["archiveId"], limit=limit, migrating=migrating):
+            fetched += len(thread)
+            progress_bus.update(migration_id, tweets_fetched=fetched)
+            yield thread
+    elif request_data.get("twitterName"):
+        # Until the timeline is exhausted the limit is the best guess of what will be posted
+        progress_bus.update(migration_id, expected_posts=min(limit, POST_LIMIT))
+        async for thread in iter_user_threads(request_data["twitterName"], limit=limit, migrating=migrating):
+            fetched += len(thread)
+            progress_bus.update(migration_id, tweets_fetched=fetched)
+            yield thread
+
+    # Extract thread data if thread URLs are provided
+    thread_urls = request_data.get("threadUrls") or []
+    async for thread in iter_threads(thread_urls, migrating):
+        fetched += len(thread)
+        progress_bus.update(migration_id, tweets_fetched=fetched)
+        yield thread
+
+    progress_bus.update(migration_id, expected_posts=min(fetched, POST_LIMIT))
+
+# Notify task status (stored in the outbox and delivered in batches, see notifyOutbox.py)
 async def notify_task_status(request_data: dict, success: bool, error_message: str = None, processor_name: str = "default"):
-    url = f"{api_frontend_url}/api/notify"
     payload = {
         "migrationId": request_data["migrationId"],
         "twitterName": request_data.get("twitterName"),
@@ -122,10 +292,5 @@ async def notify_task_status(request_data: dict, success: bool, error_message: s
         "error_message": error_message,
         "processor": processor_name,  # Add processor identification
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            print(f"[{processor_name}] Notification sent for {request_data['bskyHandle']}.")
-        except Exception as e:
-            print(f"[{processor_name}] Failed to notify status for {request_data['bskyHandle']}: {e}")
+    await notify_outbox.enqueue(payload)
+    print(f"[{processor_name}] Notification queued for {request_data['bskyHandle']}.")
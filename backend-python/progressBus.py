@@ -0,0 +1,216 @@
+"""
+MIGRATION PROGRESS BUS
+========================
+- The migration loop records its counters with update(), which only touches
+  a dict; at most every PROGRESS_INTERVAL seconds the state is turned into one
+  pre-serialized Server-Sent-Events frame per migration
+- Subscribers never poll: they wait on the migration's current asyncio.Event,
+  which is swapped for a fresh one on every publish, then send the latest
+  frame. A slow subscriber skips intermediate frames instead of queueing them
+- Queue positions are read from the job queue by one shared task, and only
+  while someone is watching a queued migration
+- Finished migrations stay subscribable for PROGRESS_RETENTION seconds
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Optional
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "0.5"))
+PROGRESS_RETENTION = float(os.getenv("PROGRESS_RETENTION", "300"))
+QUEUE_POSITION_REFRESH = 2.0  # Seconds between queue position reads while someone watches
+RATE_REFRESH = 5.0  # Republish a watched migration this often even without new counters
+KEEPALIVE_INTERVAL = 15.0  # Comment line so proxies don't close an idle stream
+RATE_WINDOW = 60.0  # Seconds of posting history behind posts/sec
+TERMINAL_STAGES = ("completed", "failed")
+
+
+class _Channel:
+    def __init__(self, migration_id: str):
+        self.state: Dict[str, Any] = {
+            "migrationId": migration_id,
+            "stage": "queued",
+            "queue_position": None,
+            "posts_made": 0,
+            "successful_posts": 0,
+            "failed_posts": 0,
+            "threads_processed": 0,
+            "tweets_fetched": 0,
+            "expected_posts": None,
+            "error": None,
+        }
+        self.version = 0
+        self.frame = b""
+        self.final = False
+        self.published_at = 0.0
+        self.changed = asyncio.Event()
+        self.dirty = False
+        self.subscribers = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.samples = deque()  # (time, posts_made) within RATE_WINDOW
+
+
+class ProgressBus:
+    def __init__(self, interval: float = PROGRESS_INTERVAL, retention: float = PROGRESS_RETENTION):
+        self.interval = interval
+        self.retention = retention
+        self.workers = 1
+        self._channels: Dict[str, _Channel] = {}
+        self._queue = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._positions_task: Optional[asyncio.Task] = None
+        self._durations = deque(maxlen=50)  # Recent migration durations, for queued ETAs
+        self.frames_published = 0
+
+    def attach(self, queue, workers: int):
+        """Read queue positions from `queue`; `workers` migrations run at once"""
+        self._queue = queue
+        self.workers = max(1, workers)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _channel(self, migration_id: str) -> _Channel:
+        channel = self._channels.get(migration_id)
+        if channel is None:
+            channel = self._channels[migration_id] = _Channel(migration_id)
+        return channel
+
+    def update(self, migration_id: Optional[str], **fields):
+        """Record new counters or a new stage; cheap enough for the posting loop"""
+        if not migration_id:
+            return
+        channel = self._channel(migration_id)
+        channel.state.update(fields)
+        if "posts_made" in fields:
+            channel.samples.append((time.monotonic(), fields["posts_made"]))
+        if "stage" in fields and fields["stage"] != "queued" and channel.started_at is None:
+            channel.started_at = time.monotonic()
+            channel.state["queue_position"] = None
+        channel.dirty = True
+
+    def finish(self, migration_id: Optional[str], success: bool, error: Optional[str] = None):
+        if not migration_id:
+            return
+        channel = self._channel(migration_id)
+        channel.state.update(stage="completed" if success else "failed", error=error)
+        channel.finished_at = time.monotonic()
+        if channel.started_at is not None:
+            self._durations.append(channel.finished_at - channel.started_at)
+        # Terminal states go out right away
+        self._publish(channel)
+
+    def _rates(self, channel: _Channel):
+        now = time.monotonic()
+        samples = channel.samples
+        while len(samples) > 2 and samples[0][0] < now - RATE_WINDOW:
+            samples.popleft()
+        posts_per_sec = 0.0
+        if len(samples) >= 2 and samples[-1][0] > samples[0][0]:
+            posts_per_sec = (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+        state = channel.state
+        eta = None
+        if state["stage"] == "queued" and state["queue_position"] and self._durations:
+            average = sum(self._durations) / len(self._durations)
+            eta = (state["queue_position"] + self.workers - 1) // self.workers * average
+        elif state["stage"] not in TERMINAL_STAGES and state["expected_posts"] and posts_per_sec > 0:
+            eta = max(state["expected_posts"] - state["posts_made"], 0) / posts_per_sec
+        return round(posts_per_sec, 2), None if eta is None else round(eta)
+
+    def _publish(self, channel: _Channel):
+        posts_per_sec, eta = self._rates(channel)
+        snapshot = dict(channel.state, posts_per_sec=posts_per_sec, eta_seconds=eta)
+        channel.version += 1
+        event = "done" if channel.state["stage"] in TERMINAL_STAGES else "progress"
+        # Serialized once, shared by every subscriber
+        channel.frame = f"id: {channel.version}\nevent: {event}\ndata: {json.dumps(snapshot)}\n\n".encode()
+        channel.final = event == "done"
+        channel.dirty = False
+        channel.published_at = time.monotonic()
+        self.frames_published += 1
+        changed, channel.changed = channel.changed, asyncio.Event()
+        changed.set()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            for migration_id, channel in list(self._channels.items()):
+                if channel.subscribers:
+                    # Only watched migrations are serialized; quiet ones still get a fresh posts/sec and ETA
+                    if channel.dirty or (not channel.final and now - channel.published_at > RATE_REFRESH):
+                        self._publish(channel)
+                elif channel.finished_at is not None and now - channel.finished_at > self.retention:
+                    del self._channels[migration_id]
+
+    async def _refresh_positions(self):
+        """One queue read for everyone watching a queued migration"""
+        while any(c.subscribers and c.state["stage"] == "queued" for c in self._channels.values()):
+            try:
+                positions = await self._queue.positions("migrationId")
+            except Exception as e:
+                print(f"Could not read queue positions: {e}")
+                positions = {}
+            for migration_id, channel in self._channels.items():
+                if channel.state["stage"] == "queued":
+                    position = positions.get(migration_id)
+                    if position != channel.state["queue_position"]:
+                        channel.state["queue_position"] = position
+                        channel.dirty = True
+            await asyncio.sleep(QUEUE_POSITION_REFRESH)
+        self._positions_task = None
+
+    async def exists(self, migration_id: str) -> bool:
+        """Known to the bus, or still waiting in the queue (e.g. queued before a restart)"""
+        channel = self._channels.get(migration_id)
+        if channel is not None and channel.state["stage"] != "queued":
+            return True
+        if self._queue is None:
+            return channel is not None
+        # Queued: also gives the first frame a queue position
+        position = await self._queue.position_of("migrationId", migration_id)
+        if position is not None:
+            channel = self._channel(migration_id)
+            channel.state["queue_position"] = position
+            channel.dirty = True
+        return channel is not None
+
+    async def subscribe(self, migration_id: str) -> AsyncIterator[bytes]:
+        """SSE frames for one migration, ending after its final state"""
+        channel = self._channel(migration_id)
+        channel.subscribers += 1
+        if channel.state["stage"] == "queued" and self._queue is not None and self._positions_task is None:
+            self._positions_task = asyncio.create_task(self._refresh_positions())
+        try:
+            if channel.version == 0 or channel.dirty:
+                self._publish(channel)
+            sent = 0
+            while True:
+                if channel.version != sent:
+                    sent = channel.version
+                    yield channel.frame
+                    if channel.final:
+                        return
+                changed = channel.changed
+                if channel.version != sent:
+                    continue  # Published while the last frame was being sent
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            channel.subscribers -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "migrations": len(self._channels),
+            "subscribers": sum(c.subscribers for c in self._channels.values()),
+            "frames_published": self.frames_published,
+        }
+
+
+progress_bus = ProgressBus()
@@ -1,53 +1,183 @@
 import asyncio
-from collections import defaultdict
-from datetime import datetime, timedelta
+import heapq
+import itertools
+import time
+from collections import deque
+
+from metrics import RATE_LIMIT_WAIT
+
+
+class _AccountState:
+    __slots__ = ("hourly_tat", "daily_tat", "waiters", "timer_at")
+
+    def __init__(self, now):
+        # GCRA "theoretical arrival times": the budget is fully free once now >= tat
+        self.hourly_tat = now
+        self.daily_tat = now
+        self.waiters = deque()  # FIFO of (future, points)
+        self.timer_at = None
 
 
 class AccountRateLimiter:
-    def __init__(self, hourly_limit=5000, daily_limit=35000):
+    """
+    Per-account points limiter (GCRA, i.e. a sliding window that refills
+    continuously) with an hourly and a daily budget.
+
+    Waiters queue FIFO per account and are woken by a single timer heap at the
+    exact moment their points become available; there is no polling and no
+    global lock.
+    """
+
+    def __init__(self, hourly_limit=5000, daily_limit=35000, hourly_window=3600.0, daily_window=86400.0):
         self.hourly_limit = hourly_limit
         self.daily_limit = daily_limit
-        self.account_limits = defaultdict(lambda: {"hourly_points": 0, "daily_points": 0})
-        self.lock = asyncio.Lock()
-        self.hourly_reset_times = defaultdict(lambda: datetime.now() + timedelta(hours=1))
-        self.daily_reset_times = defaultdict(lambda: datetime.now() + timedelta(days=1))
+        self.hourly_window = hourly_window
+        self.daily_window = daily_window
+        self._hourly_interval = hourly_window / hourly_limit
+        self._daily_interval = daily_window / daily_limit
+        self.accounts = {}
+        self._timers = []  # heap of (ready_at, seq, account_id)
+        self._seq = itertools.count()
+        self._timer_handle = None
+        self._timer_at = None
+        self.timer_wakeups = 0
+
+    def _state(self, account_id, now):
+        state = self.accounts.get(account_id)
+        if state is None:
+            if len(self.accounts) % 1024 == 1023:
+                self._prune(now)
+            state = self.accounts[account_id] = _AccountState(now)
+        return state
+
+    def _prune(self, now):
+        """Forget accounts whose budget has fully refilled (identical to a fresh state)"""
+        idle = [
+            account_id for account_id, state in self.accounts.items()
+            if not state.waiters and state.timer_at is None and max(state.hourly_tat, state.daily_tat) <= now
+        ]
+        for account_id in idle:
+            del self.accounts[account_id]
 
-    async def _reset_points(self, account_id):
-        """Reset points for an account if time window has passed."""
-        now = datetime.now()
+    def _delay(self, state, points, now):
+        """Seconds until `points` fit in both windows (0 if they fit now)"""
+        hourly_ready = max(state.hourly_tat, now) + points * self._hourly_interval - self.hourly_window
+        daily_ready = max(state.daily_tat, now) + points * self._daily_interval - self.daily_window
+        return max(hourly_ready - now, daily_ready - now, 0.0)
 
-        # Reset hourly points
-        if now >= self.hourly_reset_times[account_id]:
-            self.account_limits[account_id]["hourly_points"] = 0
-            self.hourly_reset_times[account_id] = now + timedelta(hours=1)
+    def _grant(self, state, points, now):
+        state.hourly_tat = max(state.hourly_tat, now) + points * self._hourly_interval
+        state.daily_tat = max(state.daily_tat, now) + points * self._daily_interval
 
-        # Reset daily points
-        if now >= self.daily_reset_times[account_id]:
-            self.account_limits[account_id]["daily_points"] = 0
-            self.daily_reset_times[account_id] = now + timedelta(days=1)
+    def _check_points(self, action_points):
+        if action_points > self.hourly_limit or action_points > self.daily_limit:
+            raise ValueError(f"{action_points} points can never fit in the configured limits")
+
+    def try_acquire(self, account_id, action_points):
+        """Take points without waiting. Returns False if they are not available right now"""
+        self._check_points(action_points)
+        now = time.monotonic()
+        state = self._state(account_id, now)
+        # Never jump ahead of accounts' queued waiters (FIFO fairness)
+        if state.waiters or self._delay(state, action_points, now) > 0:
+            return False
+        self._grant(state, action_points, now)
+        return True
 
     async def acquire(self, account_id, action_points):
-        """Try to acquire points for an account based on the action."""
-        while True:
-            async with self.lock:
-                # Reset points if needed
-                await self._reset_points(account_id)
-
-                limits = self.account_limits[account_id]
-                if (
-                    limits["hourly_points"] + action_points <= self.hourly_limit
-                    and limits["daily_points"] + action_points <= self.daily_limit
-                ):
-                    # Grant points
-                    limits["hourly_points"] += action_points
-                    limits["daily_points"] += action_points
-                    return True
-
-            await asyncio.sleep(1)  # Wait if limit exceeded
+        """Wait until points are available for an account, then take them."""
+        if self.try_acquire(account_id, action_points):
+            RATE_LIMIT_WAIT.observe(0.0)
+            return True
+
+        state = self.accounts[account_id]
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, action_points)
+        state.waiters.append(entry)
+        self._dispatch(account_id)
+
+        started = time.monotonic()
+        try:
+            granted = await future
+            RATE_LIMIT_WAIT.observe(time.monotonic() - started)
+            return granted
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Points were granted as we were cancelled: give them back
+                self._refund(state, action_points)
+            else:
+                try:
+                    state.waiters.remove(entry)
+                except ValueError:
+                    pass
+            self._dispatch(account_id)
+            raise
+
+    def _refund(self, state, points):
+        state.hourly_tat -= points * self._hourly_interval
+        state.daily_tat -= points * self._daily_interval
+
+    def _dispatch(self, account_id):
+        """Grant queued waiters of one account in order; schedule a timer for the first that must wait"""
+        state = self.accounts[account_id]
+        now = time.monotonic()
+        while state.waiters:
+            future, points = state.waiters[0]
+            if future.done():
+                state.waiters.popleft()
+                continue
+            delay = self._delay(state, points, now)
+            if delay > 0:
+                self._schedule(account_id, state, now + delay)
+                return
+            state.waiters.popleft()
+            self._grant(state, points, now)
+            future.set_result(True)
+
+    def _schedule(self, account_id, state, ready_at):
+        if state.timer_at is not None and state.timer_at <= ready_at:
+            return
+        state.timer_at = ready_at
+        heapq.heappush(self._timers, (ready_at, next(self._seq), account_id))
+        self._arm()
+
+    def _arm(self):
+        if not self._timers:
+            return
+        ready_at = self._timers[0][0]
+        if self._timer_handle is not None:
+            if self._timer_at <= ready_at:
+                return
+            self._timer_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer_at = ready_at
+        self._timer_handle = loop.call_later(max(ready_at - time.monotonic(), 0), self._on_timer)
+
+    def _on_timer(self):
+        self._timer_handle = None
+        self._timer_at = None
+        self.timer_wakeups += 1
+        now = time.monotonic()
+        due = set()
+        while self._timers and self._timers[0][0] <= now:
+            ready_at, _, account_id = heapq.heappop(self._timers)
+            state = self.accounts.get(account_id)
+            if state is not None and state.timer_at == ready_at:
+                state.timer_at = None
+                due.add(account_id)
+        for account_id in due:
+            self._dispatch(account_id)
+        self._arm()
 
     def get_limits(self, account_id):
         """Get current limits for debugging or logging."""
-        return self.account_limits[account_id]
+        now = time.monotonic()
+        state = self._state(account_id, now)
+        return {
+            "hourly_points": round(max(state.hourly_tat - now, 0) / self._hourly_interval),
+            "daily_points": round(max(state.daily_tat - now, 0) / self._daily_interval),
+            "waiters": len(state.waiters),
+        }
 
 
 # Usage Example
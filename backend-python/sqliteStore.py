@@ -0,0 +1,55 @@
+"""
+SQLITE STORES
+===============
+- Base class for the SQLite files kept next to the job queue (timelines,
+  blobs, notification outbox, Bluesky sessions)
+- Each store owns one connection in WAL mode, opened and used only on its
+  own single-worker thread, so the event loop never blocks on disk I/O and
+  the connection is never shared across threads
+- Subclasses create their tables in _create_tables() and run statements
+  with _run() (awaited) or _submit() (queued, not awaited)
+"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+
+class SQLiteStore:
+    _executor: Optional[ThreadPoolExecutor] = None
+    _conn: Optional[sqlite3.Connection] = None
+
+    def _open(self, path: str, thread_name: str, synchronous: str = "NORMAL"):
+        """Start the store's thread and open `path` on it (blocks until the tables exist)"""
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+        self._executor.submit(self._connect, path, synchronous).result()
+
+    def _connect(self, path: str, synchronous: str):
+        conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._create_tables(conn)
+        self._conn = conn
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        raise NotImplementedError
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _submit(self, fn, *args) -> Future:
+        return self._executor.submit(fn, *args)
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
@@ -0,0 +1,106 @@
+"""
+SELF-THREAD RECONSTRUCTION
+============================
+- Built from the "Replies" timeline: the user's tweets and replies, newest
+  first, with conversations grouped oldest first inside a page
+- Tweets are indexed by the id they reply to as they arrive; a thread is
+  assembled by walking that index once from its root, so every tweet is
+  touched a constant number of times (no scan of the thread per reply)
+- A reply is always newer than the tweet it answers, so once a root has
+  been seen its whole thread has too and it can be posted right away
+- Replies to other people are not migrated, and neither are the user's
+  own follow-ups under them
+- Tweets that are not migrated themselves (retweets, quotes) come in as
+  markers with "skipped" set; their self-replies start threads of their own
+"""
+
+from typing import Any, Dict, List, Set
+
+# Value of "skipped" for a reply to someone else: its self-replies are dropped too
+SKIPPED_REPLY = "reply_to_other"
+
+
+def _chronological(tweet: Dict[str, Any]) -> int:
+    # Snowflake ids grow with time
+    return int(tweet["id"])
+
+
+class ThreadBuilder:
+    """
+    Feed a timeline with add(), one page at a time; take() returns the
+    threads completed by that page and flush() the rest once the timeline
+    ends. Threads come out newest first, tweets inside a thread oldest first
+    and always after the tweet they reply to.
+    """
+
+    def __init__(self):
+        self._replies: Dict[str, List[Dict[str, Any]]] = {}  # parent id -> replies waiting for it
+        self._roots: List[Dict[str, Any]] = []  # seen in the current page
+        self._cuts: List[Dict[str, Any]] = []  # skipped tweets of the current page
+        self._dropped: Set[str] = set()
+        self.threads = 0
+        self.tweets = 0
+        self.dropped = 0
+
+    def add(self, tweet: Dict[str, Any]):
+        parent = tweet.get("in_reply_to")
+        if parent is not None and str(parent) in self._dropped:
+            # Late follow-up under a reply to someone else
+            tweet = {"id": tweet["id"], "skipped": SKIPPED_REPLY}
+        if tweet.get("skipped"):
+            self._cuts.append(tweet)
+        elif parent is None:
+            self._roots.append(tweet)
+        else:
+            self._replies.setdefault(str(parent), []).append(tweet)
+
+    def take(self) -> List[List[Dict[str, Any]]]:
+        """Threads whose root came in since the last call"""
+        heads = self._roots
+        for cut in self._cuts:
+            if cut["skipped"] == SKIPPED_REPLY:
+                self._drop(str(cut["id"]))
+            else:
+                # Not migrated itself: each of its self-replies heads a thread
+                heads.extend(self._replies.pop(str(cut["id"]), ()))
+        # Conversations inside a page are oldest first
+        heads.sort(key=_chronological, reverse=True)
+        threads = [self._assemble(head) for head in heads]
+        self._roots = []
+        self._cuts.clear()
+        return threads
+
+    def flush(self) -> List[List[Dict[str, Any]]]:
+        """Everything still waiting: replies whose parent was never seen (older than the fetched window, or deleted)"""
+        threads = self.take()
+        waiting = {str(tweet["id"]) for replies in self._replies.values() for tweet in replies}
+        heads = [tweet for parent, replies in self._replies.items() if parent not in waiting for tweet in replies]
+        heads.sort(key=_chronological, reverse=True)
+        threads.extend(self._assemble(head) for head in heads)
+        self._replies.clear()
+        return threads
+
+    def _assemble(self, root: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Iterative pre-order walk: arbitrarily deep threads, each branch kept together
+        thread = []
+        stack = [root]
+        while stack:
+            tweet = stack.pop()
+            thread.append(tweet)
+            replies = self._replies.pop(str(tweet["id"]), None)
+            if replies:
+                # Oldest reply on top of the stack
+                replies.sort(key=_chronological, reverse=True)
+                stack.extend(replies)
+        self.threads += 1
+        self.tweets += len(thread)
+        return thread
+
+    def _drop(self, tweet_id: str):
+        stack = [tweet_id]
+        while stack:
+            tweet_id = stack.pop()
+            self._dropped.add(tweet_id)
+            for reply in self._replies.pop(tweet_id, ()):
+                self.dropped += 1
+                stack.append(str(reply["id"]))
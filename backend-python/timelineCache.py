@@ -0,0 +1,222 @@
+"""
+ON-DISK TIMELINE CACHE
+========================
+- Formatted timeline tweets stored in SQLite, keyed by Twitter user id
+- A re-run only pages from the top until it reaches the newest cached tweet,
+  then serves the rest from disk; deeper history continues from the stored
+  bottom cursor instead of page one
+- Age (TIMELINE_CACHE_TTL_HOURS) and size (TIMELINE_CACHE_MAX_TWEETS, least
+  recently used timelines first) based eviction
+- One instance is shared by every queue processor. Every reset of a
+  timeline starts a new generation, and writes made for an older one are
+  dropped, so a job whose timeline was reset by another job for the same
+  account can't leave gaps in it
+- Holds the "Replies" timeline, markers for tweets that are not migrated
+  included, so a cached re-run rebuilds the same threads; caches written
+  before that (format version 1) are emptied on open
+"""
+
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqliteStore import SQLiteStore
+
+TIMELINE_CACHE_PATH = os.getenv("TIMELINE_CACHE_PATH", "timelines.db")
+TIMELINE_CACHE_TTL = float(os.getenv("TIMELINE_CACHE_TTL_HOURS", "168")) * 3600
+TIMELINE_CACHE_MAX_TWEETS = int(os.getenv("TIMELINE_CACHE_MAX_TWEETS", "500000"))
+TIMELINE_CACHE_VERSION = 2
+
+_UNSET = object()
+
+
+def _encode(tweet: Dict[str, Any]) -> str:
+    data = dict(tweet)
+    if tweet.get("created_at_datetime"):
+        data["created_at_datetime"] = tweet["created_at_datetime"].isoformat()
+    return json.dumps(data)
+
+
+def _decode(payload: str) -> Dict[str, Any]:
+    data = json.loads(payload)
+    if data.get("created_at_datetime"):
+        data["created_at_datetime"] = datetime.fromisoformat(data["created_at_datetime"])
+    return data
+
+
+class TimelineCache(SQLiteStore):
+    """
+    One row per cached timeline (paging state, generation, LRU stamp) plus its
+    tweets keyed by (user id, tweet id); lookups go by lower-cased screen name
+    """
+
+    def __init__(self, path: str = TIMELINE_CACHE_PATH, ttl: float = TIMELINE_CACHE_TTL, max_tweets: int = TIMELINE_CACHE_MAX_TWEETS):
+        self.path = path
+        self.ttl = ttl
+        self.max_tweets = max_tweets
+        self.hits = 0
+        self.misses = 0
+        self._open(path, "timeline-cache")
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS timelines (
+                user_id TEXT PRIMARY KEY,
+                screen_name TEXT NOT NULL,
+                newest_id INTEGER,
+                bottom_cursor TEXT,
+                complete INTEGER NOT NULL DEFAULT 0,
+                generation INTEGER NOT NULL DEFAULT 0,
+                tweet_count INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        if "generation" not in [column[1] for column in conn.execute("PRAGMA table_info(timelines)")]:
+            conn.execute("ALTER TABLE timelines ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS timelines_screen_name ON timelines (screen_name)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tweets (
+                user_id TEXT NOT NULL,
+                tweet_id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (user_id, tweet_id)
+            ) WITHOUT ROWID
+            """
+        )
+        if conn.execute("PRAGMA user_version").fetchone()[0] < TIMELINE_CACHE_VERSION:
+            # Older caches hold the "Tweets" timeline, which has no self-replies
+            conn.execute("DELETE FROM tweets")
+            conn.execute("DELETE FROM timelines")
+            conn.execute(f"PRAGMA user_version = {TIMELINE_CACHE_VERSION}")
+
+    def _delete_timeline(self, user_id: str):
+        self._conn.execute("DELETE FROM tweets WHERE user_id = ?", (user_id,))
+        self._conn.execute("DELETE FROM timelines WHERE user_id = ?", (user_id,))
+
+    def _get_timeline(self, screen_name: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT user_id, newest_id, bottom_cursor, complete, generation, fetched_at FROM timelines WHERE screen_name = ?",
+            (screen_name.lower(),),
+        ).fetchone()
+        if row is None:
+            return None
+        user_id, newest_id, bottom_cursor, complete, generation, fetched_at = row
+        if time.time() - fetched_at > self.ttl:
+            # Too old to trust (deletions, edits): start over
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._delete_timeline(user_id)
+            self._conn.execute("COMMIT")
+            return None
+        self._conn.execute("UPDATE timelines SET last_used = ? WHERE user_id = ?", (time.time(), user_id))
+        return {"user_id": user_id, "newest_id": newest_id, "bottom_cursor": bottom_cursor, "complete": bool(complete), "generation": generation}
+
+    async def get_timeline(self, screen_name: str) -> Optional[Dict[str, Any]]:
+        """Cached state for a screen name ({user_id, newest_id, bottom_cursor, complete, generation}) or None"""
+        timeline = await self._run(self._get_timeline, screen_name)
+        if timeline is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return timeline
+
+    def _reset_timeline(self, user_id: str, screen_name: str) -> int:
+        now = time.time()
+        # Unique per reset, even if the timeline was evicted in between
+        generation = time.time_ns()
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._delete_timeline(user_id)
+        # A screen name that moved to another account must not resolve to the old one
+        self._conn.execute("DELETE FROM timelines WHERE screen_name = ?", (screen_name.lower(),))
+        self._conn.execute(
+            "INSERT INTO timelines (user_id, screen_name, generation, fetched_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (user_id, screen_name.lower(), generation, now, now),
+        )
+        self._conn.execute("COMMIT")
+        return generation
+
+    async def reset_timeline(self, user_id: str, screen_name: str) -> Dict[str, Any]:
+        """Start an empty cache entry for a user (drops anything cached for it)"""
+        generation = await self._run(self._reset_timeline, str(user_id), screen_name)
+        return {"user_id": str(user_id), "newest_id": None, "bottom_cursor": None, "complete": False, "generation": generation}
+
+    def _add_tweets(self, user_id: str, generation: int, tweets: List[Dict[str, Any]], bottom_cursor, complete):
+        self._conn.execute("BEGIN IMMEDIATE")
+        if self._conn.execute("SELECT 1 FROM timelines WHERE user_id = ? AND generation = ?", (user_id, generation)).fetchone() is None:
+            # Evicted or reset by another job while being fetched
+            self._conn.execute("COMMIT")
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO tweets (user_id, tweet_id, data) VALUES (?, ?, ?)",
+            [(user_id, int(tweet["id"]), _encode(tweet)) for tweet in tweets],
+        )
+        newest = max((int(tweet["id"]) for tweet in tweets), default=None)
+        self._conn.execute(
+            """
+            UPDATE timelines SET
+                newest_id = MAX(COALESCE(newest_id, 0), COALESCE(?, 0)),
+                tweet_count = (SELECT COUNT(*) FROM tweets WHERE user_id = ?),
+                last_used = ?
+            WHERE user_id = ?
+            """,
+            (newest, user_id, time.time(), user_id),
+        )
+        if bottom_cursor is not _UNSET:
+            self._conn.execute("UPDATE timelines SET bottom_cursor = ? WHERE user_id = ?", (bottom_cursor, user_id))
+        if complete is not None:
+            self._conn.execute("UPDATE timelines SET complete = ? WHERE user_id = ?", (int(complete), user_id))
+        self._conn.execute("COMMIT")
+
+    async def add_tweets(self, timeline: Dict[str, Any], tweets: List[Dict[str, Any]], bottom_cursor=_UNSET, complete: Optional[bool] = None):
+        """Store formatted tweets in `timeline` (as returned by get/reset_timeline); optionally move the bottom cursor / mark it complete"""
+        await self._run(self._add_tweets, timeline["user_id"], timeline["generation"], tweets, bottom_cursor, complete)
+
+    def _get_tweets(self, user_id: str, before_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT data FROM tweets WHERE user_id = ? AND tweet_id < ? ORDER BY tweet_id DESC LIMIT ?",
+            (user_id, before_id if before_id is not None else 2**63 - 1, limit),
+        ).fetchall()
+        return [_decode(row[0]) for row in rows]
+
+    async def get_tweets(self, user_id: str, before_id: Optional[int] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        """Cached tweets older than before_id, newest first"""
+        return await self._run(self._get_tweets, str(user_id), before_id, limit)
+
+    def _evict(self) -> int:
+        removed = 0
+        self._conn.execute("BEGIN IMMEDIATE")
+        expired = self._conn.execute(
+            "SELECT user_id FROM timelines WHERE fetched_at < ?", (time.time() - self.ttl,)
+        ).fetchall()
+        for (user_id,) in expired:
+            self._delete_timeline(user_id)
+            removed += 1
+
+        total = self._conn.execute("SELECT COALESCE(SUM(tweet_count), 0) FROM timelines").fetchone()[0]
+        if total > self.max_tweets:
+            for user_id, count in self._conn.execute(
+                "SELECT user_id, tweet_count FROM timelines ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_tweets:
+                    break
+                self._delete_timeline(user_id)
+                total -= count
+                removed += 1
+        self._conn.execute("COMMIT")
+        return removed
+
+    async def evict(self) -> int:
+        """Drop expired timelines, then least recently used ones until under max_tweets"""
+        removed = await self._run(self._evict)
+        if removed:
+            print(f"Evicted {removed} cached timelines")
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,51 @@
+"""
+IN-MEMORY THREAD CACHE
+========================
+- Formatted threads by the id of every tweet in them, filled by the
+  timeline fetch and by thread-URL extraction and shared by every queue
+  processor
+- A thread URL pointing anywhere into a thread fetched earlier (the same
+  migration's timeline, or a migration that ran a moment ago) is served
+  without a Twitter call
+- Bounded LRU on tweet ids (TWEET_CACHE_MAX_TWEETS); a thread is stored
+  once however many of its ids are indexed
+"""
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+TWEET_CACHE_MAX_TWEETS = int(os.getenv("TWEET_CACHE_MAX_TWEETS", "50000"))
+
+
+class TweetCache:
+    def __init__(self, max_tweets: int = TWEET_CACHE_MAX_TWEETS):
+        self.max_tweets = max_tweets
+        self._threads: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, tweet_id) -> bool:
+        return str(tweet_id) in self._threads
+
+    def get_thread(self, tweet_id) -> Optional[List[Dict[str, Any]]]:
+        """The cached thread that contains `tweet_id`, if any"""
+        key = str(tweet_id)
+        thread = self._threads.get(key)
+        if thread is None:
+            self.misses += 1
+            return None
+        self._threads.move_to_end(key)
+        self.hits += 1
+        return thread
+
+    def put_thread(self, thread: List[Dict[str, Any]]):
+        for tweet in thread:
+            key = str(tweet["id"])
+            self._threads[key] = thread
+            self._threads.move_to_end(key)
+        while len(self._threads) > self.max_tweets:
+            self._threads.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"tweets": len(self._threads), "hits": self.hits, "misses": self.misses}
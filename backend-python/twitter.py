@@ -1,149 +1,119 @@
 """
-ULTRA-CONSERVATIVE RATE LIMITING MODE
-========================================
-This implementation is designed to NEVER hit rate limits to protect against account bans.
-- Uses only 60% of allocated Twikit rate limits
-- Single concurrent request at a time
-- Minimum 5-minute gaps between migrations
-- 80% safety threshold triggers early cooldown
-- 60-second safety buffer when approaching limits
-- Dynamic delay calculation based on safe request rates
-
-DO NOT MODIFY THESE SETTINGS UNLESS YOU UNDERSTAND THE BAN RISK.
+TWITTER FETCHING
+==================
+- Requests go through a pool of Twitter sessions (see twitterSessions.py);
+  each fetch is pinned to one session and moves to another one if its
+  session gets quarantined
+- Calls are paced per session and endpoint from the x-rate-limit-* headers
+  Twitter returns (see twitterPacer.py), spreading the real remaining
+  budget evenly until the real reset time
+- Single concurrent request at a time per account
+- A 429 waits for the reported reset and retries once (or fails over when
+  quarantine mode is on)
+- Timelines are read from the "Replies" tab so self-threads can be
+  rebuilt from in_reply_to ids (see threadBuilder.py)
+- Thread URLs are deduplicated and served from the thread cache shared
+  with the timeline fetch (see tweetCache.py); a tweet is fetched and
+  posted at most once per migration
 """
 
 import re
 import time
-import asyncio
 import gc
-from twikit import Client, TooManyRequests
+from twikit import TooManyRequests
 from atproto import client_utils
-
-# Global client instance (shared across all requests)
-client = Client(language="en-US")
-client.load_cookies("cookies.json")
-
-# Per-migration semaphore to avoid concurrency issues
-migration_semaphore = asyncio.Semaphore(1)  # SINGLE REQUEST AT A TIME - MAXIMUM SAFETY
-
-# ULTRA-CONSERVATIVE rate limits (70% of actual Twikit limits for safety)
-ENDPOINT_RATE_LIMITS = {
-    'get_tweet_by_id': 140, 
-    'get_user_by_screen_name': 90, 
-    'get_user_tweets': 45, 
-    'get_user_tweets_replies': 45, 
-    'default': 45  
-}
-
-# Endpoint-specific counters
-endpoint_counters = {endpoint: 0 for endpoint in ENDPOINT_RATE_LIMITS}
-endpoint_start_times = {endpoint: time.time() for endpoint in ENDPOINT_RATE_LIMITS}
-
-# Global counter (as fallback)
-api_calls = 0
-start_time = time.time()
-
-RESET_TIME = 15 * 60  # 15 minutes in seconds (900s)
-MAX_RECURSION_DEPTH = 100
+from twitterPacer import FUNCTION_ENDPOINTS
+from twitterSessions import TwitterSessionPool, SessionQuarantined
+from timelineCache import TimelineCache
+from threadBuilder import ThreadBuilder, SKIPPED_REPLY
+from tweetCache import TweetCache
+from mediaVariants import select_variant
+from metrics import TWITTER_CALLS, TWITTER_LATENCY, TWITTER_PACING_WAIT
+
+# Shared by every queue processor; loads the cookie files at import time
+sessions = TwitterSessionPool()
+timeline_cache = TimelineCache()
+tweet_cache = TweetCache()
 
 async def cleanup_memory():
     """Force garbage collection to prevent memory leaks"""
     gc.collect()
     print("Memory cleanup performed")
 
-def calculate_safe_request_rate(limit, window_seconds=900):
+def _reset_time_from(error):
+    reset = getattr(error, "rate_limit_reset", None)
+    if reset:
+        return float(reset)
+    headers = getattr(error, "headers", None) or {}
+    reset = headers.get("x-rate-limit-reset")
+    return float(reset) if reset else None
+
+async def rate_limited_api_call(api_function, *args, endpoint: str = None, session=None, **kwargs):
     """
-    Calculate ultra-conservative request rate to ensure we NEVER hit rate limits.
-    Uses 60% of the limit as maximum to add huge safety buffer.
+    Call a twikit function once the session's pacer grants a slot for its
+    endpoint. `endpoint` is the GraphQL operation (e.g. "UserTweets"); pass
+    it when it can't be inferred from the function name. `api_function`
+    must belong to `session`'s client. Raises SessionQuarantined when the
+    session gets parked by this call.
     """
-    safe_limit = int(limit * 0.6)  # Only use 60% of the allocated limit
-    requests_per_second = safe_limit / window_seconds
-    minimum_delay = 1.0 / requests_per_second if requests_per_second > 0 else 2.0
-    return max(minimum_delay, 0.5)  # Minimum 0.5 second delay (improved from 1.0)
-
-async def rate_limited_api_call(api_function, *args, **kwargs):
-    global api_calls, start_time
-
-    # Determine which endpoint we're calling based on function name
-    endpoint = api_function.__name__
-    limit = ENDPOINT_RATE_LIMITS.get(endpoint, ENDPOINT_RATE_LIMITS['default'])
-
-    # Get current counters and timing
-    current_count = endpoint_counters.get(endpoint, 0)
-    current_start = endpoint_start_times.get(endpoint, time.time())
-
-    # Check if we need to reset the counter (15-minute window)
-    now = time.time()
-    elapsed_time = now - current_start
-
-    if elapsed_time >= RESET_TIME:
-        print(f"Resetting {endpoint} counter after {elapsed_time:.2f} seconds")
-        endpoint_counters[endpoint] = 0
-        endpoint_start_times[endpoint] = now
-        current_count = 0
-        current_start = now
-        elapsed_time = 0
-
-    # ULTRA-CONSERVATIVE: Only apply delays when approaching limits
-    # Start slowing down when we're at 70% of the limit (less aggressive than 80%)
-    safety_threshold = int(limit * 0.7)  # 70% threshold for safety
-
-    if current_count >= safety_threshold:
-        # Calculate remaining time in the window with safety buffer
-        remaining_time = RESET_TIME - elapsed_time
-        # Add 30 second safety buffer (reduced from 60 for better performance)
-        sleep_time = max(remaining_time + 30, 30)  # Minimum 30 seconds
-        print(f"SAFETY THRESHOLD: {endpoint} at {current_count}/{limit} ({current_count/limit*100:.1f}%). Sleeping for {sleep_time:.2f} seconds.")
-        await asyncio.sleep(sleep_time)
-
-        # Reset after waiting
-        endpoint_counters[endpoint] = 0
-        endpoint_start_times[endpoint] = time.time()
-        current_count = 0
-    else:
-        # Only apply minimal delay when well below limits
-        # Calculate adaptive delay based on current usage
-        usage_ratio = current_count / limit
-        if usage_ratio < 0.3:  # Well below limit
-            safe_delay = 0.1  # Very short delay
-        elif usage_ratio < 0.5:  # Moderate usage
-            safe_delay = 0.5  # Short delay
-        else:  # Approaching limit
-            safe_delay = calculate_safe_request_rate(limit)
-
-        if safe_delay > 0:
-            await asyncio.sleep(safe_delay)
-            print(f"ADAPTIVE DELAY: {safe_delay:.2f}s for {endpoint} (usage: {current_count}/{limit})")
-
-    # Make the API call
-    try:
-        endpoint_counters[endpoint] = current_count + 1
-        print(f"{endpoint} API call {endpoint_counters[endpoint]}/{limit}, elapsed: {elapsed_time:.2f}s")
-
-        return await api_function(*args, **kwargs)
-
-    except TooManyRequests as e:
-        print(f"Rate limit hit for {endpoint}! Waiting for rate limit reset.")
-        # Reset counter and wait for the full window
-        endpoint_counters[endpoint] = 0
-        endpoint_start_times[endpoint] = time.time()
-        sleep_time = RESET_TIME + 10  # Wait full window + buffer
-        await asyncio.sleep(sleep_time)
-        # Try once more
-        return await api_function(*args, **kwargs)
+    if session is None:
+        session = await sessions.acquire()
+        try:
+            return await rate_limited_api_call(
+                getattr(session.client, api_function.__name__), *args, endpoint=endpoint, session=session, **kwargs
+            )
+        finally:
+            sessions.release(session)
+
+    endpoint = endpoint or FUNCTION_ENDPOINTS.get(api_function.__name__, api_function.__name__)
+    pacer = session.pacer
+
+    for attempt in range(2):
+        with TWITTER_PACING_WAIT.labels(endpoint).time():
+            await pacer.wait(endpoint)
+        try:
+            async with session.lock:
+                session.metrics["calls"] += 1
+                started = time.perf_counter()
+                result = await api_function(*args, **kwargs)
+                TWITTER_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+                TWITTER_CALLS.labels(endpoint, "ok").inc()
+                return result
 
-    except Exception as e:
-        # Check if it's a HTTP 429 error
-        if hasattr(e, 'status_code') and e.status_code == 429:
-            print(f"HTTP 429 error for {endpoint}! Waiting for rate limit reset.")
-            endpoint_counters[endpoint] = 0
-            endpoint_start_times[endpoint] = time.time()
-            sleep_time = RESET_TIME + 10  # Wait full window + buffer
-            await asyncio.sleep(sleep_time)
-            # Try once more
-            return await api_function(*args, **kwargs)
-        # If it's another error, re-raise it
-        raise
+        except Exception as e:
+            rate_limited = isinstance(e, TooManyRequests) or getattr(e, "status_code", None) == 429
+            TWITTER_CALLS.labels(endpoint, "rate_limited" if rate_limited else "error").inc()
+            reset_at = _reset_time_from(e) if rate_limited else None
+            if rate_limited:
+                # The pacer now holds the next slot until the reported reset
+                pacer.get(endpoint).exhausted(reset_at)
+            if sessions.record_error(session, e, rate_limited, reset_at):
+                raise SessionQuarantined(session, "rate_limited" if rate_limited else "auth") from e
+            if not rate_limited or attempt:
+                raise
+            print(f"Rate limit hit for {endpoint} on {session.name}! Waiting for the reported reset before retrying.")
+
+        finally:
+            pacer.release(endpoint)
+
+async def call_with_failover(session, method_name: str, *args, **kwargs):
+    """
+    Call a Client method on the pinned session. If that session gets
+    quarantined, the pin moves to another healthy session and the call is
+    retried there. Returns (session, result) since the pin may have changed.
+    """
+    failovers = 0
+    while True:
+        try:
+            return session, await rate_limited_api_call(getattr(session.client, method_name), *args, session=session, **kwargs)
+        except SessionQuarantined as e:
+            failovers += 1
+            if failovers > len(sessions.sessions) + 1:
+                raise
+            print(f"{e}; moving the fetch to another session")
+            new_session = await sessions.acquire()
+            sessions.release(session)
+            session = new_session
 
 async def getMediaUrls(tweet):
     try:
@@ -168,7 +138,8 @@ async def getMediaUrls(tweet):
                     for media in tweet.media:
                         try:
                             if isinstance(media, dict) and "media_url_https" in media:
-                                media_urls.append(media["media_url_https"])
+                                # Right-sized variant rather than the full original
+                                media_urls.append(select_variant(media))
                             elif hasattr(media, 'media_url_https'):
                                 media_urls.append(media.media_url_https)
                         except Exception as e:
@@ -245,272 +216,397 @@ async def format_tweet_text(tweet):
 
     return text, facets
 
-async def get_user_tweets(twitterName: str, limit: int = 800):
-    async with migration_semaphore:
-        print(f"Fetching tweets for {twitterName} with limit {limit}...")
-        all_tweets = {}
-        processed_ids = set()  # Global processed IDs to prevent duplicates
+def timeline_tweets(page, user_id):
+    """The user's own tweets on a timeline page, including those inside conversation modules"""
+    user_id = str(user_id)
+    for entry in page:
+        for tweet in [entry, *(getattr(entry, "replies", None) or [])]:
+            author = getattr(getattr(tweet, "user", None), "id", None)
+            if author is None or str(author) == user_id:
+                yield tweet
+
+def replies_to_other(tweet, user_id) -> bool:
+    if not getattr(tweet, "in_reply_to", None):
+        return False
+    legacy = (getattr(tweet, "_data", None) or {}).get("legacy", {})
+    return str(legacy.get("in_reply_to_user_id_str", user_id)) != str(user_id)
+
+async def format_timeline_tweet(tweet, processed_ids, user_id=None):
+    """
+    Turn a timeline tweet into the dict migrateTweetsToBluesky consumes.
+    Tweets that are not migrated come back as {"id", "skipped"} markers for
+    the thread builder; None for duplicates and tweets without an id.
+    """
+    try:
+        # Add defensive checks for tweet attributes
+        is_quote_status = False
+        is_retweet = False
+        tweet_id = None
+        tweet_text_raw = ""
+        created_at = None
 
         try:
-            user = await rate_limited_api_call(client.get_user_by_screen_name, twitterName)
-            tweets = await rate_limited_api_call(user.get_tweets, "Tweets")
+            is_quote_status = hasattr(tweet, 'is_quote_status') and tweet.is_quote_status
+        except Exception as e:
+            print(f"Error checking is_quote_status: {e}")
 
-            # Collect tweets with pagination
-            while tweets and (not limit or len(all_tweets) < limit):
-                for tweet in tweets:
-                    try:
-                        # Add defensive checks for tweet attributes
-                        is_quote_status = False
-                        is_retweet = False
-                        tweet_id = None
-                        tweet_text_raw = ""
-                        created_at = None
-                        
-                        try:
-                            is_quote_status = hasattr(tweet, 'is_quote_status') and tweet.is_quote_status
-                        except Exception as e:
-                            print(f"Error checking is_quote_status: {e}")
-                            
-                        try:
-                            tweet_text_raw = tweet.text if hasattr(tweet, 'text') and tweet.text else ""
-                            is_retweet = tweet_text_raw.startswith("RT @")
-                        except Exception as e:
-                            print(f"Error accessing tweet text: {e}")
-                            
-                        try:
-                            tweet_id = tweet.id if hasattr(tweet, 'id') else None
-                        except Exception as e:
-                            print(f"Error accessing tweet.id: {e}")
-                            continue  # Skip tweet if we can't get ID
-                            
-                        if not tweet_id:
-                            print("Skipping tweet without valid ID")
-                            continue
-                            
-                        if is_quote_status or is_retweet:
-                            continue
-                            
-                        if tweet_id not in processed_ids:
-                            tweet_text, tweet_facets = await format_tweet_text(tweet)
-                            if len(tweet_text) > 297:
-                                tweet_text = tweet_text[:297] + "..."
-
-                            try:
-                                created_at = tweet.created_at_datetime if hasattr(tweet, 'created_at_datetime') else None
-                            except Exception as e:
-                                print(f"Error accessing created_at_datetime: {e}")
-                                created_at = None
-                                
-                            if not created_at:
-                                print(f"Skipping tweet {tweet_id} without valid timestamp")
-                                continue
-
-                            all_tweets[tweet_id] = {
-                                "id": tweet_id,
-                                "created_at_datetime": created_at,
-                                "text": tweet_text,
-                                "facets": tweet_facets,
-                                "media_urls": await getMediaUrls(tweet),
-                                "replies": [],  # Initialize as empty for now
-                            }
-                            processed_ids.add(tweet_id)
-                    except Exception as e:
-                        print(f"Error processing tweet: {e}")
-                        continue
+        try:
+            tweet_text_raw = tweet.text if hasattr(tweet, 'text') and tweet.text else ""
+            is_retweet = tweet_text_raw.startswith("RT @")
+        except Exception as e:
+            print(f"Error accessing tweet text: {e}")
 
-                tweets = await tweets.next()
-
-            # Build threads from collected tweets
-            threads = []
-            sorted_tweets = sorted(all_tweets.values(), key=lambda t: t["created_at_datetime"], reverse=True)
-
-            # Separate root tweets from replies
-            root_tweets = []
-            reply_tweets = set()
-
-            # First pass: identify which tweets are replies
-            for tweet_data in sorted_tweets:
-                if tweet_data.get("replies"):
-                    for reply in tweet_data["replies"]:
-                        if reply and hasattr(reply, 'id'):
-                            reply_tweets.add(reply.id)
-
-            # Second pass: build threads only from root tweets
-            for tweet_data in sorted_tweets:
-                if tweet_data["id"] not in processed_ids and tweet_data["id"] not in reply_tweets:
-                    thread = [tweet_data]
-                    processed_ids.add(tweet_data["id"])  # Mark root tweet as processed
-                    await process_replies(tweet_data, thread, processed_ids, 0)
-                    threads.append(thread)
-                    if limit and len(threads) >= limit:
-                        break
+        try:
+            tweet_id = tweet.id if hasattr(tweet, 'id') else None
+        except Exception as e:
+            print(f"Error accessing tweet.id: {e}")
+            return None  # Skip tweet if we can't get ID
 
-            print(f"Collected {len(all_tweets)} tweets into {len(threads)} threads")
+        if not tweet_id:
+            print("Skipping tweet without valid ID")
+            return None
 
-            # Clean up memory after processing large tweet collections
-            if len(all_tweets) > 100:
-                await cleanup_memory()
+        if tweet_id in processed_ids:
+            return None
 
-            return threads
+        if user_id is not None and replies_to_other(tweet, user_id):
+            processed_ids.add(tweet_id)
+            return {"id": tweet_id, "skipped": SKIPPED_REPLY}
 
-        except TooManyRequests:
-            print("Rate limit hit! Stopping tweet collection.")
-            raise
+        if is_quote_status or is_retweet:
+            processed_ids.add(tweet_id)
+            return {"id": tweet_id, "skipped": "repost"}
+
+        tweet_text, tweet_facets = await format_tweet_text(tweet)
+        if len(tweet_text) > 297:
+            tweet_text = tweet_text[:297] + "..."
+
+        try:
+            created_at = tweet.created_at_datetime if hasattr(tweet, 'created_at_datetime') else None
         except Exception as e:
-            print(f"An error occurred while fetching tweets: {e}")
-            raise
+            print(f"Error accessing created_at_datetime: {e}")
+            created_at = None
+
+        if not created_at:
+            print(f"Skipping tweet {tweet_id} without valid timestamp")
+            processed_ids.add(tweet_id)
+            return {"id": tweet_id, "skipped": "invalid"}
+
+        processed_ids.add(tweet_id)
+        return {
+            "id": tweet_id,
+            "created_at_datetime": created_at,
+            "text": tweet_text,
+            "facets": tweet_facets,
+            "media_urls": await getMediaUrls(tweet),
+            "in_reply_to": getattr(tweet, "in_reply_to", None),
+        }
+    except Exception as e:
+        print(f"Error processing tweet: {e}")
+        return None
 
-async def process_replies(tweet_data, thread, processed_ids, depth=0, thread_root_id=None):
-    """Process replies with depth tracking to prevent infinite recursion"""
-    if depth >= MAX_RECURSION_DEPTH:
-        print(f"Maximum recursion depth ({MAX_RECURSION_DEPTH}) reached. Stopping reply processing.")
-        return
+async def iter_user_threads(twitterName: str, limit: int = 800, migrating=None):
+    """
+    Yield threads (newest first) as timeline pages arrive, so posting can start
+    before the whole timeline is fetched. A self-thread is yielded as soon as
+    its root tweet has been fetched; `limit` counts tweets, and a thread is
+    never cut. The session's lock is only held for the duration of each API
+    call, not while the consumer applies backpressure.
+
+    Fetched tweets go to the timeline cache: a re-run only pages down to the
+    newest cached tweet, serves the cached ones, and continues deeper from the
+    stored bottom cursor if the limit asks for more. Built threads also go to
+    the thread cache, and the ids of yielded tweets to `migrating`.
+    """
+    print(f"Fetching tweets for {twitterName} with limit {limit}...")
+    processed_ids = set()  # Global processed IDs to prevent duplicates
+    builder = ThreadBuilder()
+    tweets_seen = 0
+    tweets_yielded = 0
+    threads_yielded = 0
+    pages_fetched = 0
+    cached_served = 0
+
+    def limit_reached():
+        return bool(limit) and tweets_yielded >= limit
+
+    def completed(threads):
+        for thread in threads:
+            tweet_cache.put_thread(thread)
+        return threads
+
+    def yielded(thread):
+        nonlocal tweets_yielded, threads_yielded
+        tweets_yielded += len(thread)
+        threads_yielded += 1
+        if migrating is not None:
+            migrating.update(str(tweet["id"]) for tweet in thread)
+
+    session = await sessions.acquire()
+
+    async def fetch_page(user_id, cursor):
+        nonlocal session, pages_fetched
+        # Pages are requested by cursor so a fetch can continue on another session
+        session, page = await call_with_failover(
+            session, "get_user_tweets", user_id, "Replies", 40, cursor, endpoint="UserTweetsAndReplies"
+        )
+        pages_fetched += 1
+        # Clean up memory periodically on large timelines
+        if pages_fetched % 25 == 0:
+            await cleanup_memory()
+        return page
 
-    replies = tweet_data.get("replies", [])
-    current_tweet_id = tweet_data.get("id")
+    try:
+        timeline = await timeline_cache.get_timeline(twitterName)
+        if timeline is None:
+            session, user = await call_with_failover(session, "get_user_by_screen_name", twitterName)
+            timeline = await timeline_cache.reset_timeline(user.id, twitterName)
+            await timeline_cache.evict()
+        user_id = timeline["user_id"]
+
+        # 1. Tweets newer than the cache, from the top of the timeline
+        if timeline["newest_id"]:
+            cursor = None
+            overlap = 0
+            new_tweets = []
+            while not limit_reached():
+                page = await fetch_page(user_id, cursor)
+                page_tweets = []
+                for entry in page:
+                    conversation = list(timeline_tweets([entry], user_id))
+                    # A new reply comes with its (possibly cached) conversation, so only whole entries count
+                    if conversation and max(int(tweet.id) for tweet in conversation) <= timeline["newest_id"]:
+                        overlap += 1
+                        continue
+                    for tweet in conversation:
+                        if int(tweet.id) <= timeline["newest_id"]:
+                            continue
+                        tweet_data = await format_timeline_tweet(tweet, processed_ids, user_id)
+                        if tweet_data:
+                            page_tweets.append(tweet_data)
+                            builder.add(tweet_data)
+                await timeline_cache.add_tweets(timeline, page_tweets)
+                new_tweets.extend(page_tweets)
+                tweets_seen += len(page_tweets)
+
+                for thread in completed(builder.take()):
+                    yield thread
+                    yielded(thread)
+                    if limit_reached():
+                        break
 
-    # Set thread root if not provided
-    if thread_root_id is None and thread:
-        thread_root_id = thread[0]["id"]
+                # A pinned tweet can be older than the cache, so one overlap is not enough
+                if overlap >= 2 or not page or not page.next_cursor:
+                    break
+                cursor = page.next_cursor
+
+            if overlap < 2 and page and page.next_cursor:
+                # Stopped before reaching the cached tweets: the cache would have a gap, keep only the new part
+                timeline = await timeline_cache.reset_timeline(user_id, twitterName)
+                await timeline_cache.add_tweets(timeline, new_tweets, bottom_cursor=page.next_cursor)
+                timeline["bottom_cursor"] = page.next_cursor
+                timeline["newest_id"] = None
+
+            # 2. Everything already cached
+            before_id = None
+            while timeline["newest_id"] and not limit_reached():
+                cached = await timeline_cache.get_tweets(user_id, before_id)
+                if not cached:
+                    break
+                before_id = int(cached[-1]["id"])
+                for tweet_data in cached:
+                    if tweet_data["id"] in processed_ids:
+                        continue
+                    processed_ids.add(tweet_data["id"])
+                    builder.add(tweet_data)
+                    if not tweet_data.get("skipped"):
+                        cached_served += 1
+
+                for thread in completed(builder.take()):
+                    yield thread
+                    yielded(thread)
+                    if limit_reached():
+                        break
 
-    for reply in replies:
-        if not reply or reply.id in processed_ids:
-            continue
+        # 3. Older history, continuing from where the last fetch stopped
+        cursor = timeline["bottom_cursor"]
+        if timeline["newest_id"] and not cursor:
+            # Cached from the top down but without a cursor to continue from
+            timeline["complete"] = True
+        while not timeline["complete"] and not limit_reached():
+            page = await fetch_page(user_id, cursor)
+            page_tweets = []
+            for tweet in timeline_tweets(page, user_id):
+                tweet_data = await format_timeline_tweet(tweet, processed_ids, user_id)
+                if tweet_data:
+                    page_tweets.append(tweet_data)
+                    builder.add(tweet_data)
+
+            timeline["complete"] = not page or not page.next_cursor
+            cursor = page.next_cursor if page else None
+            await timeline_cache.add_tweets(timeline, page_tweets, bottom_cursor=cursor, complete=timeline["complete"])
+            tweets_seen += len(page_tweets)
+
+            for thread in completed(builder.take()):
+                yield thread
+                yielded(thread)
+                if limit_reached():
+                    break
+
+        # Self-replies whose root is older than what was fetched
+        for thread in completed(builder.flush()):
+            if limit_reached():
+                break
+            yield thread
+            yielded(thread)
+
+        print(
+            f"Collected {threads_yielded} threads / {tweets_yielded} tweets ({tweets_seen} fetched in {pages_fetched} pages, "
+            f"{cached_served} from cache, {builder.dropped} follow-ups to replies skipped)"
+        )
+
+    except TooManyRequests:
+        print("Rate limit hit! Stopping tweet collection.")
+        raise
+    except Exception as e:
+        print(f"An error occurred while fetching tweets: {e}")
+        raise
+    finally:
+        sessions.release(session)
+
+async def get_user_tweets(twitterName: str, limit: int = 800):
+    """Collect the whole timeline at once (see iter_user_threads for the streaming variant)"""
+    return [thread async for thread in iter_user_threads(twitterName, limit)]
 
+async def fetch_thread(session, root_tweet_id: str):
+    """
+    One TweetDetail call: the tweet, the tweets it replies to and its
+    self-thread continuation, formatted. Returns (session, thread) since the
+    pin may move to another session.
+    """
+    print(f"Extracting thread for tweet ID: {root_tweet_id}")
+    session, root_tweet = await call_with_failover(session, "get_tweet_by_id", root_tweet_id)
+
+    # Defensive access to reply_to and thread attributes
+    reply_to_tweets = []
+    thread_tweets_list = []
+
+    try:
+        if hasattr(root_tweet, "reply_to") and root_tweet.reply_to:
+            reply_to_tweets = root_tweet.reply_to
+    except Exception as e:
+        print(f"Error accessing reply_to: {e}")
+
+    try:
+        if hasattr(root_tweet, "thread") and root_tweet.thread:
+            thread_tweets_list = root_tweet.thread
+    except Exception as e:
+        print(f"Error accessing thread: {e}")
+
+    thread_tweets = [*reply_to_tweets, root_tweet, *thread_tweets_list]
+
+    formatted_thread = []
+    for tweet in thread_tweets:
         try:
-            # Enhanced cycle detection with error handling
-            reply_to_id = None
-            reply_id = None
-            
+            tweet_text, tweet_facets = await format_tweet_text(tweet)
+
+            # Defensive access to tweet attributes
+            tweet_id = None
+            created_at = None
+
             try:
-                reply_id = reply.id if hasattr(reply, 'id') else None
+                tweet_id = tweet.id if hasattr(tweet, 'id') else None
             except Exception as e:
-                print(f"Error accessing reply.id: {e}")
-                continue
-                
-            if not reply_id:
-                print("Skipping reply without valid ID")
+                print(f"Error accessing tweet.id: {e}")
                 continue
-                
-            try:
-                if hasattr(reply, 'in_reply_to_status_id_str'):
-                    reply_to_id = reply.in_reply_to_status_id_str
-            except Exception as e:
-                print(f"Error accessing in_reply_to_status_id_str: {e}")
 
-            # Check for cycles: reply to self, reply to ancestor, or circular reference
-            if reply_to_id:
-                # Direct self-reply
-                if str(reply_to_id) == str(reply_id):
-                    print(f"Self-reply detected for tweet {reply_id}. Skipping.")
-                    continue
-
-                # Check if reply is to any tweet in current thread
-                if any(str(t["id"]) == str(reply_to_id) for t in thread):
-                    # Check if this creates a cycle by seeing if reply is already in thread
-                    if any(str(t["id"]) == str(reply_id) for t in thread):
-                        print(f"Cycle detected in reply chain for tweet {reply_id}. Skipping.")
-                        continue
-                else:
-                    # Reply is not to any tweet in our thread, skip it
-                    continue
-
-            processed_ids.add(reply_id)  # Mark as processed
-            reply_text, reply_facets = await format_tweet_text(reply)
-            
-            # Get created_at_datetime with error handling
-            reply_created_at = None
             try:
-                reply_created_at = reply.created_at_datetime if hasattr(reply, 'created_at_datetime') else None
+                created_at = tweet.created_at_datetime if hasattr(tweet, 'created_at_datetime') else None
             except Exception as e:
-                print(f"Error accessing reply created_at_datetime: {e}")
-                
-            if not reply_created_at:
-                print(f"Skipping reply {reply_id} without valid timestamp")
+                print(f"Error accessing created_at_datetime: {e}")
                 continue
-                
-            reply_data = {
-                "id": reply_id,
-                "created_at_datetime": reply_created_at,
-                "text": reply_text,
-                "facets": reply_facets,
-                "media_urls": await getMediaUrls(reply),
-                "replies": [],  # Initialize as empty
-            }
+
+            if not tweet_id or not created_at:
+                print(f"Skipping tweet without valid ID or timestamp")
+                continue
+
+            formatted_thread.append({
+                "id": tweet_id,
+                "created_at_datetime": created_at,
+                "text": tweet_text,
+                "facets": tweet_facets,
+                "media_urls": await getMediaUrls(tweet),
+                "in_reply_to": getattr(tweet, "in_reply_to", None),
+            })
         except Exception as e:
-            print(f"Error processing reply: {e}")
+            print(f"Error processing tweet in thread: {e}")
             continue
-        thread.append(reply_data)
-        # Process nested replies with incremented depth
-        await process_replies(reply_data, thread, processed_ids, depth + 1, thread_root_id)
+    return session, formatted_thread
 
-async def extract_thread(root_tweet_url: str):
-    async with migration_semaphore:
-        try:
-            match = re.search(r"status/(\d+)", root_tweet_url)
-            if not match:
-                raise ValueError("Invalid tweet URL. Could not extract tweet ID.")
-            
-            root_tweet_id = str(match.group(1))
-            print(f"Extracting thread for tweet ID: {root_tweet_id}")
+def tweet_id_from_url(url: str):
+    match = re.search(r"status/(\d+)", url or "")
+    return match.group(1) if match else None
 
-            root_tweet = await rate_limited_api_call(client.get_tweet_by_id, root_tweet_id)
-            
-            # Defensive access to reply_to and thread attributes
-            reply_to_tweets = []
-            thread_tweets_list = []
-            
-            try:
-                if hasattr(root_tweet, "reply_to") and root_tweet.reply_to:
-                    reply_to_tweets = root_tweet.reply_to
-            except Exception as e:
-                print(f"Error accessing reply_to: {e}")
-                
-            try:
-                if hasattr(root_tweet, "thread") and root_tweet.thread:
-                    thread_tweets_list = root_tweet.thread
-            except Exception as e:
-                print(f"Error accessing thread: {e}")
+async def extract_thread(root_tweet_url: str):
+    root_tweet_id = tweet_id_from_url(root_tweet_url)
+    if not root_tweet_id:
+        raise ValueError("Invalid tweet URL. Could not extract tweet ID.")
+    session = await sessions.acquire()
+    try:
+        session, thread = await fetch_thread(session, root_tweet_id)
+        return thread
+    except Exception as e:
+        print(f"An error occurred while extracting the thread: {e}")
+        raise
+    finally:
+        sessions.release(session)
 
-            thread_tweets = [*reply_to_tweets, root_tweet, *thread_tweets_list]
+async def iter_threads(thread_urls, migrating=None):
+    """
+    Yield the thread behind each URL as soon as it is extracted, skipping
+    failures. `migrating` holds the ids of tweets already being migrated
+    (shared with iter_user_threads) and is updated here: a URL into one of
+    them costs no call, and tweets already migrating are left out of the
+    threads. Threads fetched before (by the timeline or another URL) come
+    from the thread cache; the rest share one pinned session.
+    """
+    migrating = set() if migrating is None else migrating
+    tweet_ids = []
+    for url in thread_urls or []:
+        tweet_id = tweet_id_from_url(url)
+        if tweet_id:
+            tweet_ids.append(tweet_id)
+        else:
+            print(f"Error extracting thread for URL {url}: Invalid tweet URL. Could not extract tweet ID.")
+    tweet_ids = [tweet_id for tweet_id in dict.fromkeys(tweet_ids) if tweet_id not in migrating]
 
-            formatted_thread = []
-            for tweet in thread_tweets:
+    session = None
+    try:
+        for tweet_id in tweet_ids:
+            if tweet_id in migrating:
+                # Part of the thread of an earlier URL
+                continue
+            thread = tweet_cache.get_thread(tweet_id)
+            if thread is None:
+                if session is None:
+                    session = await sessions.acquire()
                 try:
-                    tweet_text, tweet_facets = await format_tweet_text(tweet)
-                    
-                    # Defensive access to tweet attributes
-                    tweet_id = None
-                    created_at = None
-                    
-                    try:
-                        tweet_id = tweet.id if hasattr(tweet, 'id') else None
-                    except Exception as e:
-                        print(f"Error accessing tweet.id: {e}")
-                        continue
-                        
-                    try:
-                        created_at = tweet.created_at_datetime if hasattr(tweet, 'created_at_datetime') else None
-                    except Exception as e:
-                        print(f"Error accessing created_at_datetime: {e}")
-                        continue
-                        
-                    if not tweet_id or not created_at:
-                        print(f"Skipping tweet without valid ID or timestamp")
-                        continue
-                    
-                    formatted_thread.append({
-                        "id": tweet_id,
-                        "created_at_datetime": created_at,
-                        "text": tweet_text,
-                        "facets": tweet_facets,
-                        "media_urls": await getMediaUrls(tweet),
-                    })
+                    session, thread = await fetch_thread(session, tweet_id)
                 except Exception as e:
-                    print(f"Error processing tweet in thread: {e}")
+                    print(f"Error extracting thread for tweet {tweet_id}: {e}")
+                    # Continue processing other threads instead of failing entirely
                     continue
-            return formatted_thread
-
-        except Exception as e:
-            print(f"An error occurred while extracting the thread: {e}")
-            raise
+                if not thread:
+                    print(f"No thread data returned for tweet {tweet_id}")
+                    continue
+                tweet_cache.put_thread(thread)
+
+            new_tweets = [tweet for tweet in thread if str(tweet["id"]) not in migrating]
+            migrating.update(str(tweet["id"]) for tweet in thread)
+            if new_tweets:
+                yield new_tweets
+            else:
+                print(f"Thread of tweet {tweet_id} is already being migrated")
+    finally:
+        if session is not None:
+            sessions.release(session)
@@ -0,0 +1,468 @@
+"""
+TWITTER ARCHIVE IMPORT
+========================
+- Migrates from the ZIP a user downloads in Twitter's settings ("Download an
+  archive of your data") instead of the API: no Twitter budget, no session,
+  and no 3,200-tweet ceiling on the timeline
+- The upload is streamed to ARCHIVE_DIR and the ZIP is never extracted:
+  data/tweets.js (and tweets-part1.js, ...) are decompressed and parsed one
+  tweet at a time, so memory stays flat whatever the size of the archive
+- The archive lists tweets newest first, like the Replies timeline, so
+  threads are rebuilt by the same ThreadBuilder and posted while the rest of
+  the file is still being parsed
+- Photos are read from data/tweets_media/ inside the ZIP through the
+  archive:// transport mounted on the image download client; media the
+  archive doesn't hold (or a video's thumbnail) is fetched from pbs.twimg.com
+- An archive is deleted once its migration succeeds, and after
+  ARCHIVE_RETENTION_HOURS whatever happened (checked every
+  ARCHIVE_PRUNE_MINUTES); uploads that would take ARCHIVE_DIR over
+  ARCHIVE_DIR_MAX_MB are refused
+"""
+
+import asyncio
+import html
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from mediaVariants import select_variant
+from threadBuilder import ThreadBuilder, SKIPPED_REPLY
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archives")
+ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_MB", "4096")) * 1024 * 1024
+ARCHIVE_RETENTION_HOURS = float(os.getenv("ARCHIVE_RETENTION_HOURS", "24"))
+ARCHIVE_DIR_MAX_BYTES = int(os.getenv("ARCHIVE_DIR_MAX_MB", "20480")) * 1024 * 1024
+ARCHIVE_PRUNE_INTERVAL = float(os.getenv("ARCHIVE_PRUNE_MINUTES", "15")) * 60
+ARCHIVE_SCHEME = "archive://"
+PARSE_CHUNK_CHARS = 1 << 20  # Characters of tweets.js decoded per read
+PARSE_BATCH = 500  # Tweets parsed per hop to the parser thread
+MEDIA_MAX_BYTES = 64 * 1024 * 1024  # Larger archive members are not read into memory
+
+_TWEETS_FILE = re.compile(r"^data/tweets?(?:-part(\d+))?\.js$")
+_MEDIA_DIRS = ("data/tweets_media/", "data/tweet_media/")
+_STATUS_URL = re.compile(r"^https?://(?:mobile\.)?(?:twitter|x)\.com/\w+/status(?:es)?/\d+")
+_ARCHIVE_ID = re.compile(r"^[0-9a-f]{32}$")
+_CREATED_AT = "%a %b %d %H:%M:%S %z %Y"
+
+
+class ArchiveError(ValueError):
+    """Not a Twitter archive, or one this importer can't read"""
+
+
+class ArchiveStorageFull(ArchiveError):
+    """ARCHIVE_DIR has no room left for another upload"""
+
+
+def archive_path(archive_id: str, directory: str = ARCHIVE_DIR) -> Optional[str]:
+    """Path of an uploaded archive, None for an unknown or malformed id"""
+    if not archive_id or not _ARCHIVE_ID.match(archive_id):
+        return None
+    path = os.path.join(directory, f"{archive_id}.zip")
+    return path if os.path.exists(path) else None
+
+
+def stored_bytes(directory: str = ARCHIVE_DIR) -> int:
+    """Bytes held in ARCHIVE_DIR by archives and partial uploads"""
+    if not os.path.isdir(directory):
+        return 0
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith((".zip", ".zip.part")):
+            with suppress(FileNotFoundError):
+                total += entry.stat().st_size
+    return total
+
+
+# Bytes of uploads in progress not yet written to disk
+_receiving = 0
+
+
+async def save_archive(chunks, directory: str = ARCHIVE_DIR, max_bytes: int = ARCHIVE_MAX_BYTES, expected_bytes: int = 0,
+                       max_total_bytes: int = ARCHIVE_DIR_MAX_BYTES) -> Tuple[str, Dict[str, Any]]:
+    """
+    Write an uploaded archive from an async iterable of byte chunks; returns its id and summary.
+    Raises ArchiveStorageFull if it would take the directory over `max_total_bytes`.
+    """
+    global _receiving
+    os.makedirs(directory, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    # Uploads in progress count for their whole size on top of what they wrote so far, erring on the safe side
+    stored = await loop.run_in_executor(_executor, stored_bytes, directory)
+    if stored + _receiving + expected_bytes > max_total_bytes:
+        raise ArchiveStorageFull("No room for more archives right now; try again later")
+    archive_id = uuid.uuid4().hex
+    path = os.path.join(directory, f"{archive_id}.zip")
+    partial = path + ".part"
+    received = 0
+    reserved = expected_bytes
+    _receiving += reserved
+    try:
+        with open(partial, "wb") as f:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ArchiveError(f"Archive larger than {max_bytes // (1024 * 1024)} MB")
+                if received > reserved:
+                    # More than announced (or no Content-Length): reserve as it comes
+                    if stored + _receiving + received - reserved > max_total_bytes:
+                        raise ArchiveStorageFull("No room for more archives right now; try again later")
+                    _receiving += received - reserved
+                    reserved = received
+                await loop.run_in_executor(_executor, f.write, chunk)
+        summary = await loop.run_in_executor(_executor, inspect_archive, partial)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        _receiving -= reserved
+    return archive_id, {**summary, "bytes": received}
+
+
+def inspect_archive(path: str) -> Dict[str, Any]:
+    """Account and file counts of an archive; raises ArchiveError if it isn't one"""
+    if not zipfile.is_zipfile(path):
+        raise ArchiveError("Not a ZIP file")
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        parts = _tweet_parts(names)
+        if not parts:
+            raise ArchiveError("No data/tweets.js in the archive")
+        account = _read_account(zf)
+        return {
+            "username": account.get("username"),
+            "tweet_files": len(parts),
+            "media_files": sum(1 for name in names if name.startswith(_MEDIA_DIRS)),
+        }
+
+
+def prune_archives(directory: str = ARCHIVE_DIR, max_age_hours: float = ARCHIVE_RETENTION_HOURS) -> int:
+    """Delete archives (and abandoned partial uploads) older than `max_age_hours`"""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith((".zip", ".zip.part")) and os.path.getmtime(path) < cutoff:
+            archive_media.forget(name.split(".", 1)[0])
+            os.remove(path)
+            removed += 1
+    if removed:
+        print(f"Pruned {removed} old Twitter archives")
+    return removed
+
+
+async def prune_archives_periodically(interval: float = ARCHIVE_PRUNE_INTERVAL):
+    """prune_archives() every `interval` seconds, for as long as the server runs"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(_executor, prune_archives)
+        except Exception as e:
+            print(f"Pruning Twitter archives failed: {e}")
+
+
+def remove_archive(archive_id: str, directory: str = ARCHIVE_DIR):
+    path = archive_path(archive_id, directory)
+    archive_media.forget(archive_id)
+    if path:
+        os.remove(path)
+
+
+# Parsing
+
+def _tweet_parts(names: List[str]) -> List[str]:
+    """tweets.js files in order (tweets.js, tweets-part1.js, ...)"""
+    parts = []
+    for name in names:
+        match = _TWEETS_FILE.match(name)
+        if match:
+            parts.append((int(match.group(1) or 0), name))
+    return [name for _, name in sorted(parts)]
+
+
+def iter_js_array(stream: io.TextIOBase, chunk_chars: int = PARSE_CHUNK_CHARS) -> Iterator[Any]:
+    """
+    Elements of the array assigned in a `window.YTD.<name>.part0 = [ ... ]`
+    file, decoded one at a time from a text stream. Only the element being
+    decoded and one chunk of text are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = -1
+    while pos < 0:
+        chunk = stream.read(chunk_chars)
+        if not chunk:
+            return
+        buffer += chunk
+        pos = buffer.find("[")
+    pos += 1
+    eof = False
+    while True:
+        # Separators between elements
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ArchiveError("Unexpected end of tweets file")
+            chunk = stream.read(chunk_chars)
+            eof = not chunk
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The element runs past the end of the buffer (anything else fails again at the end of the file)
+            if eof:
+                raise ArchiveError("Malformed tweets file")
+            chunk = stream.read(chunk_chars)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield element
+        pos = end
+
+
+def _read_account(zf: zipfile.ZipFile) -> Dict[str, Any]:
+    try:
+        with zf.open("data/account.js") as raw:
+            for entry in iter_js_array(io.TextIOWrapper(raw, encoding="utf-8-sig")):
+                return entry.get("account") or {}
+    except KeyError:
+        pass
+    return {}
+
+
+def _is_repost(tweet: Dict[str, Any], text: str) -> bool:
+    if text.startswith("RT @") or tweet.get("retweeted_status") or tweet.get("is_quote_status"):
+        return True
+    # Archives without the quote flag: a quote ends with the link to the quoted tweet
+    urls = (tweet.get("entities") or {}).get("urls") or []
+    if not urls or not urls[-1].get("url") or not _STATUS_URL.match(urls[-1].get("expanded_url") or ""):
+        return False
+    return text.rstrip().endswith(urls[-1]["url"])
+
+
+def format_archive_text(tweet: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Display text with t.co links expanded (as link facets); leading @replies and media links dropped"""
+    text = tweet.get("full_text") or tweet.get("text") or ""
+    display = tweet.get("display_text_range")
+    if display and len(display) == 2:
+        text = text[int(display[0]):int(display[1])]
+    urls = {url.get("url"): url.get("expanded_url") for url in (tweet.get("entities") or {}).get("urls") or [] if url.get("url")}
+
+    out = ""
+    facets = []
+    for segment in re.split(r"(https?://t\.co/\w+)", text):
+        if segment in urls and urls[segment]:
+            start = len(out.encode("utf-8"))
+            out += urls[segment]
+            facets.append({
+                "index": {"byteStart": start, "byteEnd": len(out.encode("utf-8"))},
+                "features": [{"$type": "app.bsky.richtext.facet#link", "uri": urls[segment]}],
+            })
+        elif segment.startswith("http") and segment not in urls:
+            # Media link (or a link the archive has no entity for): the media is attached instead
+            continue
+        else:
+            out += html.unescape(segment)
+    out = out.strip()
+
+    if len(out) > 297:
+        out = out[:297] + "..."
+        limit = len(out.encode("utf-8")) - 3
+        facets = [facet for facet in facets if facet["index"]["byteEnd"] <= limit]
+    return out, facets
+
+
+def _media_urls(tweet: Dict[str, Any], tweet_id: str, archive_id: str, members) -> List[str]:
+    media = (tweet.get("extended_entities") or tweet.get("entities") or {}).get("media") or []
+    urls = []
+    for item in media:
+        source = item.get("media_url_https") or item.get("media_url")
+        if not source:
+            continue
+        if item.get("type", "photo") == "photo":
+            for directory in _MEDIA_DIRS:
+                member = f"{directory}{tweet_id}-{source.rsplit('/', 1)[-1]}"
+                if member in members:
+                    urls.append(f"{ARCHIVE_SCHEME}{archive_id}/{member}")
+                    break
+            else:
+                urls.append(select_variant(item))
+        else:
+            # Videos and GIFs: their thumbnail, as for the timeline
+            urls.append(select_variant(item))
+    return urls
+
+
+def format_archive_tweet(tweet: Dict[str, Any], account_id: Optional[str], archive_id: str, members) -> Optional[Dict[str, Any]]:
+    """
+    A tweets.js entry as the dict migrateTweetsToBluesky consumes (the same
+    shape format_timeline_tweet produces, {"id", "skipped"} markers included)
+    """
+    tweet = tweet.get("tweet", tweet)
+    tweet_id = tweet.get("id_str") or (str(tweet["id"]) if tweet.get("id") else None)
+    if not tweet_id:
+        return None
+
+    reply_to_user = tweet.get("in_reply_to_user_id_str")
+    if reply_to_user and account_id and reply_to_user != account_id:
+        return {"id": tweet_id, "skipped": SKIPPED_REPLY}
+    if _is_repost(tweet, tweet.get("full_text") or ""):
+        return {"id": tweet_id, "skipped": "repost"}
+    try:
+        created_at = datetime.strptime(tweet["created_at"], _CREATED_AT)
+    except (KeyError, ValueError):
+        return {"id": tweet_id, "skipped": "invalid"}
+
+    text, facets = format_archive_text(tweet)
+    return {
+        "id": tweet_id,
+        "created_at_datetime": created_at,
+        "text": text,
+        "facets": facets,
+        "media_urls": _media_urls(tweet, tweet_id, archive_id, members),
+        "in_reply_to": tweet.get("in_reply_to_status_id_str") or None,
+    }
+
+
+class ArchiveReader:
+    """Formatted tweets of one archive, newest first; bytes_read and tweets count what has been parsed"""
+
+    def __init__(self, path: str, archive_id: str):
+        self.archive_id = archive_id
+        self._zip = zipfile.ZipFile(path)
+        self.account = _read_account(self._zip)
+        self.parts = _tweet_parts(self._zip.namelist())
+        self.bytes_total = sum(self._zip.getinfo(name).file_size for name in self.parts)
+        self.bytes_read = 0
+        self.tweets = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        members = self._zip.NameToInfo
+        account_id = self.account.get("accountId")
+        done = 0
+        for name in self.parts:
+            with self._zip.open(name) as raw:
+                for entry in iter_js_array(io.TextIOWrapper(raw, encoding="utf-8-sig")):
+                    # Decompressed position (the text layer reads a chunk ahead)
+                    self.bytes_read = done + raw.tell()
+                    tweet = format_archive_tweet(entry, account_id, self.archive_id, members)
+                    if tweet:
+                        self.tweets += 1
+                        yield tweet
+            done += self._zip.getinfo(name).file_size
+            self.bytes_read = done
+
+    def close(self):
+        self._zip.close()
+
+
+async def iter_archive_threads(archive_id: str, limit: int = 800, migrating=None):
+    """
+    Yield threads (newest first) from an uploaded archive as it is parsed,
+    like iter_user_threads: `limit` counts tweets (0 = everything), a thread
+    is never cut, and the ids of yielded tweets go to `migrating`.
+    """
+    path = archive_path(archive_id)
+    if path is None:
+        raise ArchiveError(f"Unknown Twitter archive {archive_id}")
+    loop = asyncio.get_running_loop()
+    reader = await loop.run_in_executor(_executor, ArchiveReader, path, archive_id)
+    print(f"Reading Twitter archive {archive_id} of @{reader.account.get('username')} ({reader.bytes_total / 1e6:.1f} MB of tweets) with limit {limit}...")
+    tweets = iter(reader)
+    builder = ThreadBuilder()
+    tweets_yielded = 0
+    started = time.monotonic()
+
+    def next_batch():
+        return [tweet for _, tweet in zip(range(PARSE_BATCH), tweets)]
+
+    try:
+        while not (limit and tweets_yielded >= limit):
+            # Parsing runs off the event loop, a batch at a time
+            batch = await loop.run_in_executor(_executor, next_batch)
+            for tweet in batch:
+                builder.add(tweet)
+            threads = builder.take() if batch else builder.flush()
+            for thread in threads:
+                yield thread
+                tweets_yielded += len(thread)
+                if migrating is not None:
+                    migrating.update(str(tweet["id"]) for tweet in thread)
+                if limit and tweets_yielded >= limit:
+                    break
+            if not batch:
+                break
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(
+            f"Collected {builder.threads} threads / {tweets_yielded} tweets from the archive: parsed {reader.tweets} tweets, "
+            f"{reader.bytes_read / 1e6:.1f} MB in {elapsed:.1f}s ({reader.tweets / elapsed:.0f} tweets/s, "
+            f"{reader.bytes_read / 1e6 / elapsed:.1f} MB/s), {builder.dropped} follow-ups to replies skipped"
+        )
+    finally:
+        await loop.run_in_executor(_executor, reader.close)
+
+
+# Media
+
+class ArchiveMediaTransport(httpx.AsyncBaseTransport):
+    """Serves archive://<archive id>/data/tweets_media/... from the uploaded ZIP"""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._open: Dict[str, zipfile.ZipFile] = {}
+        self._lock = threading.Lock()
+
+    def _read(self, archive_id: str, member: str) -> Optional[bytes]:
+        with self._lock:
+            zf = self._open.get(archive_id)
+            if zf is None:
+                path = archive_path(archive_id, self.directory)
+                if path is None:
+                    return None
+                # Reading the central directory of a large archive is not free: keep it open for the migration
+                zf = self._open[archive_id] = zipfile.ZipFile(path)
+        info = zf.NameToInfo.get(member)
+        if info is None or info.file_size > MEDIA_MAX_BYTES:
+            return None
+        return zf.read(info)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        archive_id = request.url.host
+        member = request.url.path.lstrip("/")
+        data = None
+        if member.startswith(_MEDIA_DIRS):
+            data = await asyncio.get_running_loop().run_in_executor(_media_executor, self._read, archive_id, member)
+        if data is None:
+            return httpx.Response(404, request=request)
+        return httpx.Response(200, content=data, request=request)
+
+    def forget(self, archive_id: str):
+        with self._lock:
+            zf = self._open.pop(archive_id, None)
+        if zf is not None:
+            zf.close()
+
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="archive")
+_media_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="archive-media")
+archive_media = ArchiveMediaTransport()
@@ -0,0 +1,176 @@
+"""
+HEADER-DRIVEN TWITTER PACING
+==============================
+- Every response carries x-rate-limit-limit / -remaining / -reset; an
+  httpx response hook records them per GraphQL operation
+- Calls are spread evenly over the time left until the real reset, with a
+  small burst allowance so short migrations are not slowed down
+- When the budget is exhausted we sleep until the reported reset, not for
+  a fixed 15 minutes
+- Before the first response for an endpoint, its documented 15-minute
+  budget is assumed
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Dict, Optional
+
+WINDOW_SECONDS = 15 * 60
+# Calls per endpoint we never use, so concurrent sessions or clock skew can't tip us over
+PACE_RESERVE = int(os.getenv("TWITTER_PACE_RESERVE", "2"))
+# Calls that may go out back-to-back before even spacing applies
+PACE_BURST = int(os.getenv("TWITTER_PACE_BURST", "5"))
+# Slack added after the reported reset time
+RESET_MARGIN = float(os.getenv("TWITTER_RESET_MARGIN", "2"))
+
+# Documented 15-minute budgets, used until the server tells us otherwise
+DEFAULT_LIMITS = {
+    "TweetDetail": 150,
+    "UserByScreenName": 95,
+    "UserTweets": 50,
+    "UserTweetsAndReplies": 50,
+    "default": 50,
+}
+
+# twikit method names -> GraphQL operation they call
+FUNCTION_ENDPOINTS = {
+    "get_tweet_by_id": "TweetDetail",
+    "get_user_by_screen_name": "UserByScreenName",
+    "get_user_tweets": "UserTweets",
+    "get_tweets": "UserTweets",
+}
+
+_GRAPHQL_OPERATION = re.compile(r"/graphql/[^/]+/([A-Za-z]+)")
+
+
+def endpoint_from_url(url: str) -> Optional[str]:
+    match = _GRAPHQL_OPERATION.search(url)
+    return match.group(1) if match else None
+
+
+class EndpointPacer:
+    """Paces calls to one endpoint from the server-reported remaining budget and reset time"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = time.time() + WINDOW_SECONDS
+        self.next_slot = 0.0
+        self.in_flight = 0
+        self.observed = False
+        self.calls = 0
+        self.waited = 0.0
+
+    def _roll_window(self, now: float):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + WINDOW_SECONDS
+            self.next_slot = 0.0
+
+    def reserve(self) -> float:
+        """Claim the next call slot and return how long to sleep before using it"""
+        now = time.time()
+        self._roll_window(now)
+        self.in_flight += 1
+        self.calls += 1
+
+        # `remaining` is as last reported; the other calls in flight are not counted in it yet
+        others = self.in_flight - 1
+        available = self.remaining - others - PACE_RESERVE
+        if available <= 0:
+            # Exhausted: the next slot is right after the reset
+            start = self.reset_at + RESET_MARGIN
+            self.remaining = self.limit
+            self.reset_at = start + WINDOW_SECONDS
+            self.next_slot = start
+            available = self.remaining - others - PACE_RESERVE
+        else:
+            start = now
+
+        interval = max(self.reset_at - start, 0) / max(available, 1)
+        slot = max(self.next_slot - PACE_BURST * interval, start)
+        self.next_slot = max(self.next_slot, start) + interval
+        return max(slot - now, 0.0)
+
+    def release(self):
+        self.in_flight = max(self.in_flight - 1, 0)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset_at: Optional[float]):
+        """Adopt the values from response headers (the server is authoritative)"""
+        if limit:
+            self.limit = limit
+        if reset_at:
+            if reset_at != self.reset_at:
+                self.next_slot = min(self.next_slot, reset_at)
+            self.reset_at = reset_at
+        if remaining is not None:
+            self.remaining = remaining
+        self.observed = True
+
+    def exhausted(self, reset_at: Optional[float]):
+        """A 429: nothing left until reset_at (or a full window if unknown)"""
+        self.observe(None, 0, reset_at or time.time() + WINDOW_SECONDS)
+
+    def status(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset_in": round(max(self.reset_at - time.time(), 0), 1),
+            "in_flight": self.in_flight,
+            "observed": self.observed,
+            "calls": self.calls,
+            "waited": round(self.waited, 1),
+        }
+
+
+class TwitterPacer:
+    """Per-endpoint pacers for one Twitter session"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointPacer] = {}
+
+    def get(self, endpoint: str) -> EndpointPacer:
+        pacer = self.endpoints.get(endpoint)
+        if pacer is None:
+            limit = DEFAULT_LIMITS.get(endpoint, DEFAULT_LIMITS["default"])
+            pacer = self.endpoints[endpoint] = EndpointPacer(endpoint, limit)
+        return pacer
+
+    async def wait(self, endpoint: str):
+        pacer = self.get(endpoint)
+        delay = pacer.reserve()
+        if delay > 0:
+            pacer.waited += delay
+            if delay >= 60:
+                print(f"PACING: waiting {delay:.0f}s for the next {endpoint} slot")
+            await asyncio.sleep(delay)
+
+    def release(self, endpoint: str):
+        self.get(endpoint).release()
+
+    def record_headers(self, endpoint: str, headers):
+        remaining = headers.get("x-rate-limit-remaining")
+        if remaining is None:
+            return
+        limit = headers.get("x-rate-limit-limit")
+        reset = headers.get("x-rate-limit-reset")
+        self.get(endpoint).observe(
+            int(limit) if limit else None,
+            int(remaining),
+            float(reset) if reset else None,
+        )
+
+    def attach(self, http_client):
+        """Record rate limit headers from every response of an httpx.AsyncClient"""
+        async def on_response(response):
+            endpoint = endpoint_from_url(str(response.request.url))
+            if endpoint:
+                self.record_headers(endpoint, response.headers)
+
+        http_client.event_hooks["response"].append(on_response)
+
+    def status(self) -> Dict[str, Dict]:
+        return {name: pacer.status() for name, pacer in self.endpoints.items()}
@@ -0,0 +1,150 @@
+"""
+TWITTER SESSION POOL
+======================
+- One twikit Client per cookie file (TWITTER_COOKIE_FILES, comma separated)
+- Every session has its own header-driven pacer and its own lock, so each
+  account still makes a single request at a time
+- A fetch is pinned to the least busy healthy session; N accounts fetch N
+  timelines concurrently
+- Quarantine mode: a session that gets a 429 is parked until its reported
+  reset, one that gets an auth error (expired/locked cookies) is parked for
+  TWITTER_AUTH_QUARANTINE seconds and reloads its cookie file afterwards
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from twikit import Client
+from twikit.errors import AccountLocked, AccountSuspended, Forbidden, Unauthorized
+
+from twitterPacer import TwitterPacer
+
+load_dotenv()
+
+TWITTER_COOKIE_FILES = [f.strip() for f in os.getenv("TWITTER_COOKIE_FILES", "cookies.json").split(",") if f.strip()]
+QUARANTINE_ENABLED = os.getenv("TWITTER_QUARANTINE", "on").lower() not in ("0", "off", "false", "no")
+AUTH_QUARANTINE_SECONDS = float(os.getenv("TWITTER_AUTH_QUARANTINE", "3600"))
+RATE_LIMIT_QUARANTINE_SECONDS = 15 * 60  # When a 429 carries no reset time
+
+AUTH_ERRORS = (Unauthorized, Forbidden, AccountLocked, AccountSuspended)
+
+
+class SessionQuarantined(Exception):
+    """The session was parked mid-call; retry the work on another session"""
+
+    def __init__(self, session: "TwitterSession", reason: str):
+        super().__init__(f"Twitter session {session.name} quarantined ({reason})")
+        self.session = session
+        self.reason = reason
+
+
+class NoTwitterSessions(RuntimeError):
+    pass
+
+
+class TwitterSession:
+    def __init__(self, name: str, cookie_file: str):
+        self.name = name
+        self.cookie_file = cookie_file
+        self.client = Client(language="en-US")
+        self.client.load_cookies(cookie_file)
+        self.pacer = TwitterPacer()
+        self.pacer.attach(self.client.http)
+        self.lock = asyncio.Lock()  # One request at a time per account
+        self.active_fetches = 0
+        self.quarantined_until = 0.0
+        self.quarantine_reason: Optional[str] = None
+        self.metrics = {
+            "calls": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "auth_errors": 0,
+            "quarantines": 0,
+            "fetches": 0,
+            "last_error": None,
+        }
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.quarantined_until
+
+    def reload_cookies(self):
+        try:
+            self.client.load_cookies(self.cookie_file)
+        except Exception as e:
+            print(f"Could not reload cookies for Twitter session {self.name}: {e}")
+
+    def status(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "quarantine_reason": self.quarantine_reason if not self.healthy else None,
+            "quarantined_for": round(max(self.quarantined_until - time.time(), 0), 1),
+            "active_fetches": self.active_fetches,
+            **self.metrics,
+            "endpoints": self.pacer.status(),
+        }
+
+
+class TwitterSessionPool:
+    def __init__(self, cookie_files: List[str] = TWITTER_COOKIE_FILES, quarantine: bool = QUARANTINE_ENABLED):
+        self.quarantine_enabled = quarantine
+        self.sessions: List[TwitterSession] = []
+        for i, cookie_file in enumerate(cookie_files):
+            try:
+                self.sessions.append(TwitterSession(f"session-{i}", cookie_file))
+            except Exception as e:
+                print(f"Skipping Twitter cookie file {cookie_file}: {e}")
+        if not self.sessions:
+            raise NoTwitterSessions(f"No usable Twitter cookie files in {cookie_files}")
+        print(f"Twitter session pool ready with {len(self.sessions)} session(s)")
+
+    async def acquire(self) -> TwitterSession:
+        """
+        Pin the least busy healthy session for one fetch (release() when
+        done). Waits for the earliest quarantine to end if every session is parked.
+        """
+        while True:
+            healthy = [s for s in self.sessions if s.healthy]
+            if healthy:
+                session = min(healthy, key=lambda s: (s.active_fetches, s.metrics["calls"]))
+                session.active_fetches += 1
+                session.metrics["fetches"] += 1
+                return session
+
+            wait = min(s.quarantined_until for s in self.sessions) - time.time()
+            print(f"All Twitter sessions are quarantined; waiting {wait:.0f}s")
+            await asyncio.sleep(max(wait, 0.1))
+
+    def release(self, session: TwitterSession):
+        session.active_fetches = max(session.active_fetches - 1, 0)
+
+    def quarantine(self, session: TwitterSession, reason: str, until: float):
+        session.quarantined_until = max(session.quarantined_until, until)
+        session.quarantine_reason = reason
+        session.metrics["quarantines"] += 1
+        print(f"Twitter session {session.name} quarantined for {until - time.time():.0f}s ({reason})")
+        if reason == "auth":
+            # Give an operator the chance to drop fresh cookies in place
+            asyncio.get_running_loop().call_later(max(until - time.time(), 0), session.reload_cookies)
+
+    def record_error(self, session: TwitterSession, error: Exception, rate_limited: bool = False, reset_at: Optional[float] = None):
+        """Account for a failed call; returns True if the session was quarantined"""
+        session.metrics["errors"] += 1
+        session.metrics["last_error"] = f"{type(error).__name__}: {error}"[:200]
+        if isinstance(error, AUTH_ERRORS):
+            session.metrics["auth_errors"] += 1
+            if self.quarantine_enabled:
+                self.quarantine(session, "auth", time.time() + AUTH_QUARANTINE_SECONDS)
+                return True
+        elif rate_limited:
+            session.metrics["rate_limited"] += 1
+            if self.quarantine_enabled:
+                self.quarantine(session, "rate_limited", reset_at or time.time() + RATE_LIMIT_QUARANTINE_SECONDS)
+                return True
+        return False
+
+    def status(self) -> Dict[str, Dict]:
+        return {s.name: s.status() for s in self.sessions}
@@ -2,10 +2,44 @@ import { prisma } from '@/lib/prisma';
 import { NextRequest, NextResponse } from 'next/server';
 import nodemailer from 'nodemailer';
 
+type Notification = {
+    migrationId: string;
+    twitterName?: string;
+    bskyHandle?: string;
+    did?: string;
+    task_type?: string;
+    success: boolean;
+    error_message?: string | null;
+};
+
+// The backend sends { notifications: [...] } batches; a single notification body is still accepted
 export async function POST(req: NextRequest) {
     const body = await req.json();
 
-    const data = {
+    if (!Array.isArray(body["notifications"])) {
+        await handleNotification(toNotification(body), createTransporter());
+        return NextResponse.json({ success: true });
+    }
+
+    // One mail transporter per batch; each notification succeeds or fails on its own
+    const transporter = createTransporter();
+    const results = [];
+    for (const item of body["notifications"]) {
+        const data = toNotification(item);
+        try {
+            await handleNotification(data, transporter);
+            results.push({ migrationId: data.migrationId, success: true });
+        } catch (error) {
+            console.error(`Failed to process notification for ${data.migrationId}:`, error);
+            results.push({ migrationId: data.migrationId, success: false, error: String(error) });
+        }
+    }
+
+    return NextResponse.json({ success: results.every((result) => result.success), results });
+}
+
+function toNotification(body: any): Notification {
+    return {
         "migrationId": body["migrationId"],
         "twitterName": body["twitterName"],
         "bskyHandle": body["bskyHandle"],
@@ -14,6 +48,19 @@ export async function POST(req: NextRequest) {
         "success": body["success"],
         "error_message": body["error_message"]
     };
+}
+
+function createTransporter() {
+    return nodemailer.createTransport({
+        service: 'gmail', // Or another SMTP service
+        auth: {
+            user: process.env.EMAIL_USER, // Use environment variables for security
+            pass: process.env.EMAIL_PASS,
+        },
+    });
+}
+
+async function handleNotification(data: Notification, transporter: nodemailer.Transporter) {
     console.log("Notification received: ", data);
 
     const status = data.success ? "SUCCESS" : "FAILED";
@@ -41,16 +88,6 @@ export async function POST(req: NextRequest) {
         });
     }
 
-    // Send email notification
-    const transporter = nodemailer.createTransport({
-        service: 'gmail', // Or another SMTP service
-        auth: {
-            user: process.env.EMAIL_USER, // Use environment variables for security
-            pass: process.env.EMAIL_PASS,
-        },
-    });
-
-
     const mailOptions = {
         from: process.env.EMAIL_USER,
         to: process.env.NOTIFICATION_EMAIL || process.env.EMAIL_USER, // Usar variable de entorno
@@ -74,9 +111,6 @@ A migration process has completed with the following details:
     } catch (error) {
         console.error("Failed to send notification email:", error);
     }
-
-
-    return NextResponse.json({ success: true });
 }
 
 